@@ -0,0 +1,28 @@
+"""add_user_data_keys
+
+Revision ID: i45678901234
+Revises: h34567890123
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'i45678901234'
+down_revision = 'h34567890123'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Per-user data key (wrapped by the master key) for envelope encryption of
+    # application secrets. Existing secrets are migrated lazily when read.
+    op.add_column('users', sa.Column('data_key', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    # Secrets already migrated to envelope encryption ("e1:" prefix) must be
+    # re-encrypted with the master key before downgrading
+    op.drop_column('users', 'data_key')
@@ -0,0 +1,26 @@
+"""add_global_settings_version
+
+Revision ID: j56789012345
+Revises: i45678901234
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'j56789012345'
+down_revision = 'i45678901234'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Bumped by every settings update so each worker knows when to recompile
+    # caches derived from the settings (IP range matchers)
+    op.add_column('global_settings', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('global_settings', 'version')
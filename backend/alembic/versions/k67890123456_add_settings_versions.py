@@ -0,0 +1,31 @@
+"""add_settings_versions
+
+Revision ID: k67890123456
+Revises: j56789012345
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'k67890123456'
+down_revision = 'j56789012345'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Bumped by every update so each worker knows when its cached snapshot of
+    # the configuration is stale
+    op.add_column('oidc_config', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    # password_policy is created on demand (no migration creates it)
+    if sa.inspect(op.get_bind()).has_table('password_policy'):
+        op.add_column('password_policy', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table('password_policy'):
+        op.drop_column('password_policy', 'version')
+    op.drop_column('oidc_config', 'version')
@@ -0,0 +1,47 @@
+"""add_dashboard_rollups
+
+Revision ID: l78901234567
+Revises: k67890123456
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'l78901234567'
+down_revision = 'k67890123456'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Pre-aggregated counters for the admin dashboard; fill them for existing
+    # data with `python backfill_rollups.py`
+    op.create_table(
+        'login_daily_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('success_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failure_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table(
+        'user_login_daily_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('login_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('day', 'user_id')
+    )
+    op.create_table(
+        'application_category_rollups',
+        sa.Column('category', sa.String(), nullable=False),
+        sa.Column('account_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('category')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('application_category_rollups')
+    op.drop_table('user_login_daily_rollups')
+    op.drop_table('login_daily_rollups')
@@ -0,0 +1,56 @@
+"""add_audit_log_composite_indexes
+
+Revision ID: m89012345678
+Revises: l78901234567
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'm89012345678'
+down_revision = 'l78901234567'
+branch_labels = None
+depends_on = None
+
+COMPOSITE_INDEXES = {
+    'ix_audit_logs_created_at_id': ['created_at', 'id'],
+    'ix_audit_logs_user_id_created_at': ['user_id', 'created_at', 'id'],
+    'ix_audit_logs_action_created_at': ['action', 'created_at', 'id'],
+    'ix_audit_logs_status_created_at': ['status', 'created_at', 'id'],
+}
+
+# Single-column indexes that are prefixes of the composite ones
+SINGLE_COLUMN_INDEXES = {
+    'ix_audit_logs_created_at': ['created_at'],
+    'ix_audit_logs_user_id': ['user_id'],
+    'ix_audit_logs_action': ['action'],
+}
+
+
+def _existing_indexes():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('audit_logs')}
+
+
+def upgrade() -> None:
+    # Newest-first listings filtered by user, action or status, paginated by
+    # (created_at, id), are served by an index range scan without a sort
+    existing = _existing_indexes()
+    for name, columns in COMPOSITE_INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'audit_logs', columns)
+    for name in SINGLE_COLUMN_INDEXES:
+        if name in existing:
+            op.drop_index(name, 'audit_logs')
+
+
+def downgrade() -> None:
+    existing = _existing_indexes()
+    for name, columns in SINGLE_COLUMN_INDEXES.items():
+        if name not in existing:
+            op.create_index(name, 'audit_logs', columns)
+    for name in COMPOSITE_INDEXES:
+        if name in existing:
+            op.drop_index(name, 'audit_logs')
@@ -11,19 +11,104 @@ Supports both allowlists (only specified IPs/countries) and blocklists (block sp
 """
 
 import ipaddress
-import requests
 import os
+import threading
+from array import array
+from bisect import bisect_right
 from typing import List, Dict, Optional, Tuple
 from ipaddress import IPv4Network, IPv6Network
 
+from .geoip import geoip_provider
+
+
+class CompiledRanges:
+    """
+    A list of CIDR ranges compiled for fast lookups.
+
+    Each range becomes an integer interval [start, end], kept sorted by start
+    in separate IPv4 (array) and IPv6 (list) tables. A lookup is a binary
+    search for the last range starting at or before the address; if that
+    range ends before the address, the search follows the chain of ranges
+    enclosing it (CIDR ranges are either nested or disjoint), so the most
+    specific matching range is found in O(log n) plus the nesting depth.
+    """
+
+    __slots__ = ("v4", "v6", "size")
+
+    def __init__(self, cidrs: List[str]):
+        intervals = {4: [], 6: []}
+        for cidr in cidrs or []:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except (ValueError, TypeError):
+                continue  # Skip invalid CIDR ranges
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), cidr)
+            )
+        self.v4 = self._build(intervals[4], lambda: array("Q"))
+        self.v6 = self._build(intervals[6], list)
+        self.size = len(intervals[4]) + len(intervals[6])
+
+    @staticmethod
+    def _build(intervals, make_table):
+        # Sorted by start, enclosing ranges before the ranges they contain
+        intervals.sort(key=lambda interval: (interval[0], -interval[1]))
+        starts, ends, parents, labels = make_table(), make_table(), array("l"), []
+        open_ranges: List[int] = []
+        for index, (start, end, cidr) in enumerate(intervals):
+            while open_ranges and ends[open_ranges[-1]] < start:
+                open_ranges.pop()
+            parents.append(open_ranges[-1] if open_ranges else -1)
+            open_ranges.append(index)
+            starts.append(start)
+            ends.append(end)
+            labels.append(cidr)
+        return starts, ends, parents, labels
+
+    def match(self, client_ip) -> Optional[str]:
+        """Return the most specific range containing an ipaddress.ip_address, or None"""
+        starts, ends, parents, labels = self.v4 if client_ip.version == 4 else self.v6
+        value = int(client_ip)
+        index = bisect_right(starts, value) - 1
+        while index >= 0:
+            if ends[index] >= value:
+                return labels[index]
+            index = parents[index]
+        return None
+
 
 class AccessRestrictions:
     """Handles IP and geographic access restrictions"""
 
     def __init__(self):
-        # Use a free geo-IP service (ipapi.co) for country lookup
-        self.geo_api_url = "http://ip-api.com/json/{}"
-        self.geo_cache = {}  # Simple in-memory cache for geo lookups
+        # Country lookups come from the local GeoIP database (see geoip)
+        self.geoip = geoip_provider
+        # (settings id, settings version) -> (blocked, allowed) compiled ranges
+        self._compiled_key = None
+        self._compiled: Optional[Tuple[CompiledRanges, CompiledRanges]] = None
+        self._compile_lock = threading.Lock()
+
+    def compiled_ranges(self, settings) -> Tuple[CompiledRanges, CompiledRanges]:
+        """
+        Blocked and allowed IP ranges of the settings, compiled.
+
+        Compiled once per settings version (GlobalSettings.version, bumped by
+        crud.update_global_settings); settings without a version are compiled
+        on every call.
+        """
+        version = getattr(settings, "version", None)
+        if version is None:
+            return CompiledRanges(settings.blocked_ip_ranges), CompiledRanges(settings.allowed_ip_ranges)
+        key = (getattr(settings, "id", None), version)
+        compiled = self._compiled
+        if self._compiled_key == key and compiled is not None:
+            return compiled
+        with self._compile_lock:
+            if self._compiled_key != key:
+                self._compiled = (CompiledRanges(settings.blocked_ip_ranges),
+                                  CompiledRanges(settings.allowed_ip_ranges))
+                self._compiled_key = key
+            return self._compiled
 
     def check_ip_restrictions(self, ip_address: str, settings) -> Tuple[bool, Optional[str]]:
         """
@@ -39,24 +124,17 @@ class AccessRestrictions:
         except ValueError:
             return False, "Invalid IP address format"
 
+        blocked, allowed = self.compiled_ranges(settings)
+
         # Check blocked IP ranges first
-        for cidr in settings.blocked_ip_ranges or []:
-            try:
-                network = ipaddress.ip_network(cidr, strict=False)
-                if client_ip in network:
-                    return False, f"IP address {ip_address} is in blocked range {cidr}"
-            except ValueError:
-                continue  # Skip invalid CIDR ranges
+        cidr = blocked.match(client_ip)
+        if cidr is not None:
+            return False, f"IP address {ip_address} is in blocked range {cidr}"
 
         # If allowlist is configured, IP must be in allowed ranges
         if settings.allowed_ip_ranges:
-            for cidr in settings.allowed_ip_ranges:
-                try:
-                    network = ipaddress.ip_network(cidr, strict=False)
-                    if client_ip in network:
-                        return True, None
-                except ValueError:
-                    continue  # Skip invalid CIDR ranges
+            if allowed.match(client_ip) is not None:
+                return True, None
 
             # IP not in any allowed range
             return False, f"IP address {ip_address} is not in allowed ranges"
@@ -111,32 +189,10 @@ class AccessRestrictions:
 
     def _get_country_code(self, ip_address: str) -> Optional[str]:
         """
-        Get country code for IP address using ip-api.com
+        Get country code for IP address from the offline GeoIP database
         Returns ISO 3166-1 alpha-2 country code or None if lookup fails
         """
-        # Check cache first
-        if ip_address in self.geo_cache:
-            return self.geo_cache[ip_address]
-
-        try:
-            response = requests.get(self.geo_api_url.format(ip_address), timeout=3)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get('status') == 'success':
-                country_code = data.get('countryCode')
-                # Cache the result
-                self.geo_cache[ip_address] = country_code
-                return country_code
-            else:
-                # Cache failure to avoid repeated requests
-                self.geo_cache[ip_address] = None
-                return None
-
-        except (requests.RequestException, ValueError, KeyError):
-            # Cache failure to avoid repeated requests
-            self.geo_cache[ip_address] = None
-            return None
+        return self.geoip.country_code(ip_address)
 
     def validate_cidr_ranges(self, cidr_list: List[str]) -> List[str]:
         """
@@ -0,0 +1,532 @@
+"""
+Audit Log Archive Module
+
+Retention for audit_logs: rows older than AUDIT_RETENTION_DAYS are moved out
+of the database into append-only, compressed segment files, keeping the hot
+table (and every query, count and export over it) small. Archived rows stay
+searchable through search().
+
+Layout under AUDIT_ARCHIVE_DIR, one or more segments per UTC day:
+
+    2026/01/audit-2026-01-15-<first id>-<last id>.ndjson.gz    rows, oldest first
+    2026/01/audit-2026-01-15-<first id>-<last id>.idx.json     sidecar index
+
+- A segment is a sequence of gzip members (blocks of AUDIT_ARCHIVE_BLOCK_ROWS
+  NDJSON rows), so it is still a valid .gz file, and a single block can be
+  read on its own
+- The sidecar holds the segment's time range, action set and user id range,
+  plus each block's byte offset, time range and user id range; searches skip
+  whole segments and blocks using it and decompress one block at a time
+- Segments are written to temporary files and the sidecar is renamed into
+  place last, so a segment without a sidecar is ignored (and rewritten by the
+  next run); rows are deleted only after their segment is in place, in
+  chunks of AUDIT_ARCHIVE_CHUNK_SIZE with a commit per chunk
+- A run that stopped between archiving and deleting a day resumes by
+  deleting the rows its sidecar already covers instead of archiving them
+  twice
+- AUDIT_RETENTION_DAYS=0 (default) disables the background job; archive
+  manually with archive_audit_logs.py
+- Only one process archives at a time (a lock file in the archive directory)
+"""
+
+import gzip
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, time as day_time, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, not_, or_, select
+from sqlalchemy.orm import Session
+
+from . import models
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on a single archiving process
+    fcntl = None
+
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "0"))
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", os.path.join(_BACKEND_DIR, "audit_archive"))
+AUDIT_ARCHIVE_INTERVAL_HOURS = float(os.getenv("AUDIT_ARCHIVE_INTERVAL_HOURS", "24"))
+AUDIT_ARCHIVE_CHUNK_SIZE = int(os.getenv("AUDIT_ARCHIVE_CHUNK_SIZE", "5000"))
+AUDIT_ARCHIVE_BLOCK_ROWS = int(os.getenv("AUDIT_ARCHIVE_BLOCK_ROWS", "1000"))
+
+SEGMENT_SUFFIX = ".ndjson.gz"
+INDEX_SUFFIX = ".idx.json"
+
+_COLUMNS = ("id", "user_id", "action", "resource_type", "resource_id", "ip_address",
+            "user_agent", "status", "reason", "details", "created_at")
+
+
+def _row_record(row) -> Dict[str, Any]:
+    record = dict(zip(_COLUMNS, row))
+    record["created_at"] = record["created_at"].isoformat()
+    return record
+
+
+def _range_update(summary: Dict[str, Any], record: Dict[str, Any]):
+    """Widen a block/segment summary (time and user id range) to include a record"""
+    summary["rows"] += 1
+    summary["start"] = min(summary["start"] or record["created_at"], record["created_at"])
+    summary["end"] = max(summary["end"] or record["created_at"], record["created_at"])
+    user_id = record["user_id"]
+    if user_id is not None:
+        summary["user_id_min"] = user_id if summary["user_id_min"] is None else min(summary["user_id_min"], user_id)
+        summary["user_id_max"] = user_id if summary["user_id_max"] is None else max(summary["user_id_max"], user_id)
+    else:
+        summary["has_null_user"] = True
+
+
+def _new_summary() -> Dict[str, Any]:
+    return {"rows": 0, "start": None, "end": None, "user_id_min": None, "user_id_max": None,
+            "has_null_user": False}
+
+
+def _may_contain_user(summary: Dict[str, Any], user_id: Optional[int]) -> bool:
+    if user_id is None:
+        return True
+    low, high = summary.get("user_id_min"), summary.get("user_id_max")
+    return low is not None and low <= user_id <= high
+
+
+def _covered(indexes: List[Dict[str, Any]]):
+    """
+    Rows stored in these segments. A segment holds every row of its day with
+    an id in its id range, up to its last timestamp, that existed when it was
+    written; audit rows are never inserted with a past timestamp.
+    """
+    log = models.AuditLog
+    return or_(*(
+        and_(log.id.between(index["min_id"], index["max_id"]),
+             log.created_at <= datetime.fromisoformat(index["end"]))
+        for index in indexes
+    ))
+
+
+class _Newest:
+    """Heap entry key ordering (created_at, id) newest first"""
+
+    __slots__ = ("key",)
+
+    def __init__(self, key: Tuple[str, int]):
+        self.key = key
+
+    def __lt__(self, other: "_Newest") -> bool:
+        return self.key > other.key
+
+
+def _overlaps(summary: Dict[str, Any], start: Optional[str], end: Optional[str]) -> bool:
+    return (start is None or summary["end"] >= start) and (end is None or summary["start"] <= end)
+
+
+class SegmentWriter:
+    """Writes one segment (blocks of gzip-compressed NDJSON) and its sidecar index"""
+
+    def __init__(self, directory: str, day: datetime, block_rows: int = AUDIT_ARCHIVE_BLOCK_ROWS):
+        self.directory = directory
+        self.day = day
+        self.block_rows = max(1, block_rows)
+        self.temp_path = os.path.join(directory, f".audit-{day:%Y-%m-%d}-{os.getpid()}{SEGMENT_SUFFIX}.tmp")
+        self._file = open(self.temp_path, "wb")
+        self._block: List[str] = []
+        self._block_summary = _new_summary()
+        self.summary = _new_summary()
+        self.summary.update({"min_id": None, "max_id": None})
+        self.actions = set()
+        self.blocks: List[Dict[str, Any]] = []
+
+    def add(self, record: Dict[str, Any]):
+        self._block.append(json.dumps(record, default=str, separators=(",", ":")))
+        _range_update(self._block_summary, record)
+        _range_update(self.summary, record)
+        row_id = record["id"]
+        self.summary["min_id"] = row_id if self.summary["min_id"] is None else min(self.summary["min_id"], row_id)
+        self.summary["max_id"] = row_id if self.summary["max_id"] is None else max(self.summary["max_id"], row_id)
+        if record["action"] is not None:
+            self.actions.add(record["action"])
+        if len(self._block) >= self.block_rows:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        data = gzip.compress(("\n".join(self._block) + "\n").encode(), compresslevel=6, mtime=0)
+        offset = self._file.tell()
+        self._file.write(data)
+        self.blocks.append(dict(self._block_summary, offset=offset, length=len(data)))
+        self._block = []
+        self._block_summary = _new_summary()
+
+    def commit(self) -> Dict[str, Any]:
+        """Move the segment into place and write its sidecar. Returns the sidecar."""
+        self._flush_block()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        name = f"audit-{self.day:%Y-%m-%d}-{self.summary['min_id']}-{self.summary['max_id']}"
+        index = dict(self.summary, format=1, segment=name + SEGMENT_SUFFIX, day=f"{self.day:%Y-%m-%d}",
+                     actions=sorted(self.actions), blocks=self.blocks)
+        os.replace(self.temp_path, os.path.join(self.directory, name + SEGMENT_SUFFIX))
+        index_temp = os.path.join(self.directory, f".{name}{INDEX_SUFFIX}.tmp")
+        with open(index_temp, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(index_temp, os.path.join(self.directory, name + INDEX_SUFFIX))
+        return index
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class AuditArchiver:
+    """Moves old audit logs into segment files and searches them"""
+
+    def __init__(self, directory: str = AUDIT_ARCHIVE_DIR, retention_days: int = AUDIT_RETENTION_DAYS,
+                 chunk_size: int = AUDIT_ARCHIVE_CHUNK_SIZE, block_rows: int = AUDIT_ARCHIVE_BLOCK_ROWS,
+                 interval_hours: float = AUDIT_ARCHIVE_INTERVAL_HOURS, session_factory=None):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.chunk_size = max(1, chunk_size)
+        self.block_rows = block_rows
+        self.interval = interval_hours * 3600
+        self.session_factory = session_factory
+        # sidecar path -> (mtime, index)
+        self._indexes: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._index_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.runs = 0
+        self.rows_archived = 0
+        self.rows_deleted = 0
+        self.segments_written = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    # Archiving
+
+    def archive(self, db: Session, older_than_days: Optional[int] = None,
+                now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Archive and delete audit logs older than the retention period.
+
+        Returns:
+            Summary of the run (cutoff, days, rows archived and deleted, segments)
+        """
+        days = self.retention_days if older_than_days is None else older_than_days
+        if days <= 0:
+            raise ValueError("Retention period must be at least one day")
+        cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+        os.makedirs(self.directory, exist_ok=True)
+
+        summary = {"cutoff": cutoff.isoformat(), "days": 0, "rows_archived": 0, "rows_deleted": 0,
+                   "segments": [], "skipped": False}
+        lock = self._acquire_lock()
+        if lock is False:
+            summary["skipped"] = True
+            return summary
+        started = time.perf_counter()
+        try:
+            day_start = self._next_day(db, None, cutoff)
+            while day_start is not None:
+                day_end = min(day_start + timedelta(days=1), cutoff)
+                archived, deleted, segment = self._archive_day(db, day_start, day_end)
+                summary["days"] += 1
+                summary["rows_archived"] += archived
+                summary["rows_deleted"] += deleted
+                if segment:
+                    summary["segments"].append(segment)
+                day_start = self._next_day(db, day_end, cutoff)
+        finally:
+            if lock:
+                lock.close()
+        summary["seconds"] = round(time.perf_counter() - started, 2)
+        self.runs += 1
+        self.rows_archived += summary["rows_archived"]
+        self.rows_deleted += summary["rows_deleted"]
+        self.segments_written += len(summary["segments"])
+        self.last_run = {key: value for key, value in summary.items() if key != "segments"}
+        return summary
+
+    def _acquire_lock(self):
+        """Open lock file (None without fcntl), or False if another process holds it"""
+        if fcntl is None:
+            return None
+        lock = open(os.path.join(self.directory, ".archive.lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        return lock
+
+    @staticmethod
+    def _next_day(db: Session, after: Optional[datetime], cutoff: datetime) -> Optional[datetime]:
+        """Midnight of the first day at or after `after` with rows older than the cutoff"""
+        query = db.query(func.min(models.AuditLog.created_at)).filter(models.AuditLog.created_at < cutoff)
+        if after is not None:
+            query = query.filter(models.AuditLog.created_at >= after)
+        first = query.scalar()
+        if first is None:
+            return None
+        if isinstance(first, str):  # func.min loses the DateTime type on SQLite
+            first = datetime.fromisoformat(first)
+        return datetime.combine(first.date(), day_time())
+
+    def _archive_day(self, db: Session, day_start: datetime, day_end: datetime) -> Tuple[int, int, Optional[str]]:
+        """Archive one day's rows (before day_end) into a segment, then delete them"""
+        log = models.AuditLog
+        in_day = (log.created_at >= day_start, log.created_at < day_end)
+        directory = os.path.join(self.directory, f"{day_start:%Y}", f"{day_start:%m}")
+        os.makedirs(directory, exist_ok=True)
+
+        # Segments of earlier runs; their rows are not archived again, only
+        # deleted if a previous run stopped before deleting them
+        indexes = self._day_indexes(directory, day_start)
+
+        stmt = select(*(getattr(log, column) for column in _COLUMNS)).where(*in_day)
+        if indexes:
+            stmt = stmt.where(not_(_covered(indexes)))
+        stmt = stmt.order_by(log.created_at, log.id).execution_options(yield_per=self.chunk_size)
+
+        writer = SegmentWriter(directory, day_start, self.block_rows)
+        index = None
+        try:
+            result = db.execute(stmt)
+            for row in result:
+                writer.add(_row_record(row))
+            result.close()
+            if writer.summary["rows"]:
+                index = writer.commit()
+                self._load_index(os.path.join(directory, index["segment"][:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX))
+                indexes.append(index)
+            else:
+                writer.abort()
+        except Exception:
+            writer.abort()
+            db.rollback()
+            raise
+        db.rollback()  # End the read transaction before deleting
+
+        deleted = self._delete_archived(db, in_day, _covered(indexes)) if indexes else 0
+        return (index["rows"] if index else 0), deleted, (index["segment"] if index else None)
+
+    def _delete_archived(self, db: Session, in_day, covered) -> int:
+        """Delete a day's archived rows in chunks, one commit per chunk"""
+        log = models.AuditLog
+        deleted = 0
+        while True:
+            ids = [row_id for (row_id,) in db.query(log.id).filter(*in_day, covered)
+                   .order_by(log.id).limit(self.chunk_size)]
+            if not ids:
+                return deleted
+            db.query(log).filter(log.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            deleted += len(ids)
+
+    # Sidecar indexes
+
+    def _load_index(self, path: str) -> Optional[Dict[str, Any]]:
+        """Sidecar at path, re-read only when the file changed"""
+        with self._index_lock:
+            try:
+                mtime = os.path.getmtime(path)
+                cached = self._indexes.get(path)
+                if cached is None or cached[0] != mtime:
+                    with open(path) as f:
+                        cached = (mtime, json.load(f))
+                    self._indexes[path] = cached
+            except (OSError, ValueError) as e:
+                print(f"Warning: skipping unreadable audit archive index {path}: {e}")
+                self._indexes.pop(path, None)
+                return None
+        return dict(cached[1], path=path[:-len(INDEX_SUFFIX)] + SEGMENT_SUFFIX)
+
+    def indexes(self) -> List[Dict[str, Any]]:
+        """Sidecar indexes of all complete segments, oldest first"""
+        paths = []
+        for root, _, files in os.walk(self.directory):
+            paths.extend(os.path.join(root, name) for name in files
+                         if name.endswith(INDEX_SUFFIX) and not name.startswith("."))
+        with self._index_lock:
+            for path in set(self._indexes) - set(paths):
+                del self._indexes[path]
+        loaded = [index for index in map(self._load_index, paths) if index is not None]
+        return sorted(loaded, key=lambda index: (index["start"], index["min_id"]))
+
+    def _day_indexes(self, directory: str, day_start: datetime) -> List[Dict[str, Any]]:
+        prefix = f"audit-{day_start:%Y-%m-%d}-"
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith(prefix) and name.endswith(INDEX_SUFFIX)]
+        return [index for index in map(self._load_index, paths) if index is not None]
+
+    # Search
+
+    def search(self, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+               user_id: Optional[int] = None, action: Optional[str] = None, limit: int = 100,
+               cursor: Optional[Tuple[datetime, int]] = None) -> List[Dict[str, Any]]:
+        """
+        Archived audit logs matching the filters, newest first.
+
+        Only segments and blocks whose sidecar ranges can match are read, one
+        block at a time. Pass the (created_at, id) of the last row returned as
+        cursor to continue (see pagination).
+        """
+        return list(self._iter_matches(start_date, end_date, user_id, action, cursor, limit))
+
+    def _iter_matches(self, start_date, end_date, user_id, action, cursor, limit) -> Iterator[Dict[str, Any]]:
+        start = start_date.isoformat() if start_date else None
+        end = end_date.isoformat() if end_date else None
+        cursor_key = None
+        if cursor is not None:
+            cursor_key = (cursor[0].isoformat(), cursor[1])
+            end = min(end, cursor_key[0]) if end else cursor_key[0]
+
+        # Segments usually follow each other in time, but can overlap (a run
+        # with a later cutoff followed by one with an earlier cutoff, or rows
+        # written late with older timestamps), so their rows are merged by
+        # (created_at, id). A segment is only opened once the newest row
+        # still to be returned could come from it.
+        pending = deque(sorted(
+            (index for index in self.indexes()
+             if _overlaps(index, start, end) and _may_contain_user(index, user_id)
+             and (action is None or action in index["actions"])),
+            key=lambda index: index["end"], reverse=True
+        ))
+        heap: List[Tuple[_Newest, int, Dict[str, Any], Iterator[Dict[str, Any]]]] = []
+        segments = []
+        order = itertools.count()
+
+        def push_next(rows: Iterator[Dict[str, Any]]):
+            record = next(rows, None)
+            if record is not None:
+                heapq.heappush(heap, (_Newest((record["created_at"], record["id"])), next(order), record, rows))
+
+        found = 0
+        try:
+            while found < limit:
+                while pending and (not heap or pending[0]["end"] >= heap[0][0].key[0]):
+                    rows = self._segment_matches(pending.popleft(), start, end, user_id, action, cursor_key)
+                    segments.append(rows)
+                    push_next(rows)
+                if not heap:
+                    return
+                _, _, record, rows = heapq.heappop(heap)
+                push_next(rows)
+                record["created_at"] = datetime.fromisoformat(record["created_at"])
+                yield record
+                found += 1
+        finally:
+            for rows in segments:
+                rows.close()
+
+    @staticmethod
+    def _segment_matches(index, start, end, user_id, action, cursor_key) -> Iterator[Dict[str, Any]]:
+        """Matching rows of one segment, newest first, decompressing one block at a time"""
+        with open(index["path"], "rb") as f:
+            for block in reversed(index["blocks"]):
+                if not _overlaps(block, start, end) or not _may_contain_user(block, user_id):
+                    continue
+                f.seek(block["offset"])
+                lines = gzip.decompress(f.read(block["length"])).decode().splitlines()
+                for line in reversed(lines):
+                    record = json.loads(line)
+                    created_at = record["created_at"]
+                    if (start and created_at < start) or (end and created_at > end):
+                        continue
+                    if cursor_key is not None and (created_at, record["id"]) >= cursor_key:
+                        continue
+                    if user_id is not None and record["user_id"] != user_id:
+                        continue
+                    if action is not None and record["action"] != action:
+                        continue
+                    yield record
+
+    # Background job
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Run archive() every AUDIT_ARCHIVE_INTERVAL_HOURS in a background thread"""
+        if self.running or self.retention_days <= 0:
+            return
+        if not self.session_factory:
+            raise ValueError("AuditArchiver requires a session factory")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-archiver", daemon=True)
+        self._thread.start()
+        print(f"[AUDIT ARCHIVE] Archiving audit logs older than {self.retention_days} days "
+              f"every {self.interval / 3600:g} hours to {self.directory}")
+
+    def stop(self, timeout: float = 10.0):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            db = self.session_factory()
+            try:
+                summary = self.archive(db)
+                if summary["rows_archived"] or summary["rows_deleted"]:
+                    print(f"[AUDIT ARCHIVE] Archived {summary['rows_archived']} and deleted "
+                          f"{summary['rows_deleted']} audit logs older than {summary['cutoff']}")
+            except Exception as e:
+                print(f"[AUDIT ARCHIVE ERROR] {e}")
+            finally:
+                db.close()
+            self._stop_event.wait(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Archive size and job counters"""
+        indexes = self.indexes()
+        return {
+            "directory": self.directory,
+            "retention_days": self.retention_days,
+            "running": self.running,
+            "segments": len(indexes),
+            "archived_rows": sum(index["rows"] for index in indexes),
+            "archived_bytes": sum(index["blocks"][-1]["offset"] + index["blocks"][-1]["length"]
+                                  for index in indexes if index["blocks"]),
+            "oldest": indexes[0]["start"] if indexes else None,
+            "newest": max(index["end"] for index in indexes) if indexes else None,
+            "runs": self.runs,
+            "rows_archived": self.rows_archived,
+            "rows_deleted": self.rows_deleted,
+            "segments_written": self.segments_written,
+            "last_run": self.last_run
+        }
+
+
+# Global audit archiver instance
+audit_archiver = AuditArchiver()
+
+
+def get_audit_archiver() -> AuditArchiver:
+    """Get the global audit archiver"""
+    return audit_archiver
+
+
+def initialize_audit_archiver(db_session_factory):
+    """Start the background retention job (if AUDIT_RETENTION_DAYS is set)"""
+    audit_archiver.session_factory = db_session_factory
+    audit_archiver.start()
+
+
+def shutdown_audit_archiver():
+    """Stop the background retention job"""
+    audit_archiver.stop()
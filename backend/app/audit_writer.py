@@ -0,0 +1,155 @@
+"""
+Audit Log Writer Module
+
+Write-behind buffer for AuditLog rows. crud.create_audit_log is called on
+almost every endpoint; instead of an INSERT + COMMIT + refresh per event,
+records are queued in memory and a background thread bulk-inserts them every
+AUDIT_BATCH_SIZE records or AUDIT_FLUSH_INTERVAL_MS milliseconds, updating the
+dashboard rollups in the same transaction. The same thread then hands each
+record to security_monitor.log_security_event.
+
+Durability:
+- AUDIT_DURABILITY=async (default) queues records; "sync" writes every
+  record in the caller's transaction, as before
+- Actions listed in AUDIT_SYNC_ACTIONS (account locks, credential, key and
+  session revocations, ...) are always written synchronously
+- The queue is bounded by AUDIT_QUEUE_SIZE records; when full,
+  AUDIT_QUEUE_FULL_POLICY either writes the record synchronously ("sync",
+  default, nothing is lost) or drops it ("drop")
+- Pending records are flushed on shutdown
+- When the writer is not running (tests, scripts) every record is written
+  synchronously
+"""
+
+import os
+import queue
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .dashboard_rollups import record_audit_events
+from .history_writer import BatchedWriter
+
+
+AUDIT_WRITER_ENABLED = os.getenv("AUDIT_WRITER_ENABLED", "true").lower() == "true"
+AUDIT_DURABILITY = os.getenv("AUDIT_DURABILITY", "async").lower()  # async or sync
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "500"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_QUEUE_FULL_POLICY = os.getenv("AUDIT_QUEUE_FULL_POLICY", "sync").lower()  # sync or drop
+
+# Security-critical actions that must be on disk before the request returns
+DEFAULT_SYNC_ACTIONS = (
+    "account_locked,account_unlocked,account_deleted,access_denied,"
+    "password_reset_completed,password_policy_updated,2fa_enabled,backup_codes_regenerated,"
+    "api_key_created,api_key_revoked,api_key_deleted,session_revoked,all_sessions_revoked,"
+    "device_revoked,webauthn_key_registered,webauthn_key_deleted,"
+    "bulk_user_import,backup_restored,backup_deleted,audit_logs_exported"
+)
+AUDIT_SYNC_ACTIONS = frozenset(
+    action.strip() for action in os.getenv("AUDIT_SYNC_ACTIONS", DEFAULT_SYNC_ACTIONS).split(",") if action.strip()
+)
+
+
+def feed_security_monitor(record: Dict[str, Any]):
+    """Pass an audit record to the security monitor for real-time analysis"""
+    try:
+        from .security_monitor import log_security_event
+        log_security_event(record["action"], record["user_id"], record["ip_address"], record["details"])
+    except ImportError:
+        # Security monitor not available, continue without it
+        pass
+    except Exception as e:
+        print(f"Security monitor error: {e}")
+
+
+class AuditWriter(BatchedWriter):
+    """Buffers AuditLog rows, bulk-inserts them in the background and feeds the security monitor"""
+
+    thread_name = "audit-writer"
+    description = "audit log"
+
+    def __init__(self, session_factory=None, durability: str = AUDIT_DURABILITY,
+                 sync_actions=AUDIT_SYNC_ACTIONS, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval_ms: int = AUDIT_FLUSH_INTERVAL_MS,
+                 max_queue_size: int = AUDIT_QUEUE_SIZE,
+                 full_policy: str = AUDIT_QUEUE_FULL_POLICY):
+        if durability not in ("async", "sync"):
+            raise ValueError(f"Unknown audit durability mode: {durability}")
+        if full_policy not in ("sync", "drop"):
+            raise ValueError(f"Unknown audit queue policy: {full_policy}")
+        super().__init__(session_factory, batch_size, flush_interval_ms, max_queue_size, full_policy)
+        self.durability = durability
+        self.sync_actions = frozenset(sync_actions)
+        self.written_sync = 0
+        self.overflowed = 0
+
+    def is_sync(self, action: Optional[str]) -> bool:
+        """Whether a record must be written in the caller's transaction"""
+        return not self.running or self.durability == "sync" or action in self.sync_actions
+
+    def enqueue(self, record: Dict[str, Any]) -> bool:
+        """
+        Queue an audit record (AuditLog column values, created_at included).
+
+        Returns False if the queue is full; the caller then writes the record
+        itself (policy "sync") or it is dropped (policy "drop").
+        """
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.full_policy == "drop":
+                self.dropped += 1
+                feed_security_monitor(record)
+            else:
+                self.overflowed += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def record_sync(self):
+        """Count a record the caller wrote in its own transaction"""
+        self.written_sync += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and throughput counters"""
+        stats = super().stats()
+        stats.update({
+            "durability": self.durability,
+            "sync_actions": len(self.sync_actions),
+            "written_sync": self.written_sync,
+            "overflowed": self.overflowed
+        })
+        return stats
+
+    def _insert(self, db: Session, rows: List[Dict[str, Any]]):
+        db.execute(insert(models.AuditLog), rows)
+        record_audit_events(db, rows)
+
+    def _after_batch(self, batch: List[Dict[str, Any]]):
+        for record in batch:
+            feed_security_monitor(record)
+
+
+# Global audit writer instance
+audit_writer = AuditWriter()
+
+
+def get_audit_writer() -> AuditWriter:
+    """Get the global audit writer instance"""
+    return audit_writer
+
+
+def initialize_audit_writer(db_session_factory):
+    """Start the background audit writer with database access"""
+    if not AUDIT_WRITER_ENABLED:
+        return
+    audit_writer.session_factory = db_session_factory
+    audit_writer.start()
+
+
+def shutdown_audit_writer():
+    """Stop the background writer and flush pending audit records"""
+    audit_writer.stop()
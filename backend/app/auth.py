@@ -1,20 +1,23 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from .database import get_db
 from . import models, crud
+from .principal_cache import Principal, attach_user, principal_cache, snapshot_user
+from .session_revocation import revocation_index
+from .password_hashing import password_hasher
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 import os
 import secrets
 import hashlib
+from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Password hashing using argon2
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Password hashing using argon2, on a bounded worker pool (see password_hashing)
+pwd_context = password_hasher.context
 
 # JWT settings
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
@@ -23,11 +26,21 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
 security = HTTPBearer()
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def hash_password(password: str, block: bool = False) -> str:
+    """
+    Hash a password on the password hashing pool.
+
+    Raises:
+        PasswordHashingBusy: If the pool's queue is full (unless block=True)
+    """
+    return password_hasher.hash(password, block=block)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Verify a password; returns (valid, new_hash) with new_hash set if the hash should be upgraded"""
+    return password_hasher.verify_and_update(plain_password, hashed_password)
 
 def hash_token(token: str) -> str:
     """Hash a token using SHA256"""
@@ -48,33 +61,87 @@ def generate_backup_codes(count: int = 10, length: int = 8) -> list[str]:
         codes.append(formatted_code)
     return codes
 
-def create_access_token(data: dict, expires_delta: timedelta = None):
+def issue_access_token(data: dict, expires_delta: timedelta = None):
+    """Create an access token; returns (token, jti, expiry) so callers need not decode it"""
     import uuid
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire, "jti": str(uuid.uuid4())})
+    jti = str(uuid.uuid4())
+    to_encode.update({"exp": expire, "jti": jti})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return encoded_jwt, jti, expire
+
+def create_access_token(data: dict, expires_delta: timedelta = None):
+    return issue_access_token(data, expires_delta)[0]
+
+def verify_access_token(token: str) -> Principal:
+    """
+    Verify an access token, reusing the principal cached for its jti.
+
+    Raises:
+        JWTError: If the token is invalid or expired
+        ValueError: If the subject is not a user ID
+    """
+    jti = jwt.get_unverified_claims(token).get("jti")
+    principal = principal_cache.get(jti, token)
+    if principal is not None:
+        return principal
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    token = credentials.credentials
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id_str: str = payload.get("sub")
+    if user_id_str is None:
+        raise JWTError("Token has no subject")
+    principal = Principal(int(user_id_str), payload.get("jti"), payload.get("exp"), token_role=payload.get("role"))
+    principal_cache.put(token, principal)
+    return principal
+
+def get_request_principal(request: Request) -> Optional[Principal]:
+    """
+    Verified principal of the request's bearer token, or None.
+
+    The result is kept on request.state, so the rate limiter and
+    get_current_user verify a token at most once per request.
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+
+    auth_header = request.headers.get("authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id_str: str = payload.get("sub")
-        if user_id_str is None:
+        principal = verify_access_token(auth_header.split(" ")[1])
+    except (JWTError, ValueError):
+        return None
+    if revocation_index.is_revoked(principal.jti):
+        return None
+    request.state.principal = principal
+    return principal
+
+def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+    principal = getattr(request.state, "principal", None)
+    if principal is None:
+        try:
+            principal = verify_access_token(credentials.credentials)
+        except JWTError as e:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user_id = int(user_id_str)
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except ValueError:
-        raise HTTPException(status_code=401, detail="Invalid user ID in token")
-    
-    user = crud.get_user(db, user_id=user_id)
+        except ValueError:
+            raise HTTPException(status_code=401, detail="Invalid user ID in token")
+        if revocation_index.is_revoked(principal.jti):
+            raise HTTPException(status_code=401, detail="Session has been revoked")
+        request.state.principal = principal
+
+    # Cached principals carry a snapshot of the user; attach it without a query
+    if principal.user_state is not None:
+        return attach_user(db, principal.user_state)
+
+    user = crud.get_user(db, user_id=principal.user_id)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    principal.user_state = snapshot_user(user)
     return user
 
 def require_admin(current_user: models.User = Depends(get_current_user)):
@@ -0,0 +1,215 @@
+"""
+Code Stream Module
+
+Server-Sent Events support for GET /api/applications/codes/stream.
+
+Instead of every client polling for new codes, each open stream subscribes
+its TOTP accounts to one shared scheduler. The scheduler groups accounts by
+period and sleeps until the next period boundary, then pushes the new codes
+of every account whose period just rolled over to the subscribed streams.
+
+- One asyncio task serves all streams, waking once per boundary
+- Secrets are decoded once into OTPKeys when the stream opens
+- Concurrent streams are limited per user (CODE_STREAM_MAX_PER_USER) and in
+  total (CODE_STREAM_MAX_TOTAL)
+- Streams close after CODE_STREAM_MAX_SECONDS so clients reconnect with a
+  fresh token and account list; account changes send a "resync" event
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .otp_engine import DEFAULT_PERIOD, OTPKey
+
+
+CODE_STREAM_MAX_PER_USER = int(os.getenv("CODE_STREAM_MAX_PER_USER", "3"))
+CODE_STREAM_MAX_TOTAL = int(os.getenv("CODE_STREAM_MAX_TOTAL", "1000"))
+CODE_STREAM_MAX_SECONDS = int(os.getenv("CODE_STREAM_MAX_SECONDS", "3600"))
+CODE_STREAM_HEARTBEAT_SECONDS = int(os.getenv("CODE_STREAM_HEARTBEAT_SECONDS", "15"))
+
+# Pending events per stream; a client this far behind only needs the latest codes
+_QUEUE_SIZE = 8
+
+
+class StreamLimitExceeded(Exception):
+    """Raised when a user or the server has too many open code streams"""
+
+
+def format_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class CodeSubscription:
+    """One open stream: a user's TOTP accounts grouped by period"""
+
+    __slots__ = ("user_id", "accounts", "queue", "loop")
+
+    def __init__(self, user_id: int, accounts: Dict[int, List[Tuple[int, OTPKey]]],
+                 loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.accounts = accounts
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        self.loop = loop
+
+    def push(self, event: str):
+        """Queue an event, dropping the oldest one if the client is falling behind"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def codes_at(self, for_time: float, periods: Optional[Sequence[int]] = None) -> Dict[str, Any]:
+        """Codes event payload (same shape as GET /codes) for the given periods"""
+        codes = []
+        for period in periods or self.accounts:
+            remaining = period - int(for_time) % period
+            for app_id, key in self.accounts.get(period, ()):
+                code, next_code = key.window(for_time, ahead=1)
+                codes.append({
+                    "id": app_id,
+                    "otp_type": "TOTP",
+                    "code": code,
+                    "next_code": next_code,
+                    "period": period,
+                    "remaining_seconds": remaining
+                })
+        return {"server_time": int(for_time), "codes": codes}
+
+
+class CodeStreamScheduler:
+    """Shared period-boundary scheduler for all open code streams"""
+
+    def __init__(self, max_per_user: int = CODE_STREAM_MAX_PER_USER,
+                 max_total: int = CODE_STREAM_MAX_TOTAL):
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self._by_period: Dict[int, Set[CodeSubscription]] = {}
+        self._by_user: Dict[int, Set[CodeSubscription]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._changed: Optional[asyncio.Event] = None
+        self.events_sent = 0
+        self.wakeups = 0
+
+    def subscribe(self, user_id: int, accounts: Sequence[Tuple[int, str, int]]) -> CodeSubscription:
+        """
+        Register a stream for a user's (app_id, secret, period) accounts.
+
+        Must be called from the event loop that will consume the stream.
+
+        Raises:
+            StreamLimitExceeded: If the per-user or total stream limit is reached
+        """
+        grouped: Dict[int, List[Tuple[int, OTPKey]]] = {}
+        for app_id, secret, period in accounts:
+            period = period or DEFAULT_PERIOD
+            grouped.setdefault(period, []).append((app_id, OTPKey(secret, period=period)))
+
+        loop = asyncio.get_running_loop()
+        subscription = CodeSubscription(user_id, grouped, loop)
+        with self._lock:
+            if len(self._by_user.get(user_id, ())) >= self.max_per_user:
+                raise StreamLimitExceeded("Too many open code streams for this user")
+            if sum(len(subs) for subs in self._by_user.values()) >= self.max_total:
+                raise StreamLimitExceeded("Too many open code streams")
+            self._by_user.setdefault(user_id, set()).add(subscription)
+            for period in grouped:
+                self._by_period.setdefault(period, set()).add(subscription)
+
+        # (Re)start the scheduler on this loop if it is not running here
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._changed = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        else:
+            self._changed.set()
+        return subscription
+
+    def unsubscribe(self, subscription: CodeSubscription):
+        """Remove a stream (idempotent)"""
+        with self._lock:
+            user_subs = self._by_user.get(subscription.user_id)
+            if user_subs is not None:
+                user_subs.discard(subscription)
+                if not user_subs:
+                    del self._by_user[subscription.user_id]
+            for period in subscription.accounts:
+                period_subs = self._by_period.get(period)
+                if period_subs is not None:
+                    period_subs.discard(subscription)
+                    if not period_subs:
+                        del self._by_period[period]
+
+    def notify_user(self, user_id: int, reason: str = "accounts_changed"):
+        """
+        Tell a user's open streams to reconnect (e.g. after accounts changed).
+
+        Safe to call from any thread.
+        """
+        with self._lock:
+            subscriptions = list(self._by_user.get(user_id, ()))
+        event = format_event("resync", {"reason": reason})
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Open streams and scheduler activity"""
+        with self._lock:
+            return {
+                "streams": sum(len(subs) for subs in self._by_user.values()),
+                "users": len(self._by_user),
+                "periods": sorted(self._by_period),
+                "max_per_user": self.max_per_user,
+                "max_total": self.max_total,
+                "wakeups": self.wakeups,
+                "events_sent": self.events_sent
+            }
+
+    async def _run(self):
+        """Sleep until the nearest period boundary, then push codes for every period that rolled over"""
+        while True:
+            with self._lock:
+                periods = list(self._by_period)
+            if not periods:
+                self._task = None
+                return
+
+            now = time.time()
+            due = {period: (int(now) // period + 1) * period for period in periods}
+            boundary = min(due.values())
+            self._changed.clear()
+            try:
+                # Wake early if a subscription with a new period arrives
+                await asyncio.wait_for(self._changed.wait(), timeout=max(0.0, boundary - now))
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            # Generate codes for the new period, not a late tick of the old one
+            for_time = max(time.time(), boundary)
+            rolled = [period for period, at in due.items() if at <= boundary]
+            self.wakeups += 1
+            with self._lock:
+                targets: Dict[CodeSubscription, List[int]] = {}
+                for period in rolled:
+                    for subscription in self._by_period.get(period, ()):
+                        targets.setdefault(subscription, []).append(period)
+            for subscription, sub_periods in targets.items():
+                subscription.push(format_event("codes", subscription.codes_at(for_time, sub_periods)))
+                self.events_sent += 1
+
+
+# Global scheduler instance
+code_stream_scheduler = CodeStreamScheduler()
+
+
+def get_code_stream_scheduler() -> CodeStreamScheduler:
+    """Get the global code stream scheduler"""
+    return code_stream_scheduler
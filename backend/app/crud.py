@@ -1,9 +1,19 @@
+from sqlalchemy import func, select, tuple_, update
 from sqlalchemy.orm import Session
 from . import models, schemas, auth
-from . import secrets_encryption
+from . import envelope_encryption
+from . import side_effects
+from .secret_cache import secret_cache
+from .history_writer import history_writer
+from .audit_writer import audit_writer, feed_security_monitor
+from .code_stream import code_stream_scheduler
+from .principal_cache import principal_cache
+from .session_revocation import revocation_index
+from .settings_cache import settings_cache, SettingsSnapshot
+from .dashboard_rollups import record_audit_events
 import os
 from dotenv import load_dotenv
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from datetime import datetime
 
 load_dotenv()
@@ -32,21 +42,33 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+def check_user_password(user: models.User, password: str) -> bool:
+    """
+    Check a local user's password.
+
+    A hash stored with outdated Argon2 parameters is replaced on the user
+    (not committed) while we have the password.
+    """
+    if not user or user.is_sso_user:
+        return False  # SSO users cannot login locally
+    valid, new_hash = auth.verify_and_update_password(password, user.password_hash)
+    if valid and new_hash:
+        user.password_hash = new_hash
+    return valid
+
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
-    if not user:
-        return None
-    if user.is_sso_user:
-        return None  # SSO users cannot login locally
-    if not auth.verify_password(password, user.password_hash):
+    if not check_user_password(user, password):
         return None
+    if user in db.dirty:
+        db.commit()
     return user
 
 def get_applications(db: Session, user_id: int):
     return db.query(models.Application).filter(models.Application.user_id == user_id).order_by(models.Application.display_order).all()
 
 def create_application(db: Session, app: schemas.ApplicationCreate, user_id: int):
-    encrypted_secret = secrets_encryption.encrypt_secret(app.secret)
+    encrypted_secret = envelope_encryption.encrypt_for_user(db, user_id, app.secret)
     db_app = models.Application(
         name=app.name,
         secret=encrypted_secret,
@@ -62,34 +84,76 @@ def create_application(db: Session, app: schemas.ApplicationCreate, user_id: int
     db.add(db_app)
     db.commit()
     db.refresh(db_app)
+    code_stream_scheduler.notify_user(user_id)
     return db_app
 
 def get_application(db: Session, app_id: int):
     return db.query(models.Application).filter(models.Application.id == app_id).first()
 
+def advance_hotp_counter(db: Session, app_id: int, commit: bool = True) -> Optional[int]:
+    """
+    Atomically advance an HOTP counter and return the counter value to generate a code from.
+
+    Uses a single UPDATE ... RETURNING so concurrent requests can never hand
+    out the same code. On databases without UPDATE ... RETURNING (SQLite
+    before 3.35) the UPDATE runs first and the new value is read back with
+    SELECT ... FOR UPDATE inside the same transaction.
+
+    Returns None if the application does not exist.
+    """
+    stmt = (
+        update(models.Application)
+        .where(models.Application.id == app_id)
+        .values(counter=func.coalesce(models.Application.counter, 0) + 1)
+    )
+    if db.get_bind().dialect.update_returning:
+        new_counter = db.execute(stmt.returning(models.Application.counter)).scalar_one_or_none()
+    else:
+        result = db.execute(stmt)
+        new_counter = None
+        if result.rowcount:
+            new_counter = db.execute(
+                select(models.Application.counter)
+                .where(models.Application.id == app_id)
+                .with_for_update()
+            ).scalar_one()
+    if commit:
+        db.commit()
+    if new_counter is None:
+        return None
+    return new_counter - 1
+
 def update_application(db: Session, app_id: int, app: schemas.ApplicationUpdate):
     db_app = get_application(db, app_id)
+    secret_cache.invalidate(app_id)
     if db_app:
         for key, value in app.dict().items():
             if key == "secret" and value:
-                value = secrets_encryption.encrypt_secret(value)
+                value = envelope_encryption.encrypt_for_user(db, db_app.user_id, value)
             if value is not None:
                 setattr(db_app, key, value)
         db.commit()
         db.refresh(db_app)
+        code_stream_scheduler.notify_user(db_app.user_id)
     return db_app
 
 def delete_application(db: Session, app_id: int):
     db_app = get_application(db, app_id)
+    secret_cache.invalidate(app_id)
     if db_app:
+        # Write out queued history first so it can't reference a deleted application
+        history_writer.flush()
+
         # Delete related code_generation_history records first (cascade)
         db.query(models.CodeGenerationHistory).filter(
             models.CodeGenerationHistory.application_id == app_id
         ).delete(synchronize_session=False)
         
         # Now delete the application
+        user_id = db_app.user_id
         db.delete(db_app)
         db.commit()
+        code_stream_scheduler.notify_user(user_id)
     return db_app
 
 def get_global_settings(db: Session):
@@ -114,10 +178,17 @@ def update_global_settings(db: Session, settings_update):
         for key, value in settings_update.dict(exclude_unset=True).items():
             if hasattr(settings, key):
                 setattr(settings, key, value)
+    # Invalidates caches compiled from the settings (e.g. IP range matchers) in every worker
+    settings.version = (settings.version or 0) + 1
     db.commit()
+    settings_cache.invalidate(models.GlobalSettings)
     db.refresh(settings)
     return settings
 
+def get_global_settings_snapshot(db: Session) -> SettingsSnapshot:
+    """Read-only cached copy of the global settings (see settings_cache)"""
+    return settings_cache.get(db, models.GlobalSettings, get_global_settings)
+
 def get_oidc_config(db: Session):
     """Get or create OIDC configuration"""
     try:
@@ -152,10 +223,16 @@ def update_oidc_config(db: Session, config_update: schemas.OIDCConfigUpdate):
     for key, value in config_update.dict().items():
         if value is not None:
             setattr(config, key, value)
+    config.version = (config.version or 0) + 1
     db.commit()
+    settings_cache.invalidate(models.OIDCConfig)
     db.refresh(config)
     return config
 
+def get_oidc_config_snapshot(db: Session) -> SettingsSnapshot:
+    """Read-only cached copy of the OIDC configuration (see settings_cache)"""
+    return settings_cache.get(db, models.OIDCConfig, get_oidc_config)
+
 def get_user_by_oidc_id(db: Session, oidc_id: str):
     """Get user by OIDC ID"""
     return db.query(models.User).filter(models.User.oidc_id == oidc_id).first()
@@ -166,7 +243,7 @@ def create_sso_user(db: Session, oidc_id: str, email: str, name: str, username:
         groups = []
     
     # Determine role based on groups
-    config = get_oidc_config(db)
+    config = get_oidc_config_snapshot(db)
     role = "user"  # default
     if any(group in config.admin_groups for group in groups):
         role = "admin"
@@ -306,8 +383,9 @@ def create_enhanced_user_session(db: Session, **session_data):
     db.refresh(session)
     return session
 
-def create_user_session(db: Session, user_id: int, token_jti: str, ip_address: str = None, user_agent: str = None, expires_at = None):
-    """Create a new user session"""
+def create_user_session(db: Session, user_id: int, token_jti: str, ip_address: str = None, user_agent: str = None, expires_at = None,
+                        commit: bool = True):
+    """Create a new user session (with commit=False, the caller commits)"""
     session = models.UserSession(
         user_id=user_id,
         token_jti=token_jti,
@@ -316,8 +394,9 @@ def create_user_session(db: Session, user_id: int, token_jti: str, ip_address: s
         expires_at=expires_at
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    if commit:
+        db.commit()
+        db.refresh(session)
     return session
 
 def get_user_sessions(db: Session, user_id: int, exclude_revoked: bool = True):
@@ -333,6 +412,7 @@ def revoke_session(db: Session, session_id: int):
     if session:
         session.revoked = True
         db.commit()
+        revocation_index.add(session.token_jti, session.expires_at)
         return True
     return False
 
@@ -344,44 +424,80 @@ def revoke_all_user_sessions(db: Session, user_id: int, exclude_session_id: int
     )
     if exclude_session_id:
         query = query.filter(models.UserSession.id != exclude_session_id)
+    revoked = query.with_entities(models.UserSession.token_jti, models.UserSession.expires_at).all()
     query.update({"revoked": True})
     db.commit()
+    revocation_index.add_many(revoked)
+    # Bulk updates bypass the ORM events that invalidate cached principals
+    principal_cache.invalidate_user(user_id)
 
 # Audit Log Functions
 def create_audit_log(db: Session, user_id: int = None, action: str = None, resource_type: str = None, 
                      resource_id: int = None, ip_address: str = None, user_agent: str = None,
-                     status: str = "success", reason: str = None, details: dict = None):
-    """Create an audit log entry"""
-    audit_log = models.AuditLog(
-        user_id=user_id,
-        action=action,
-        resource_type=resource_type,
-        resource_id=resource_id,
-        ip_address=ip_address,
-        user_agent=user_agent,
-        status=status,
-        reason=reason,
-        details=details
-    )
+                     status: str = "success", reason: str = None, details: dict = None,
+                     commit: bool = True):
+    """
+    Create an audit log entry.
+
+    Most actions are queued for the background audit writer (see
+    audit_writer); security-critical ones are written in the caller's
+    transaction. With commit=False nothing happens until the caller commits
+    and runs side_effects.dispatch(): the entry is added to the session, or
+    queued only once the transaction has committed.
+    """
+    record = {
+        "user_id": user_id,
+        "action": action,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "status": status,
+        "reason": reason,
+        "details": details,
+        "created_at": datetime.utcnow()
+    }
+    if not audit_writer.is_sync(action):
+        if not commit:
+            side_effects.defer(db, _enqueue_audit_log, db, record)
+        elif not audit_writer.enqueue(record) and audit_writer.full_policy == "sync":
+            _write_audit_log(db, record)
+        return models.AuditLog(**record)
+
+    audit_log = models.AuditLog(**record)
     db.add(audit_log)
+    record_audit_events(db, [record])
+    audit_writer.record_sync()
+    if not commit:
+        side_effects.defer(db, feed_security_monitor, record)
+        return audit_log
     db.commit()
     db.refresh(audit_log)
+    feed_security_monitor(record)
+    return audit_log
 
-    # Also log to security monitor for real-time analysis
-    try:
-        from .security_monitor import log_security_event
-        log_security_event(action, user_id, ip_address, details)
-    except ImportError:
-        # Security monitor not available, continue without it
-        pass
+def _write_audit_log(db: Session, record: dict):
+    """Write an audit record in its own commit (queue full)"""
+    db.add(models.AuditLog(**record))
+    record_audit_events(db, [record])
+    db.commit()
+    audit_writer.record_sync()
+    feed_security_monitor(record)
 
-    return audit_log
+def _enqueue_audit_log(db: Session, record: dict):
+    if not audit_writer.enqueue(record) and audit_writer.full_policy == "sync":
+        _write_audit_log(db, record)
 
 def get_audit_logs(db: Session, user_id: int = None, action: str = None, status: str = None,
-                   start_date = None, end_date = None, limit: int = 100, offset: int = 0):
-    """Get audit logs with optional filters"""
-    from datetime import datetime
-    
+                   start_date = None, end_date = None, limit: int = 100, offset: int = 0,
+                   cursor: Optional[Tuple[datetime, int]] = None):
+    """
+    Get audit logs with optional filters, newest first.
+
+    Pass the (created_at, id) of the last row of the previous page as cursor
+    (see pagination) to seek to the next page through the composite indexes;
+    offset is kept for older clients and ignored when a cursor is given.
+    """
     query = db.query(models.AuditLog, models.User.name.label('username')).outerjoin(
         models.User, models.AuditLog.user_id == models.User.id
     )
@@ -396,8 +512,12 @@ def get_audit_logs(db: Session, user_id: int = None, action: str = None, status:
         query = query.filter(models.AuditLog.created_at >= start_date)
     if end_date:
         query = query.filter(models.AuditLog.created_at <= end_date)
+    if cursor:
+        query = query.filter(tuple_(models.AuditLog.created_at, models.AuditLog.id) < tuple_(*cursor))
+        offset = 0
     
-    results = query.order_by(models.AuditLog.created_at.desc()).limit(limit).offset(offset).all()
+    query = query.order_by(models.AuditLog.created_at.desc(), models.AuditLog.id.desc())
+    results = query.limit(limit).offset(offset).all()
     
     # Convert to response format
     audit_logs = []
@@ -425,23 +545,23 @@ def export_applications(db: Session, user_id: int):
     from datetime import datetime
     applications = db.query(models.Application).filter(models.Application.user_id == user_id).all()
     
+    decrypted_secrets = envelope_encryption.decrypt_application_secrets(db, applications)
+    
     exported_apps = []
-    for app in applications:
-        try:
-            decrypted_secret = secrets_encryption.decrypt_secret(app.secret)
-            exported_apps.append(schemas.ApplicationExportData(
-                name=app.name,
-                secret=decrypted_secret,
-                otp_type=app.otp_type,
-                counter=app.counter,
-                icon=app.icon,
-                color=app.color,
-                category=app.category,
-                favorite=app.favorite
-            ))
-        except Exception as e:
-            print(f"Error exporting app {app.id}: {str(e)}")
+    for app, decrypted_secret in zip(applications, decrypted_secrets):
+        if decrypted_secret is None:
+            print(f"Error exporting app {app.id}: could not decrypt secret")
             continue
+        exported_apps.append(schemas.ApplicationExportData(
+            name=app.name,
+            secret=decrypted_secret,
+            otp_type=app.otp_type,
+            counter=app.counter,
+            icon=app.icon,
+            color=app.color,
+            category=app.category,
+            favorite=app.favorite
+        ))
     
     return schemas.ExportResponse(
         export_date=datetime.utcnow(),
@@ -469,7 +589,7 @@ def import_applications(db: Session, user_id: int, import_data: schemas.ImportRe
                 elif import_data.conflict_action == "overwrite":
                     # Update existing app
                     existing_app = existing_apps[app_data.name]
-                    encrypted_secret = secrets_encryption.encrypt_secret(app_data.secret)
+                    encrypted_secret = envelope_encryption.encrypt_for_user(db, user_id, app_data.secret)
                     existing_app.secret = encrypted_secret
                     existing_app.icon = app_data.icon or existing_app.icon
                     existing_app.color = app_data.color or existing_app.color
@@ -480,7 +600,7 @@ def import_applications(db: Session, user_id: int, import_data: schemas.ImportRe
                     continue
             
             # Create new application
-            encrypted_secret = secrets_encryption.encrypt_secret(app_data.secret)
+            encrypted_secret = envelope_encryption.encrypt_for_user(db, user_id, app_data.secret)
             backup_key = auth.generate_token()
             
             new_app = models.Application(
@@ -503,6 +623,9 @@ def import_applications(db: Session, user_id: int, import_data: schemas.ImportRe
             errors.append(f"Error importing '{app_data.name}': {str(e)}")
             continue
     
+    if imported or overwritten:
+        code_stream_scheduler.notify_user(user_id)
+    
     return schemas.ImportResponse(
         imported=imported,
         skipped=skipped,
@@ -661,11 +784,18 @@ def update_password_policy(db: Session, policy_update: dict):
     for key, value in policy_update.items():
         if value is not None and hasattr(policy, key):
             setattr(policy, key, value)
+    policy.version = (policy.version or 0) + 1
     db.commit()
+    settings_cache.invalidate(models.PasswordPolicy)
     db.refresh(policy)
     return policy
 
 
+def get_password_policy_snapshot(db: Session) -> SettingsSnapshot:
+    """Read-only cached copy of the password policy (see settings_cache)"""
+    return settings_cache.get(db, models.PasswordPolicy, get_password_policy)
+
+
 # Bulk user import functions
 def bulk_import_users(db: Session, users_data: list, default_role: str = "user") -> dict:
     """Import multiple users from data"""
@@ -704,7 +834,7 @@ def bulk_import_users(db: Session, users_data: list, default_role: str = "user")
                 name=user_data.get("name", user_data["username"]),
                 role=user_data.get("role", default_role),
                 is_sso_user=user_data.get("is_sso_user", False),
-                password_hash=auth.hash_password(user_data["password"]) if "password" in user_data and user_data["password"] else None
+                password_hash=auth.hash_password(user_data["password"], block=True) if "password" in user_data and user_data["password"] else None
             )
             
             db.add(new_user)
@@ -729,8 +859,9 @@ def bulk_import_users(db: Session, users_data: list, default_role: str = "user")
 
 # Notification CRUD functions
 
-def create_in_app_notification(db: Session, user_id: int, notification_type: str, title: str, message: str, details: dict = None) -> models.InAppNotification:
-    """Create a new in-app notification for a user"""
+def create_in_app_notification(db: Session, user_id: int, notification_type: str, title: str, message: str, details: dict = None,
+                               commit: bool = True) -> models.InAppNotification:
+    """Create a new in-app notification for a user (with commit=False, the caller commits)"""
     notification = models.InAppNotification(
         user_id=user_id,
         notification_type=notification_type,
@@ -740,8 +871,9 @@ def create_in_app_notification(db: Session, user_id: int, notification_type: str
         read=False
     )
     db.add(notification)
-    db.commit()
-    db.refresh(notification)
+    if commit:
+        db.commit()
+        db.refresh(notification)
     return notification
 
 
@@ -0,0 +1,348 @@
+"""
+Dashboard Rollups Module
+
+Pre-aggregated counters behind /api/admin/dashboard/stats, so loading the
+dashboard never scans audit_logs or applications:
+
+- login_daily_rollups: login_success / login_failed events per UTC day
+- user_login_daily_rollups: login_success events per user and day
+- application_category_rollups: 2FA accounts per category
+
+Maintenance:
+- Login rollups are incremented in the transaction that writes the audit rows
+  (crud.create_audit_log and the background audit writer)
+- Category counts follow Application inserts, deletes and category changes
+  made through the ORM; bulk deletes must call adjust_categories
+- rebuild() (python backfill_rollups.py) recomputes everything from the
+  source tables, e.g. after upgrading an existing database. It only sees
+  rows still in audit_logs: once old logs are archived (audit_archive),
+  login counts for archived days are lost by a rebuild (the 7-day
+  dashboard window is unaffected while AUDIT_RETENTION_DAYS >= 7)
+- The assembled response is cached per process for
+  DASHBOARD_CACHE_TTL_SECONDS
+"""
+
+import os
+import threading
+import time
+import weakref
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "30"))
+DASHBOARD_WINDOW_DAYS = 7
+
+LOGIN_SUCCESS_ACTION = "login_success"
+LOGIN_FAILED_ACTION = "login_failed"
+
+
+def _dialect_name(executor) -> str:
+    bind = executor.get_bind() if isinstance(executor, Session) else executor
+    return bind.dialect.name
+
+
+def _increment(executor, model, rows: List[Dict[str, Any]], counters: Sequence[str]):
+    """Add each row's counters to the rollup row with the same key, creating missing rows"""
+    if not rows:
+        return
+    table = model.__table__
+    keys = [column.name for column in table.primary_key.columns]
+    dialect = _dialect_name(executor)
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        stmt = upsert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={name: table.c[name] + stmt.excluded[name] for name in counters}
+        )
+        executor.execute(stmt)
+        return
+    for row in rows:
+        matches = and_(*(table.c[key] == row[key] for key in keys))
+        result = executor.execute(update(table).where(matches).values(
+            {name: table.c[name] + row[name] for name in counters}
+        ))
+        if not result.rowcount:
+            executor.execute(insert(table).values(row))
+
+
+def record_audit_events(executor, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Count login audit records into the login rollups.
+
+    Args:
+        executor: Session or Connection of the transaction writing the records
+        records: AuditLog column values (created_at included)
+
+    Returns:
+        Number of records counted
+    """
+    days: Dict[date, List[int]] = {}
+    user_days: Dict[Tuple[date, int], int] = {}
+    for record in records:
+        action = record.get("action")
+        if action != LOGIN_SUCCESS_ACTION and action != LOGIN_FAILED_ACTION:
+            continue
+        day = (record.get("created_at") or datetime.utcnow()).date()
+        counts = days.setdefault(day, [0, 0])
+        if action == LOGIN_SUCCESS_ACTION:
+            counts[0] += 1
+            if record.get("user_id") is not None:
+                key = (day, record["user_id"])
+                user_days[key] = user_days.get(key, 0) + 1
+        else:
+            counts[1] += 1
+    if not days:
+        return 0
+
+    _increment(executor, models.LoginDailyRollup, [
+        {"day": day, "success_count": success, "failure_count": failure}
+        for day, (success, failure) in days.items()
+    ], ("success_count", "failure_count"))
+    _increment(executor, models.UserLoginDailyRollup, [
+        {"day": day, "user_id": user_id, "login_count": count}
+        for (day, user_id), count in user_days.items()
+    ], ("login_count",))
+    return sum(success + failure for success, failure in days.values())
+
+
+def adjust_categories(executor, deltas: Dict[Optional[str], int]):
+    """Add deltas to the account count of each category (None is stored as "")"""
+    merged: Dict[str, int] = {}
+    for category, delta in deltas.items():
+        merged[category or ""] = merged.get(category or "", 0) + delta
+    _increment(executor, models.ApplicationCategoryRollup, [
+        {"category": category, "account_count": delta}
+        for category, delta in merged.items() if delta
+    ], ("account_count",))
+
+
+@event.listens_for(models.Application, "after_insert")
+def _application_inserted(mapper, connection, target):
+    adjust_categories(connection, {target.category: 1})
+
+
+@event.listens_for(models.Application, "before_delete")
+def _application_deleted(mapper, connection, target):
+    adjust_categories(connection, {target.category: -1})
+
+
+@event.listens_for(models.Application, "before_update")
+def _application_updated(mapper, connection, target):
+    history = inspect(target).attrs.category.history
+    if not history.added:
+        return
+    if history.deleted:
+        old_category = history.deleted[0]
+    else:
+        # Set without loading the old value (e.g. after a commit expired it)
+        old_category = connection.execute(
+            select(models.Application.category).where(models.Application.id == target.id)
+        ).scalar()
+    if (old_category or "") != (target.category or ""):
+        adjust_categories(connection, {old_category: -1, target.category: 1})
+
+
+def rebuild(db: Session) -> Dict[str, int]:
+    """
+    Recompute all rollups from audit_logs and applications in one transaction.
+
+    Archived audit logs are not read, so login counts of archived days are
+    undercounted (dropped) afterwards.
+
+    Returns:
+        Number of rows written to each rollup table
+    """
+    action = models.AuditLog.action
+    day = func.date(models.AuditLog.created_at)
+    category = func.coalesce(models.Application.category, "")
+
+    for model in (models.LoginDailyRollup, models.UserLoginDailyRollup, models.ApplicationCategoryRollup):
+        db.query(model).delete()
+
+    db.execute(insert(models.LoginDailyRollup).from_select(
+        ["day", "success_count", "failure_count"],
+        select(
+            day,
+            func.sum(case((action == LOGIN_SUCCESS_ACTION, 1), else_=0)),
+            func.sum(case((action == LOGIN_FAILED_ACTION, 1), else_=0))
+        ).where(action.in_((LOGIN_SUCCESS_ACTION, LOGIN_FAILED_ACTION))).group_by(day)
+    ))
+    db.execute(insert(models.UserLoginDailyRollup).from_select(
+        ["day", "user_id", "login_count"],
+        select(day, models.AuditLog.user_id, func.count(models.AuditLog.id)).where(
+            action == LOGIN_SUCCESS_ACTION,
+            models.AuditLog.user_id.isnot(None)
+        ).group_by(day, models.AuditLog.user_id)
+    ))
+    db.execute(insert(models.ApplicationCategoryRollup).from_select(
+        ["category", "account_count"],
+        select(category, func.count(models.Application.id)).group_by(category)
+    ))
+    db.commit()
+    dashboard_cache.invalidate()
+
+    return {
+        model.__tablename__: db.query(model).count()
+        for model in (models.LoginDailyRollup, models.UserLoginDailyRollup, models.ApplicationCategoryRollup)
+    }
+
+
+def compute_dashboard_stats(db: Session) -> Dict[str, Any]:
+    """Dashboard statistics from the rollups and the users table"""
+    now = datetime.utcnow()
+    since = now - timedelta(days=DASHBOARD_WINDOW_DAYS)
+    # Rollups are per day, so the window starts at midnight of its first day
+    first_day = since.date()
+
+    total_users, active_users, users_with_2fa = db.query(
+        func.count(models.User.id),
+        func.coalesce(func.sum(case((models.User.created_at >= since, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((models.User.totp_enabled == True, 1), else_=0)), 0)
+    ).one()
+
+    locked_accounts_details = db.query(
+        models.User.id,
+        models.User.email,
+        models.User.locked_until,
+        models.User.failed_login_attempts,
+        models.User.last_failed_login
+    ).filter(
+        models.User.locked_until != None,
+        models.User.locked_until > now
+    ).all()
+
+    login_days = db.query(models.LoginDailyRollup).filter(
+        models.LoginDailyRollup.day >= first_day
+    ).order_by(models.LoginDailyRollup.day).all()
+
+    login_count = func.sum(models.UserLoginDailyRollup.login_count)
+    top_users = db.query(models.User.email, login_count.label("login_count")).join(
+        models.User, models.User.id == models.UserLoginDailyRollup.user_id
+    ).filter(
+        models.UserLoginDailyRollup.day >= first_day
+    ).group_by(models.User.id, models.User.email).order_by(login_count.desc()).limit(5).all()
+
+    categories = db.query(models.ApplicationCategoryRollup).filter(
+        models.ApplicationCategoryRollup.account_count > 0
+    ).order_by(models.ApplicationCategoryRollup.category).all()
+
+    # Recent activity (last 10 events)
+    try:
+        recent_events = db.query(
+            models.AuditLog.action,
+            models.AuditLog.created_at,
+            models.User.email,
+            models.AuditLog.status
+        ).join(
+            models.User,
+            models.AuditLog.user_id == models.User.id
+        ).order_by(
+            models.AuditLog.created_at.desc()
+        ).limit(10).all()
+    except Exception as e:
+        print(f"[ERROR] Error fetching recent events: {str(e)}")
+        recent_events = []
+
+    two_fa_coverage = (users_with_2fa / total_users * 100) if total_users > 0 else 0
+
+    return {
+        "total_users": total_users,
+        "active_users_7d": active_users,
+        "total_accounts": sum(row.account_count for row in categories),
+        "users_with_2fa": users_with_2fa,
+        "two_fa_coverage_percent": round(two_fa_coverage, 1),
+        "recent_logins_7d": sum(row.success_count for row in login_days),
+        "recent_failed_logins_7d": sum(row.failure_count for row in login_days),
+        "locked_accounts": len(locked_accounts_details),
+        "locked_accounts_details": [
+            {
+                "id": user.id,
+                "email": user.email,
+                "locked_until": user.locked_until.isoformat(),
+                "failed_login_attempts": user.failed_login_attempts,
+                "last_failed_login": user.last_failed_login.isoformat() if user.last_failed_login else None
+            }
+            for user in locked_accounts_details
+        ],
+        "top_active_users": [
+            {"email": email, "login_count": count}
+            for email, count in top_users
+        ],
+        "account_distribution_by_category": [
+            {"category": row.category or None, "count": row.account_count}
+            for row in categories
+        ],
+        "recent_events": [
+            {
+                "action": action,
+                "email": email,
+                "status": status,
+                "created_at": created_at.isoformat()
+            }
+            for action, created_at, email, status in recent_events
+        ],
+        "login_trend": [
+            {"date": str(row.day), "count": row.success_count}
+            for row in login_days if row.success_count
+        ]
+    }
+
+
+class DashboardCache:
+    """Short-lived per-process cache of the assembled dashboard statistics"""
+
+    def __init__(self, ttl_seconds: float = DASHBOARD_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        # engine -> (expires at, stats)
+        self._entries: "weakref.WeakKeyDictionary[Any, Tuple[float, Dict[str, Any]]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, compute: Callable[[Session], Dict[str, Any]] = compute_dashboard_stats) -> Dict[str, Any]:
+        """Cached statistics, recomputed once they are older than the TTL"""
+        bind = db.get_bind()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(bind)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        stats = compute(db)
+        if self.ttl_seconds > 0:
+            with self._lock:
+                self._entries[bind] = (now + self.ttl_seconds, stats)
+        return stats
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Global dashboard cache instance
+dashboard_cache = DashboardCache()
+
+
+def get_dashboard_cache() -> DashboardCache:
+    """Get the global dashboard statistics cache"""
+    return dashboard_cache
@@ -0,0 +1,237 @@
+"""
+Envelope Encryption Module
+
+Encrypts application OTP secrets with a per-user data key instead of the
+master key.
+
+- Every user gets a random Fernet data key, stored in users.data_key wrapped
+  (encrypted) by the master key ring from secrets_encryption
+- Application secrets are encrypted with the owner's data key and stored as
+  "e2:<AES-GCM token>" (compact format, see secrets_encryption), or as the
+  legacy "e1:<fernet token>" when SECRET_FORMAT=fernet
+- Rotating the master key only re-wraps users.data_key (one row per user)
+  instead of re-encrypting every application secret
+- Unwrapped data keys are cached on the SQLAlchemy session (Session.info),
+  i.e. for the lifetime of one request
+- Secrets still encrypted directly with the master key, or in an older
+  format, are read as before and re-encrypted under the owner's data key in
+  the current format the first time they are read
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from . import models, secrets_encryption
+from .secrets_encryption import AEADCipher, ENVELOPE_AEAD_PREFIX, ENVELOPE_PREFIX
+from .secret_cache import secret_cache
+
+
+_SESSION_CACHE_KEY = "envelope_data_keys"
+
+
+class DataKey:
+    """An unwrapped per-user data key"""
+
+    __slots__ = ("fernet", "aead")
+
+    def __init__(self, key: str):
+        self.fernet = Fernet(key.encode())
+        self.aead = AEADCipher(key)
+
+    def encrypt(self, secret: str) -> str:
+        if secrets_encryption.SECRET_FORMAT == "fernet":
+            return ENVELOPE_PREFIX + self.fernet.encrypt(secret.encode()).decode()
+        return self.aead.encrypt_text(secret, ENVELOPE_AEAD_PREFIX)
+
+    def decrypt(self, token: str) -> str:
+        if token.startswith(ENVELOPE_AEAD_PREFIX):
+            return self.aead.decrypt_text(token, ENVELOPE_AEAD_PREFIX)
+        return self.fernet.decrypt(token[len(ENVELOPE_PREFIX):].encode()).decode()
+
+
+def is_envelope_encrypted(value: str) -> bool:
+    """Check if a value was encrypted with a per-user data key (any format)"""
+    return bool(value) and value.startswith((ENVELOPE_PREFIX, ENVELOPE_AEAD_PREFIX))
+
+
+def needs_reencryption(value: str) -> bool:
+    """Check if a stored secret is not yet in the current envelope format"""
+    if not value:
+        return False
+    current = ENVELOPE_PREFIX if secrets_encryption.SECRET_FORMAT == "fernet" else ENVELOPE_AEAD_PREFIX
+    return not value.startswith(current)
+
+
+def _session_cache(db: Session) -> Dict[int, DataKey]:
+    return db.info.setdefault(_SESSION_CACHE_KEY, {})
+
+
+def clear_data_key_cache(db: Session):
+    """Forget the data keys unwrapped for this session"""
+    db.info.pop(_SESSION_CACHE_KEY, None)
+
+
+def _forget_on_rollback(db: Session):
+    """Drop the session's data keys if its transaction rolls back (keys created in it are gone)"""
+    if not event.contains(db, "after_rollback", clear_data_key_cache):
+        event.listen(db, "after_rollback", clear_data_key_cache)
+
+
+def get_data_key(db: Session, user_id: int, create: bool = False) -> Optional[DataKey]:
+    """
+    Get the unwrapped data key for a user.
+
+    Keys are unwrapped once per session. With create=True a missing key is
+    written in the caller's transaction, which the caller commits along with
+    the secrets encrypted under it; if that transaction rolls back, the
+    session forgets the key so it is not used again.
+
+    Returns:
+        The user's DataKey, or None if the user has none and create is False
+    """
+    cache = _session_cache(db)
+    data_key = cache.get(user_id)
+    if data_key is not None:
+        return data_key
+
+    wrapped = db.query(models.User.data_key).filter(models.User.id == user_id).scalar()
+    if not wrapped:
+        if not create:
+            return None
+        new_wrapped = secrets_encryption.encrypt_secret(Fernet.generate_key().decode())
+        # Only set the key if no concurrent request has created one first
+        db.execute(
+            update(models.User)
+            .where(models.User.id == user_id, models.User.data_key.is_(None))
+            .values(data_key=new_wrapped)
+        )
+        _forget_on_rollback(db)
+        wrapped = db.query(models.User.data_key).filter(models.User.id == user_id).scalar()
+        if not wrapped:
+            raise ValueError(f"Cannot create a data key for unknown user {user_id}")
+
+    data_key = DataKey(secrets_encryption.decrypt_secret(wrapped))
+    cache[user_id] = data_key
+    return data_key
+
+
+def encrypt_for_user(db: Session, user_id: int, secret: str) -> str:
+    """Encrypt a secret with the user's data key (creating the key if needed)"""
+    if not secret:
+        return ""
+    return get_data_key(db, user_id, create=True).encrypt(secret)
+
+
+def decrypt_for_user(db: Session, user_id: int, encrypted_secret: str) -> str:
+    """
+    Decrypt a secret owned by a user.
+
+    Envelope-encrypted secrets are decrypted with the user's data key;
+    anything else is treated as a legacy master-key token.
+
+    Raises:
+        ValueError: If decryption fails
+    """
+    if not encrypted_secret:
+        return ""
+    if not is_envelope_encrypted(encrypted_secret):
+        return secrets_encryption.decrypt_secret(encrypted_secret)
+
+    data_key = get_data_key(db, user_id)
+    if data_key is None:
+        raise ValueError(f"User {user_id} has no data key to decrypt this secret")
+    try:
+        return data_key.decrypt(encrypted_secret)
+    except (InvalidToken, InvalidTag):
+        raise ValueError("Failed to decrypt secret: invalid token for this user's data key")
+
+
+def decrypt_many_for_user(db: Session, user_id: int, encrypted_secrets: Iterable[str],
+                          ignore_errors: bool = False) -> List[Optional[str]]:
+    """Decrypt a batch of one user's secrets, preserving order"""
+    results = []
+    for token in encrypted_secrets:
+        try:
+            results.append(decrypt_for_user(db, user_id, token))
+        except ValueError:
+            if not ignore_errors:
+                raise
+            results.append(None)
+    return results
+
+
+def decrypt_application_secrets(db: Session, applications: Sequence[models.Application],
+                                migrate: bool = True) -> List[Optional[str]]:
+    """
+    Decrypt application secrets through the secret cache.
+
+    Applications whose secret is still a legacy master-key token, or in an
+    older envelope format, are re-encrypted under the owner's data key in the
+    current format (lazy migration). Secrets that cannot be decrypted yield
+    None.
+    """
+    owners = {app.secret: app.user_id for app in applications}
+
+    def decrypt_batch(tokens: List[str]) -> List[Optional[str]]:
+        results = []
+        for token in tokens:
+            try:
+                results.append(decrypt_for_user(db, owners[token], token))
+            except ValueError:
+                results.append(None)
+        return results
+
+    secrets = secret_cache.get_or_decrypt_many(
+        [(app.id, app.secret) for app in applications], decrypt_many=decrypt_batch
+    )
+    if migrate:
+        migrate_legacy_secrets(db, applications, secrets)
+    return secrets
+
+
+def decrypt_application_secret(db: Session, application: models.Application, migrate: bool = True) -> str:
+    """
+    Decrypt one application's secret (see decrypt_application_secrets).
+
+    Raises:
+        ValueError: If the secret cannot be decrypted
+    """
+    secret = decrypt_application_secrets(db, [application], migrate=migrate)[0]
+    if secret is None:
+        raise ValueError("Failed to decrypt secret")
+    return secret
+
+
+def migrate_legacy_secrets(db: Session, applications: Sequence[models.Application],
+                           secrets: Sequence[Optional[str]]) -> int:
+    """
+    Re-encrypt already decrypted legacy secrets under their owners' data keys
+    in the current format.
+
+    Failures are logged and leave the legacy token in place; it will be
+    migrated on a later read.
+
+    Returns:
+        Number of applications migrated
+    """
+    pending = [
+        (app, secret) for app, secret in zip(applications, secrets)
+        if secret and needs_reencryption(app.secret)
+    ]
+    if not pending:
+        return 0
+    try:
+        for app, secret in pending:
+            app.secret = encrypt_for_user(db, app.user_id, secret)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Warning: could not migrate secrets to envelope encryption: {str(e)}")
+        return 0
+    for app, secret in pending:
+        secret_cache.put(app.id, app.secret, secret)
+    return len(pending)
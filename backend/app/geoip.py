@@ -0,0 +1,359 @@
+"""
+GeoIP Module
+
+Offline IP -> country lookups for geographic access restrictions and session
+enrichment, replacing the synchronous call to ip-api.com (3 s timeout) made
+during login.
+
+The database is a compact binary file built from a CSV of IP ranges by
+import_geoip.py. It is memory-mapped (shared between worker processes by the
+OS page cache) and searched in place by binary search, so a lookup costs a
+few microseconds and loading it costs nothing up front.
+
+File layout (little-endian header, fixed-size records sorted by start):
+
+    magic "AN2GEO1\\0" | uint32 IPv4 count | uint32 IPv6 count
+    IPv4 records: uint32 start | uint32 end | 2-byte country code
+    IPv6 records: 16-byte start | 16-byte end (big-endian) | 2-byte country code
+
+- GEOIP_DATABASE_PATH selects the file (default: geoip.bin in the backend
+  directory)
+- Results are kept in a bounded LRU (GEOIP_CACHE_SIZE)
+- Until a database is imported, lookups fall back to ip-api.com
+  (GEOIP_ONLINE_FALLBACK, default true) so configured geo restrictions keep
+  being enforced after an upgrade; with the fallback off and no database,
+  lookups return None and geo restrictions fail open, which
+  check_geoip_configuration reports as an error at startup
+"""
+
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GEOIP_DATABASE_PATH = os.getenv("GEOIP_DATABASE_PATH", os.path.join(_BACKEND_DIR, "geoip.bin"))
+GEOIP_CACHE_SIZE = int(os.getenv("GEOIP_CACHE_SIZE", "10000"))
+GEOIP_ONLINE_FALLBACK = os.getenv("GEOIP_ONLINE_FALLBACK", "true").lower() == "true"
+
+MAGIC = b"AN2GEO1\0"
+_HEADER = struct.Struct("<8sII")
+_V4_RECORD = struct.Struct("<II2s")
+_V6_RECORD_SIZE = 34
+
+# Ranges are (version, start, end, country)
+Range = Tuple[int, int, int, str]
+
+
+class GeoIPDatabase:
+    """Read-only, memory-mapped range -> country table"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.v4_count, self.v6_count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a GeoIP database (run import_geoip.py)")
+        self._v4_offset = _HEADER.size
+        self._v6_offset = self._v4_offset + self.v4_count * _V4_RECORD.size
+        if len(self._mmap) < self._v6_offset + self.v6_count * _V6_RECORD_SIZE:
+            self._mmap.close()
+            raise ValueError(f"{path} is truncated")
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """Country code of an address, or None if it is not in any range"""
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        if ip.version == 4:
+            return self._search(int(ip), self.v4_count, self._v4_record)
+        return self._search(int(ip), self.v6_count, self._v6_record)
+
+    def close(self):
+        self._mmap.close()
+
+    def _v4_record(self, index: int) -> Tuple[int, int, bytes]:
+        return _V4_RECORD.unpack_from(self._mmap, self._v4_offset + index * _V4_RECORD.size)
+
+    def _v6_record(self, index: int) -> Tuple[int, int, bytes]:
+        offset = self._v6_offset + index * _V6_RECORD_SIZE
+        record = self._mmap[offset:offset + _V6_RECORD_SIZE]
+        return int.from_bytes(record[:16], "big"), int.from_bytes(record[16:32], "big"), record[32:]
+
+    @staticmethod
+    def _search(value: int, count: int, record) -> Optional[str]:
+        # Last record starting at or before value
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if record(middle)[0] <= value:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        _, end, country = record(low - 1)
+        return country.decode("ascii") if value <= end else None
+
+
+def parse_csv(rows: Iterable[List[str]]) -> Iterator[Range]:
+    """
+    Ranges from CSV rows in either of the common layouts:
+
+        start_ip,end_ip,country[,...]   (IP strings or integers; DB-IP, IP2Location)
+        network,country[,...]           (CIDR)
+
+    Header lines, unknown countries ("-", "ZZ") and malformed rows are skipped.
+    """
+    for row in rows:
+        if len(row) < 2:
+            continue
+        try:
+            if "/" in row[0]:
+                network = ipaddress.ip_network(row[0].strip(), strict=False)
+                version, start, end = network.version, int(network.network_address), int(network.broadcast_address)
+                country = row[1]
+            else:
+                first, last = (_parse_address(value) for value in row[:2])
+                if first.version != last.version:
+                    continue
+                version, start, end = first.version, int(first), int(last)
+                country = row[2] if len(row) > 2 else ""
+        except ValueError:
+            continue
+        country = country.strip().strip('"').upper()
+        if len(country) == 2 and country.isalpha() and country != "ZZ" and start <= end:
+            yield version, start, end, country
+
+
+def _parse_address(value: str):
+    value = value.strip().strip('"')
+    if value.isdigit():
+        number = int(value)
+        return ipaddress.ip_address(number) if number <= 0xFFFFFFFF else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+def build_database(ranges: Iterable[Range], path: str) -> Dict[str, int]:
+    """
+    Write ranges to a GeoIP database file (atomically replacing it).
+
+    Overlapping ranges are resolved in favour of the one starting later (the
+    narrower one when they start together), so a range nested in a broader
+    one wins inside it.
+
+    Returns:
+        Number of IPv4 and IPv6 ranges written
+    """
+    tables: Dict[int, List[Tuple[int, int, str]]] = {4: [], 6: []}
+    for version, start, end, country in ranges:
+        tables[version].append((start, end, country))
+    for version in tables:
+        tables[version] = _flatten(tables[version])
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(tables[4]), len(tables[6])))
+        for start, end, country in tables[4]:
+            f.write(_V4_RECORD.pack(start, end, country.encode("ascii")))
+        for start, end, country in tables[6]:
+            f.write(start.to_bytes(16, "big") + end.to_bytes(16, "big") + country.encode("ascii"))
+    os.replace(temp_path, path)
+    return {"ipv4_ranges": len(tables[4]), "ipv6_ranges": len(tables[6])}
+
+
+def _flatten(ranges: List[Tuple[int, int, str]]) -> List[Tuple[int, int, str]]:
+    """Sort ranges and make them disjoint, merging adjacent ranges of the same country"""
+    ranges.sort(key=lambda r: (r[0], -r[1]))
+    flat: List[Tuple[int, int, str]] = []
+
+    def emit(start: int, end: int, country: str):
+        if start > end:
+            return
+        if flat and flat[-1][2] == country and flat[-1][1] + 1 == start:
+            flat[-1] = (flat[-1][0], end, country)
+        else:
+            flat.append((start, end, country))
+
+    # Ranges that started earlier and still cover the next address, innermost last
+    enclosing: List[Tuple[int, str]] = []
+    cursor = 0  # First address not written yet
+    for start, end, country in ranges:
+        while enclosing and enclosing[-1][0] < start:
+            enclosing_end, enclosing_country = enclosing.pop()
+            emit(cursor, enclosing_end, enclosing_country)
+            cursor = max(cursor, enclosing_end + 1)
+        if enclosing:
+            emit(cursor, start - 1, enclosing[-1][1])
+        cursor = max(cursor, start)
+        enclosing.append((end, country))
+    while enclosing:
+        enclosing_end, enclosing_country = enclosing.pop()
+        emit(cursor, enclosing_end, enclosing_country)
+        cursor = max(cursor, enclosing_end + 1)
+    return flat
+
+
+def import_csv(csv_path: str, path: str) -> Dict[str, int]:
+    """Build a GeoIP database from a CSV file"""
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return build_database(parse_csv(csv.reader(f)), path)
+
+
+class GeoIPProvider:
+    """Country lookups from the local database, behind a bounded LRU"""
+
+    def __init__(self, path: str = GEOIP_DATABASE_PATH, cache_size: int = GEOIP_CACHE_SIZE,
+                 online_fallback: bool = GEOIP_ONLINE_FALLBACK):
+        self.path = path
+        self.cache_size = cache_size
+        self.online_fallback = online_fallback
+        self.online_url = "http://ip-api.com/json/{}"
+        self._database: Optional[GeoIPDatabase] = None
+        self._loaded = False
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def database(self) -> Optional[GeoIPDatabase]:
+        """The memory-mapped database, opened on first use"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._database = self._open()
+                    self._loaded = True
+        return self._database
+
+    def country_code(self, ip_address: str) -> Optional[str]:
+        """ISO 3166-1 alpha-2 country code of an address, or None if unknown"""
+        with self._lock:
+            if ip_address in self._cache:
+                self._cache.move_to_end(ip_address)
+                self.hits += 1
+                return self._cache[ip_address]
+            self.misses += 1
+
+        country = self._lookup(ip_address)
+
+        with self._lock:
+            self._cache[ip_address] = country
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return country
+
+    @property
+    def can_resolve(self) -> bool:
+        """Whether lookups can return a country (a database or the online fallback)"""
+        return self.database is not None or self.online_fallback
+
+    def reload(self):
+        """Reopen the database file (after running the importer) and clear the cache"""
+        # The old mapping is not closed: lookups in flight may still read it,
+        # and it is unmapped once no longer referenced
+        with self._lock:
+            self._database = self._open()
+            self._loaded = True
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Database size and cache counters"""
+        database = self.database
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "database": self.path if database else None,
+                "ipv4_ranges": database.v4_count if database else 0,
+                "ipv6_ranges": database.v6_count if database else 0,
+                "online_fallback": self.online_fallback,
+                "cache_size": len(self._cache),
+                "max_cache_size": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _open(self) -> Optional[GeoIPDatabase]:
+        if not self.path or not os.path.exists(self.path):
+            if not self.online_fallback:
+                print(f"Warning: GeoIP database {self.path or '(unset)'} not found; "
+                      "geographic restrictions cannot be enforced (run import_geoip.py)")
+            return None
+        try:
+            return GeoIPDatabase(self.path)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not open GeoIP database: {e}")
+            return None
+
+    def _lookup(self, ip_address: str) -> Optional[str]:
+        database = self.database
+        if database is not None:
+            return database.lookup(ip_address)
+        if self.online_fallback:
+            return self._lookup_online(ip_address)
+        return None
+
+    def _lookup_online(self, ip_address: str) -> Optional[str]:
+        try:
+            response = requests.get(self.online_url.format(ip_address), timeout=3)
+            response.raise_for_status()
+            data = response.json()
+            if data.get('status') == 'success':
+                return data.get('countryCode')
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+        return None
+
+
+# Global instance
+geoip_provider = GeoIPProvider()
+
+
+def get_geoip_provider() -> GeoIPProvider:
+    """Get the global GeoIP provider"""
+    return geoip_provider
+
+
+def geo_restrictions_problem(settings, provider: GeoIPProvider = None) -> Optional[str]:
+    """Why configured geo restrictions cannot be enforced, or None if they can"""
+    provider = provider or geoip_provider
+    if not settings.geo_restrictions_enabled:
+        return None
+    if not (settings.blocked_countries or settings.allowed_countries):
+        return None
+    if not provider.can_resolve:
+        return (f"Geographic restrictions are configured but no GeoIP database is loaded from "
+                f"{provider.path or '(unset)'} and GEOIP_ONLINE_FALLBACK is off; every country is "
+                f"allowed until a database is imported (python import_geoip.py)")
+    return None
+
+
+def check_geoip_configuration(db_session_factory) -> Optional[str]:
+    """Log an error at startup if configured geo restrictions cannot be enforced"""
+    from . import crud
+
+    db = db_session_factory()
+    try:
+        problem = geo_restrictions_problem(crud.get_global_settings_snapshot(db))
+    except Exception as e:
+        print(f"Warning: could not check geographic restrictions: {e}")
+        return None
+    finally:
+        db.close()
+    if problem:
+        print(f"[GEOIP ERROR] {problem}")
+    elif geoip_provider.database is None and geoip_provider.online_fallback:
+        print("Warning: no GeoIP database; looking countries up on ip-api.com until one is imported")
+    return problem
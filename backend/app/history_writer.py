@@ -0,0 +1,277 @@
+"""
+Code Generation History Writer Module
+
+Write-behind buffer for CodeGenerationHistory rows. Code views are the most
+frequent write in the system; instead of one INSERT + COMMIT per view, entries
+are queued in memory and a background thread bulk-inserts them every
+HISTORY_BATCH_SIZE entries or HISTORY_FLUSH_INTERVAL_MS milliseconds.
+
+Behaviour:
+- The queue is bounded by HISTORY_QUEUE_SIZE entries
+- When full, HISTORY_QUEUE_FULL_POLICY decides whether to drop the entry
+  ("drop", default) or block the request for up to HISTORY_BLOCK_TIMEOUT_MS
+  ("block") before dropping it
+- Pending entries are flushed on shutdown
+- When the writer is not running (tests, scripts) entries are written
+  synchronously with the caller's session
+
+The queue, background thread and batch insert live in BatchedWriter, which
+audit_writer.AuditWriter also builds on.
+"""
+
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+HISTORY_WRITER_ENABLED = os.getenv("HISTORY_WRITER_ENABLED", "true").lower() == "true"
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "1000"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_QUEUE_FULL_POLICY = os.getenv("HISTORY_QUEUE_FULL_POLICY", "drop").lower()  # drop or block
+HISTORY_BLOCK_TIMEOUT_MS = int(os.getenv("HISTORY_BLOCK_TIMEOUT_MS", "100"))
+
+
+class BatchedWriter:
+    """
+    Bounded queue of row dicts that a background thread bulk-inserts.
+
+    Subclasses implement _insert (and optionally _after_batch) and decide how
+    rows get into the queue.
+    """
+
+    thread_name = "batched-writer"
+    description = "rows"
+
+    def __init__(self, session_factory=None, batch_size: int = 200, flush_interval_ms: int = 1000,
+                 max_queue_size: int = 10000, full_policy: str = "drop"):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.full_policy = full_policy
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._write_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the background writer thread"""
+        if self.running:
+            return
+        if not self.session_factory:
+            raise ValueError(f"{type(self).__name__} requires a session factory")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the writer thread and flush everything still queued"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self) -> int:
+        """Synchronously write everything currently queued. Returns rows written."""
+        total = 0
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return total
+            total += self._write(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and throughput counters"""
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "max_queue_size": self._queue.maxsize,
+            "full_policy": self.full_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 1) if self.batches else 0,
+            "rows_per_second": round(self.written / self.write_seconds, 1) if self.write_seconds else 0
+        }
+
+    def _insert(self, db: Session, rows: List[Dict[str, Any]]):
+        """Add rows to the session's transaction (committed by the caller)"""
+        raise NotImplementedError
+
+    def _after_batch(self, batch: List[Dict[str, Any]]):
+        """Called with each batch once it has been written, outside the write lock"""
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                batch = self._collect()
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                print(f"{type(self).__name__} error: {e}")
+                time.sleep(self.flush_interval)
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        """Wait for up to batch_size entries or until the flush interval elapses"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 0.25)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        """Bulk insert a batch; on failure fall back to row-by-row so one bad row can't lose the rest"""
+        with self._write_lock:
+            start = time.perf_counter()
+            db = self.session_factory()
+            try:
+                try:
+                    self._insert(db, batch)
+                    db.commit()
+                    written = len(batch)
+                except Exception:
+                    db.rollback()
+                    written = 0
+                    for entry in batch:
+                        try:
+                            self._insert(db, [entry])
+                            db.commit()
+                            written += 1
+                        except Exception as e:
+                            db.rollback()
+                            self.failed += 1
+                            print(f"Failed to write {self.description}: {e}")
+            finally:
+                db.close()
+            self.write_seconds += time.perf_counter() - start
+            self.written += written
+            self.batches += 1
+        self._after_batch(batch)
+        return written
+
+
+class HistoryWriter(BatchedWriter):
+    """Buffers CodeGenerationHistory rows and bulk-inserts them in the background"""
+
+    thread_name = "history-writer"
+    description = "code generation history"
+
+    def __init__(self, session_factory=None, batch_size: int = HISTORY_BATCH_SIZE,
+                 flush_interval_ms: int = HISTORY_FLUSH_INTERVAL_MS,
+                 max_queue_size: int = HISTORY_QUEUE_SIZE,
+                 full_policy: str = HISTORY_QUEUE_FULL_POLICY,
+                 block_timeout_ms: int = HISTORY_BLOCK_TIMEOUT_MS):
+        if full_policy not in ("drop", "block"):
+            raise ValueError(f"Unknown history queue policy: {full_policy}")
+        super().__init__(session_factory, batch_size, flush_interval_ms, max_queue_size, full_policy)
+        self.block_timeout = block_timeout_ms / 1000.0
+
+    def record(self, db: Session, application_id: int, user_id: int,
+               ip_address: str = None, user_agent: str = None) -> bool:
+        """Record a single code generation. Returns False if the entry was dropped."""
+        return self.record_many(db, [application_id], user_id, ip_address, user_agent) == 1
+
+    def record_many(self, db: Session, application_ids: List[int], user_id: int,
+                    ip_address: str = None, user_agent: str = None) -> int:
+        """
+        Record code generations for several applications viewed in one request.
+
+        Queues the entries when the writer is running; otherwise adds them to
+        the caller's session and commits once. Returns the number of entries
+        accepted (entries dropped because the queue is full are not counted).
+        """
+        generated_at = datetime.utcnow()
+        entries = [
+            {
+                "application_id": application_id,
+                "user_id": user_id,
+                "ip_address": ip_address,
+                "user_agent": user_agent,
+                "generated_at": generated_at
+            }
+            for application_id in application_ids
+        ]
+        if not entries:
+            return 0
+
+        if not self.running:
+            db.add_all(models.CodeGenerationHistory(**entry) for entry in entries)
+            db.commit()
+            return len(entries)
+
+        accepted = 0
+        for entry in entries:
+            try:
+                if self.full_policy == "block":
+                    self._queue.put(entry, timeout=self.block_timeout)
+                else:
+                    self._queue.put_nowait(entry)
+            except queue.Full:
+                self.dropped += 1
+                continue
+            accepted += 1
+        self.enqueued += accepted
+        return accepted
+
+    def _insert(self, db: Session, rows: List[Dict[str, Any]]):
+        db.execute(insert(models.CodeGenerationHistory), rows)
+
+
+# Global history writer instance
+history_writer = HistoryWriter()
+
+
+def get_history_writer() -> HistoryWriter:
+    """Get the global history writer instance"""
+    return history_writer
+
+
+def initialize_history_writer(db_session_factory):
+    """Start the background history writer with database access"""
+    if not HISTORY_WRITER_ENABLED:
+        return
+    history_writer.session_factory = db_session_factory
+    history_writer.start()
+
+
+def shutdown_history_writer():
+    """Stop the background writer and flush pending history entries"""
+    history_writer.stop()
@@ -0,0 +1,301 @@
+"""
+Key Rotation Module
+
+Streams every encrypted column through a key ring that knows both the new
+and the old keys, re-encrypting each value under the new key (and in the
+current ciphertext format).
+
+Encrypted columns:
+- users.data_key        (ENCRYPTION_KEY) per-user keys wrapping application secrets
+- applications.secret   (ENCRYPTION_KEY) only legacy rows not yet migrated to
+                        envelope encryption; "e1:" secrets are skipped
+- users.totp_secret     (ENCRYPTION_KEY)
+- smtp_config.password  (SMTP_ENCRYPTION_KEY, falling back to ENCRYPTION_KEY)
+
+Rows are read in keyset-paginated chunks (WHERE id > last_id ORDER BY id
+LIMIT n), re-encrypted by a worker pool and written back with one commit per
+chunk, so a rotation over millions of rows never holds one giant
+transaction. After every chunk the last processed id is saved to a
+checkpoint file, and an interrupted rotation resumes where it stopped.
+
+Each write is guarded by the ciphertext that was read, so a value changed by
+the running application in the meantime is left alone rather than
+overwritten with a stale secret.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, update
+
+from . import models, secrets_encryption, smtp_encryption
+
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Per-token outcomes returned by the worker pool
+ROTATED = "rotated"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+@lru_cache(maxsize=8)
+def _key_ring_for(keys: Tuple[str, ...], secret_format: Optional[str]) -> secrets_encryption.KeyRing:
+    return secrets_encryption.KeyRing(list(keys), secret_format=secret_format)
+
+
+def rotate_tokens(keys: Tuple[str, ...], tokens: List[str],
+                  secret_format: Optional[str] = None) -> List[Tuple[str, Optional[str]]]:
+    """
+    Re-encrypt tokens under keys[0]. Runs inside the worker pool.
+
+    Plain-text (never encrypted) values and envelope-encrypted secrets (which
+    use a per-user data key, not the master key) are skipped, tokens that no
+    key can decrypt are reported as failed.
+    """
+    ring = _key_ring_for(keys, secret_format)
+    results = []
+    for token in tokens:
+        if not secrets_encryption.is_master_key_token(token):
+            results.append((SKIPPED, None))
+            continue
+        try:
+            results.append((ROTATED, ring.rotate(token)))
+        except ValueError:
+            results.append((FAILED, None))
+    return results
+
+
+def key_fingerprint(key: str) -> str:
+    """Short, non-reversible identifier for a key (stored in checkpoints)"""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class RotationTarget:
+    """One encrypted column and the keys used to rotate it"""
+
+    def __init__(self, name: str, model, column: str, keys: List[str], secret_format: Optional[str] = None):
+        if not keys:
+            raise ValueError(f"No keys configured for {name}")
+        self.name = name
+        self.model = model
+        self.column = column
+        # First key is the new key; the rest are only used to decrypt
+        self.keys = tuple(dict.fromkeys(keys))
+        # Ciphertext format to write (default: SECRET_FORMAT)
+        self.secret_format = secret_format
+
+    @property
+    def new_key(self) -> str:
+        return self.keys[0]
+
+
+class RotationStats:
+    """Counters for one rotated column"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = 0
+        self.rotated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.conflicts = 0
+        self.chunks = 0
+        self.elapsed = 0.0
+        self.failed_ids: List[int] = []
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "target": self.name,
+            "rows": self.rows,
+            "rotated": self.rotated,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "conflicts": self.conflicts,
+            "chunks": self.chunks,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1)
+        }
+
+
+class RotationCheckpoint:
+    """
+    Last processed id per target, persisted to a JSON file after every chunk.
+
+    The checkpoint records a fingerprint of the new key; a checkpoint written
+    for a different key is ignored so a new rotation always starts over.
+    """
+
+    def __init__(self, path: Optional[str], fingerprint: str):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.positions: Dict[str, int] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("key_fingerprint") == fingerprint:
+                self.positions = {k: int(v) for k, v in data.get("positions", {}).items()}
+
+    def get(self, target: str) -> int:
+        return self.positions.get(target, 0)
+
+    def set(self, target: str, last_id: int):
+        self.positions[target] = last_id
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key_fingerprint": self.fingerprint, "positions": self.positions}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.positions = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class KeyRotator:
+    """Rotates encrypted columns in keyset-paginated, individually committed chunks"""
+
+    def __init__(self, session_factory, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 4,
+                 use_processes: bool = False, checkpoint_path: Optional[str] = None,
+                 progress: Optional[Callable[[RotationStats], None]] = None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self.use_processes = use_processes
+        self.checkpoint_path = checkpoint_path
+        self.progress = progress
+
+    def run(self, targets: Iterable[RotationTarget]) -> List[RotationStats]:
+        """Rotate every target in turn, resuming from the checkpoint if one exists"""
+        targets = list(targets)
+        if not targets:
+            return []
+        checkpoint = RotationCheckpoint(self.checkpoint_path, key_fingerprint(targets[0].new_key))
+        pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+        with pool_class(max_workers=self.workers) as pool:
+            results = [self.rotate_target(target, pool, checkpoint) for target in targets]
+        checkpoint.clear()
+        return results
+
+    def rotate_target(self, target: RotationTarget, pool: Executor,
+                      checkpoint: RotationCheckpoint) -> RotationStats:
+        stats = RotationStats(target.name)
+        model = target.model
+        column = getattr(model, target.column)
+        table = model.__table__
+        guarded_update = (
+            update(table)
+            .where(and_(table.c.id == bindparam("b_id"), table.c[target.column] == bindparam("b_old")))
+            .values({target.column: bindparam("b_new")})
+        )
+
+        last_id = checkpoint.get(target.name)
+        start = time.perf_counter()
+        while True:
+            db = self.session_factory()
+            try:
+                rows = (
+                    db.query(model.id, column)
+                    .filter(model.id > last_id, column.isnot(None), column != "")
+                    .order_by(model.id)
+                    .limit(self.chunk_size)
+                    .all()
+                )
+                if not rows:
+                    break
+
+                outcomes = self._rotate_chunk(pool, target, [token for _, token in rows])
+                params = []
+                for (row_id, token), (outcome, new_token) in zip(rows, outcomes):
+                    if outcome == ROTATED:
+                        params.append({"b_id": row_id, "b_old": token, "b_new": new_token})
+                    elif outcome == SKIPPED:
+                        stats.skipped += 1
+                    else:
+                        stats.failed += 1
+                        stats.failed_ids.append(row_id)
+
+                if params:
+                    result = db.execute(guarded_update, params)
+                    updated = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(params)
+                    stats.rotated += updated
+                    stats.conflicts += len(params) - updated
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            last_id = rows[-1][0]
+            checkpoint.set(target.name, last_id)
+            stats.rows += len(rows)
+            stats.chunks += 1
+            stats.elapsed = time.perf_counter() - start
+            if self.progress:
+                self.progress(stats)
+
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    def _rotate_chunk(self, pool: Executor, target: RotationTarget,
+                      tokens: List[str]) -> List[Tuple[str, Optional[str]]]:
+        """Split a chunk across the pool, preserving token order"""
+        size = max(1, -(-len(tokens) // self.workers))
+        slices = [tokens[i:i + size] for i in range(0, len(tokens), size)]
+        results = []
+        for part in pool.map(rotate_tokens, [target.keys] * len(slices), slices,
+                             [target.secret_format] * len(slices)):
+            results.extend(part)
+        return results
+
+
+def default_targets(new_key: Optional[str] = None, old_keys: Optional[List[str]] = None,
+                    smtp_new_key: Optional[str] = None) -> List[RotationTarget]:
+    """
+    Build the rotation targets for every encrypted column.
+
+    By default secrets are rotated to the current ENCRYPTION_KEY, accepting
+    anything in PREVIOUS_ENCRYPTION_KEYS, i.e. deploy the new key with the old
+    one listed as previous and then run the rotation. SMTP passwords follow
+    ENCRYPTION_KEY unless a dedicated SMTP_ENCRYPTION_KEY is configured, in
+    which case they are only rotated when smtp_new_key is given.
+    """
+    ring = secrets_encryption.KeyRing.load()
+    new_key = new_key or ring.primary_key
+    old_keys = list(old_keys) if old_keys is not None else ring.keys
+    secret_keys = [new_key] + old_keys
+
+    targets = [
+        RotationTarget("users.data_key", models.User, "data_key", secret_keys),
+        RotationTarget("applications.secret", models.Application, "secret", secret_keys),
+        RotationTarget("users.totp_secret", models.User, "totp_secret", secret_keys),
+    ]
+
+    current_smtp_key = smtp_encryption.get_smtp_encryption_key()
+    if smtp_new_key:
+        targets.append(RotationTarget(
+            "smtp_config.password", models.SMTPConfig, "password", [smtp_new_key, current_smtp_key] + old_keys,
+            secret_format="fernet"
+        ))
+    elif not os.getenv("SMTP_ENCRYPTION_KEY"):
+        # smtp_encryption only reads Fernet tokens
+        targets.append(RotationTarget(
+            "smtp_config.password", models.SMTPConfig, "password", secret_keys, secret_format="fernet"
+        ))
+    else:
+        print("Skipping smtp_config.password: SMTP_ENCRYPTION_KEY is set and no new SMTP key was given")
+    return targets
@@ -1,15 +1,21 @@
 import os
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from sqlalchemy import text
 from slowapi.errors import RateLimitExceeded
 from .routers import users, applications, auth, admin, webauthn, notifications, sync, sharing
 from .database import engine, SessionLocal
-from .rate_limit import limiter, get_rate_limit_exceeded_handler
-from . import models
+from .rate_limit import limiter, get_rate_limit_exceeded_handler, compile_role_limits, enforce_role_rate_limits
+from . import models, secrets_encryption
 from .security_monitor import initialize_security_monitoring
+from .history_writer import initialize_history_writer, shutdown_history_writer
+from .audit_writer import initialize_audit_writer, shutdown_audit_writer
+from .session_revocation import initialize_revocation_index, shutdown_revocation_index
+from .audit_archive import initialize_audit_archiver, shutdown_audit_archiver
+from .password_hashing import PasswordHashingBusy, configure_request_threadpool
+from .geoip import check_geoip_configuration
 
 # Create tables without startup
 # try:
@@ -24,6 +30,8 @@ app = FastAPI(
     docs_url="/api/docs",
     redoc_url=None,  # We'll use a custom optimized ReDoc endpoint
     openapi_url="/api/openapi.json",
+    # Per-role limits for authenticated requests, checked once per request after routing
+    dependencies=[Depends(enforce_role_rate_limits)],
 )
 
 # Get allowed origins from environment, default to localhost for development
@@ -38,15 +46,94 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
 # Add rate limiter to app state and exception handler
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, get_rate_limit_exceeded_handler())
 
+
+@app.exception_handler(PasswordHashingBusy)
+async def password_hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    """Shed load quickly when the password hashing queue is full"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # Initialize security monitoring
 initialize_security_monitoring(SessionLocal)
 
+
+@app.on_event("startup")
+def load_encryption_keys():
+    """Load the secrets key ring once and allow reloading it with SIGHUP"""
+    secrets_encryption.get_key_ring()
+    secrets_encryption.install_reload_signal_handler()
+
+
+@app.on_event("startup")
+async def size_request_threadpool():
+    """Apply REQUEST_THREADPOOL_SIZE, which password hashing is sized against"""
+    configure_request_threadpool()
+
+
+@app.on_event("startup")
+def check_geo_restrictions():
+    """Report geographic restrictions that cannot be enforced without a GeoIP database"""
+    check_geoip_configuration(SessionLocal)
+
+
+@app.on_event("startup")
+def start_history_writer():
+    """Start the write-behind buffer for code generation history"""
+    initialize_history_writer(SessionLocal)
+
+
+@app.on_event("shutdown")
+def flush_history_writer():
+    """Write out any code generation history still queued"""
+    shutdown_history_writer()
+
+
+@app.on_event("startup")
+def start_audit_writer():
+    """Start the write-behind buffer for audit logs"""
+    initialize_audit_writer(SessionLocal)
+
+
+@app.on_event("shutdown")
+def flush_audit_writer():
+    """Write out any audit logs still queued"""
+    shutdown_audit_writer()
+
+
+@app.on_event("startup")
+def load_revoked_sessions():
+    """Load revoked session tokens and resync them periodically"""
+    initialize_revocation_index(SessionLocal)
+
+
+@app.on_event("shutdown")
+def stop_revocation_resync():
+    """Stop the revoked-session resync thread"""
+    shutdown_revocation_index()
+
+
+@app.on_event("startup")
+def start_audit_archiver():
+    """Start the audit log retention job (if AUDIT_RETENTION_DAYS is set)"""
+    initialize_audit_archiver(SessionLocal)
+
+
+@app.on_event("shutdown")
+def stop_audit_archiver():
+    """Stop the audit log retention job"""
+    shutdown_audit_archiver()
+
+
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(users.router, prefix="/api/users", tags=["User Management"])
 app.include_router(applications.router, prefix="/api/applications", tags=["2FA Applications"])
@@ -56,6 +143,9 @@ app.include_router(notifications.router, prefix="/api/notifications", tags=["Not
 app.include_router(sync.router, prefix="/api/sync", tags=["Multi-Device Sync"])
 app.include_router(sharing.router, prefix="/api/sharing", tags=["Account Sharing"])
 
+# Build the per-role rate limit items of every route once
+compile_role_limits(app.routes)
+
 
 def custom_openapi():
     """Custom OpenAPI schema with enhanced styling and information"""
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Boolean, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -19,6 +19,7 @@ class User(Base):
     settings = Column(JSON, default={"theme": "light", "autoLock": 5, "codeFormat": "spaced"})  # User preferences
     totp_secret = Column(String, nullable=True)  # TOTP secret for 2FA (encrypted)
     totp_enabled = Column(Boolean, default=False)  # Whether TOTP 2FA is enabled
+    data_key = Column(String, nullable=True)  # Per-user data key, wrapped by the master key (envelope_encryption)
 
     # Account lockout fields
     failed_login_attempts = Column(Integer, default=0)  # Counter for failed login attempts
@@ -37,7 +38,7 @@ class Application(Base):
     name = Column(String, index=True)
     icon = Column(String, nullable=True, default=None)  # Custom emoji or icon
     color = Column(String, nullable=True, default='#6B46C1')  # Background color for the icon
-    secret = Column(Text)  # Encrypted with Fernet (secrets_encryption module) - NEVER stored in plain text
+    secret = Column(Text)  # Encrypted with the owner's data key (envelope_encryption module) - NEVER stored in plain text
     backup_key = Column(String)
     otp_type = Column(String, default="TOTP")  # TOTP or HOTP
     counter = Column(Integer, default=0)  # For HOTP counter
@@ -103,6 +104,8 @@ class GlobalSettings(Base):
     allowed_countries = Column(JSON, default=[])  # List of allowed country codes (ISO 3166-1 alpha-2)
     blocked_countries = Column(JSON, default=[])  # List of blocked country codes
     
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every update; keys compiled caches and snapshots
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -126,6 +129,7 @@ class OIDCConfig(Base):
     scope = Column(String, default="openid email profile")
     admin_groups = Column(JSON, default=["administrators", "admins"])  # Groups that map to admin role
     user_groups = Column(JSON, default=["users"])  # Groups that map to user role
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every update; revalidates cached snapshots
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -232,8 +236,8 @@ class AuditLog(Base):
     __tablename__ = "audit_logs"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
-    action = Column(String, index=True)  # login, logout, account_added, password_changed, etc
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    action = Column(String)  # login, logout, account_added, password_changed, etc
     resource_type = Column(String, nullable=True)  # user, account, settings
     resource_id = Column(Integer, nullable=True)
     ip_address = Column(String, nullable=True)
@@ -241,10 +245,52 @@ class AuditLog(Base):
     status = Column(String, default="success")  # success, failed
     details = Column(JSON, nullable=True)  # Additional context
     reason = Column(String, nullable=True)  # Failure reason if status is failed
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
 
+    # Newest-first listings (keyset pagination on created_at, id), optionally
+    # filtered by user, action or status
+    __table_args__ = (
+        Index("ix_audit_logs_created_at_id", "created_at", "id"),
+        Index("ix_audit_logs_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_audit_logs_action_created_at", "action", "created_at", "id"),
+        Index("ix_audit_logs_status_created_at", "status", "created_at", "id"),
+    )
+
+
+class LoginDailyRollup(Base):
+    """
+    Login successes and failures per UTC day, maintained as audit events are
+    written (see dashboard_rollups).
+    """
+    __tablename__ = "login_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    success_count = Column(Integer, nullable=False, default=0)
+    failure_count = Column(Integer, nullable=False, default=0)
+
+
+class UserLoginDailyRollup(Base):
+    """
+    Successful logins per user and UTC day (see dashboard_rollups).
+    """
+    __tablename__ = "user_login_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)  # No foreign key: rows of deleted users are simply not joined
+    login_count = Column(Integer, nullable=False, default=0)
+
+
+class ApplicationCategoryRollup(Base):
+    """
+    Number of 2FA accounts per category (see dashboard_rollups).
+    """
+    __tablename__ = "application_category_rollups"
+
+    category = Column(String, primary_key=True)  # "" for accounts without a category
+    account_count = Column(Integer, nullable=False, default=0)
+
 
 class WebAuthnCredential(Base):
     """
@@ -363,6 +409,7 @@ class PasswordPolicy(Base):
     # Breach checking
     check_breach_database = Column(Boolean, default=True)  # Use HaveIBeenPwned API
     
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped on every update; revalidates cached snapshots
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -0,0 +1,145 @@
+"""
+OTP Engine Module
+
+Fast RFC 4226 (HOTP) / RFC 6238 (TOTP) code generation for many secrets at once.
+
+pyotp builds a new TOTP/HOTP object and re-decodes the base32 secret for every
+code. This engine decodes each secret once into an OTPKey that holds a keyed
+HMAC object; generating a code only copies that precomputed HMAC state and
+feeds it the 8-byte counter.
+
+OTPKeys hold the raw secret, so they are built per request (or per stream)
+and never cached globally; decrypted secrets are cached only by secret_cache,
+which is opt-in, bounded and zeroes entries when they are evicted.
+
+Supports:
+- SHA1, SHA256 and SHA512 digests
+- 6 or 8 digit codes
+- Custom TOTP periods
+- Batch generation for many (key, timestep) pairs, including
+  look-behind/look-ahead windows
+"""
+
+import base64
+import hmac
+import struct
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+SUPPORTED_DIGESTS = ("sha1", "sha256", "sha512")
+SUPPORTED_DIGITS = (6, 8)
+DEFAULT_PERIOD = 30
+
+_COUNTER = struct.Struct(">Q")
+_TRUNCATE = struct.Struct(">I")
+_MODULI = {digits: 10 ** digits for digits in SUPPORTED_DIGITS}
+
+
+def decode_secret(secret: str) -> bytes:
+    """
+    Decode a base32 OTP secret into raw key bytes.
+
+    Whitespace and lowercase letters are accepted and missing padding is
+    added, matching what authenticator apps accept.
+
+    Raises:
+        ValueError: If the secret is not valid base32
+    """
+    if not secret:
+        raise ValueError("OTP secret is empty")
+    normalized = "".join(secret.split()).upper()
+    normalized += "=" * ((8 - len(normalized) % 8) % 8)
+    try:
+        return base64.b32decode(normalized)
+    except Exception as e:
+        raise ValueError(f"Invalid base32 OTP secret: {str(e)}")
+
+
+class OTPKey:
+    """A decoded OTP secret with precomputed HMAC state"""
+
+    __slots__ = ("digest", "digits", "period", "_hmac", "_modulus")
+
+    def __init__(self, secret: Union[str, bytes], digest: str = "sha1", digits: int = 6,
+                 period: int = DEFAULT_PERIOD):
+        digest = digest.lower()
+        if digest not in SUPPORTED_DIGESTS:
+            raise ValueError(f"Unsupported OTP digest: {digest}")
+        if digits not in SUPPORTED_DIGITS:
+            raise ValueError(f"Unsupported number of OTP digits: {digits}")
+        if period <= 0:
+            raise ValueError("OTP period must be positive")
+
+        key = secret if isinstance(secret, bytes) else decode_secret(secret)
+        self.digest = digest
+        self.digits = digits
+        self.period = period
+        self._hmac = hmac.new(key, digestmod=digest)
+        self._modulus = _MODULI[digits]
+
+    def at_counter(self, counter: int) -> str:
+        """Generate the code for an HOTP counter / TOTP timestep"""
+        mac = self._hmac.copy()
+        mac.update(_COUNTER.pack(counter))
+        digest = mac.digest()
+        offset = digest[-1] & 0x0F
+        code = (_TRUNCATE.unpack_from(digest, offset)[0] & 0x7FFFFFFF) % self._modulus
+        return str(code).zfill(self.digits)
+
+    def timestep(self, for_time: Optional[float] = None) -> int:
+        """Get the TOTP timestep for a unix timestamp (default: now)"""
+        if for_time is None:
+            for_time = time.time()
+        return int(for_time) // self.period
+
+    def at(self, for_time: Optional[float] = None, offset: int = 0) -> str:
+        """Generate the TOTP code for a timestamp, optionally offset by whole periods"""
+        return self.at_counter(self.timestep(for_time) + offset)
+
+    def window(self, for_time: Optional[float] = None, behind: int = 0, ahead: int = 0) -> List[str]:
+        """Generate codes from `behind` periods before to `ahead` periods after for_time"""
+        step = self.timestep(for_time)
+        return [self.at_counter(step + offset) for offset in range(-behind, ahead + 1)]
+
+    def remaining_seconds(self, for_time: Optional[float] = None) -> int:
+        """Seconds until the TOTP code for for_time expires"""
+        if for_time is None:
+            for_time = time.time()
+        return self.period - int(for_time) % self.period
+
+    def verify(self, code: str, for_time: Optional[float] = None, valid_window: int = 0) -> bool:
+        """Check a TOTP code, accepting valid_window periods of clock drift either way"""
+        if not code:
+            return False
+        code = str(code).strip()
+        return any(
+            hmac.compare_digest(candidate, code)
+            for candidate in self.window(for_time, behind=valid_window, ahead=valid_window)
+        )
+
+
+def generate_codes(pairs: Iterable[Tuple[OTPKey, int]]) -> List[str]:
+    """
+    Generate codes for many (key, counter/timestep) pairs in one call.
+
+    Args:
+        pairs: Iterable of (OTPKey, counter) tuples
+
+    Returns:
+        Codes in the same order as the pairs
+    """
+    return [key.at_counter(counter) for key, counter in pairs]
+
+
+def generate_windows(keys: Sequence[OTPKey], for_time: Optional[float] = None,
+                     behind: int = 0, ahead: int = 0) -> List[List[str]]:
+    """
+    Generate TOTP code windows for many keys against one timestamp.
+
+    Each result list runs from `behind` periods before to `ahead` periods
+    after the current period, so with behind=0, ahead=1 every entry is
+    [current_code, next_code].
+    """
+    if for_time is None:
+        for_time = time.time()
+    return [key.window(for_time, behind=behind, ahead=ahead) for key in keys]
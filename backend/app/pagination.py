@@ -0,0 +1,37 @@
+"""
+Keyset Pagination Module
+
+Opaque cursors for lists ordered newest first by (created_at, id), such as the
+audit log. A page continues strictly after the last row of the previous one,
+so the database seeks straight to it through a (..., created_at, id) index
+instead of scanning and discarding OFFSET rows.
+
+- The cursor of the next page is returned in the X-Next-Cursor response
+  header whenever a page is full; list bodies are unchanged
+- Cursors are URL-safe base64 and carry no secrets; a malformed cursor
+  raises ValueError
+"""
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Tuple
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Cursor positioned after the row with this (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """(created_at, id) of a cursor from encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("Invalid pagination cursor") from e
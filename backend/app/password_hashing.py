@@ -0,0 +1,193 @@
+"""
+Password Hashing Module
+
+Runs Argon2 hashing and verification on a dedicated, bounded worker pool
+instead of the request threads.
+
+Argon2 is deliberately slow and memory-hard. Run directly in the sync login,
+signup and password handlers it occupies the server's shared request
+threadpool, so a burst of logins starves every other endpoint. Here:
+
+- At most PASSWORD_HASH_WORKERS hashes run at once
+- At most PASSWORD_HASH_QUEUE_SIZE more may wait for a worker; anything
+  beyond that fails immediately with PasswordHashingBusy (HTTP 503 with
+  Retry-After)
+- Every running or waiting hash still holds the request thread that asked
+  for it, so workers + queue is capped at a quarter of the request
+  threadpool (REQUEST_THREADPOOL_SIZE, applied at startup); a burst of
+  logins can never take more than that share of the threads other
+  endpoints need
+- Argon2 parameters come from ARGON2_TIME_COST, ARGON2_MEMORY_COST and
+  ARGON2_PARALLELISM; hashes made with other parameters are upgraded the
+  next time the user logs in (see verify_and_update)
+- Queue wait and hash time are tracked per operation (stats())
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "4"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+# Threads that run sync endpoints and dependencies (AnyIO's default is 40)
+REQUEST_THREADPOOL_SIZE = int(os.getenv("REQUEST_THREADPOOL_SIZE", "40"))
+# Share of those threads that may be waiting on password hashing at once
+PASSWORD_HASH_MAX_THREADS = max(1, REQUEST_THREADPOOL_SIZE // 4)
+
+# Argon2id parameters; the defaults match the hashes created so far (3 passes, 64 MiB, 4 lanes)
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+
+def build_context(time_cost: int = ARGON2_TIME_COST, memory_cost: int = ARGON2_MEMORY_COST,
+                  parallelism: int = ARGON2_PARALLELISM) -> CryptContext:
+    """CryptContext hashing with the given Argon2 parameters and flagging others for rehash"""
+    return CryptContext(
+        schemes=["argon2"],
+        deprecated="auto",
+        argon2__time_cost=time_cost,
+        argon2__memory_cost=memory_cost,
+        argon2__parallelism=parallelism
+    )
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing queue is full"""
+
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        super().__init__("Password hashing is busy, please retry")
+        self.retry_after = retry_after
+
+
+class _OperationStats:
+    __slots__ = ("count", "queue_wait_total", "queue_wait_max", "run_total", "run_max")
+
+    def __init__(self):
+        self.count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def record(self, queue_wait: float, run: float):
+        self.count += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.run_total += run
+        self.run_max = max(self.run_max, run)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "queue_wait_avg_ms": round(self.queue_wait_total / self.count * 1000, 2) if self.count else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 2),
+            "hash_time_avg_ms": round(self.run_total / self.count * 1000, 2) if self.count else 0.0,
+            "hash_time_max_ms": round(self.run_max * 1000, 2)
+        }
+
+
+class PasswordHasher:
+    """Bounded worker pool for password hashing and verification"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE_SIZE,
+                 context: Optional[CryptContext] = None, max_threads: int = PASSWORD_HASH_MAX_THREADS):
+        self.workers = min(max(1, workers), max(1, max_threads))
+        self.queue_size = min(max(0, queue_size), max(0, max_threads - self.workers))
+        if (self.workers, self.queue_size) != (max(1, workers), max(0, queue_size)):
+            print(f"Warning: password hashing limited to {self.workers} workers + {self.queue_size} queued "
+                  f"so it holds at most {max_threads} request threads")
+        self.context = context or build_context()
+        # One permit per running or waiting operation
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _OperationStats] = {}
+        self._pending = 0
+        self.rejected = 0
+
+    def hash(self, password: str, block: bool = False) -> str:
+        """Hash a password with the current Argon2 parameters"""
+        return self._run("hash", self.context.hash, block, password)
+
+    def verify(self, password: str, hashed: str, block: bool = False) -> bool:
+        """Check a password against a stored hash"""
+        return self._run("verify", self.context.verify, block, password, hashed)
+
+    def verify_and_update(self, password: str, hashed: str,
+                          block: bool = False) -> Tuple[bool, Optional[str]]:
+        """
+        Check a password and, if the hash uses outdated parameters, rehash it.
+
+        Returns:
+            (valid, new_hash) where new_hash is None unless the stored hash
+            should be replaced
+        """
+        return self._run("verify", self.context.verify_and_update, block, password, hashed)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool size, queue usage and per-operation timings"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "request_threadpool_size": REQUEST_THREADPOOL_SIZE,
+                "in_flight": self._pending,
+                "rejected": self.rejected,
+                "operations": {name: stats.to_dict() for name, stats in self._stats.items()}
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _run(self, operation: str, func: Callable, block: bool, *args):
+        # Fail fast when every worker is busy and the queue is full (unless
+        # the caller, e.g. a bulk import, prefers to wait)
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashingBusy()
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._stats.setdefault(operation, _OperationStats()).record(
+                        started - submitted, finished - started
+                    )
+
+        try:
+            return self._executor.submit(timed).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+
+# Global instance
+password_hasher = PasswordHasher()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Get the global password hasher"""
+    return password_hasher
+
+
+def configure_request_threadpool(size: int = REQUEST_THREADPOOL_SIZE):
+    """Size the threadpool that runs sync endpoints; call from the event loop"""
+    import anyio.to_thread
+
+    anyio.to_thread.current_default_thread_limiter().total_tokens = size
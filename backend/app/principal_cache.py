@@ -0,0 +1,235 @@
+"""
+Authenticated Principal Cache Module
+
+In-process cache of verified access tokens for auth.get_current_user and the
+rate-limit key function. Without it every authenticated request verifies its
+JWT (twice, once for the rate-limit key) and loads the full User row.
+
+- Entries are keyed by token jti; a lookup must present the exact token that
+  was verified (compared by SHA256), so a forged token reusing a jti misses
+- Bounded by PRINCIPAL_CACHE_MAX_ENTRIES (LRU); an entry lives for at most
+  PRINCIPAL_CACHE_TTL_SECONDS and never past the token's own expiry
+- A cached principal holds a snapshot of the user's columns that
+  get_current_user attaches to the request's session without a query
+- Invalidated when a User row is changed or deleted through the ORM (role,
+  password, lock state, settings, ...), when a session is revoked, and by
+  crud.revoke_all_user_sessions
+- Invalidation is per process: with several workers, a change made in one
+  worker is picked up by the others after at most the TTL
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Dict, Iterable, Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import models
+
+
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() == "true"
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+_PENDING_USERS_KEY = "principal_cache_users"
+_PENDING_TOKENS_KEY = "principal_cache_tokens"
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class Principal:
+    """A verified access token and, once loaded, a snapshot of its user"""
+
+    __slots__ = ("user_id", "jti", "expires_at", "user_state", "token_role")
+
+    def __init__(self, user_id: int, jti: Optional[str], expires_at: Optional[float],
+                 user_state: Optional[Dict[str, Any]] = None, token_role: Optional[str] = None):
+        self.user_id = user_id
+        self.jti = jti
+        self.expires_at = expires_at
+        self.user_state = user_state
+        self.token_role = token_role
+
+    @property
+    def role(self) -> Optional[str]:
+        """The user's role: from the cached user if loaded, else the token's "role" claim"""
+        if self.user_state is not None:
+            return self.user_state.get("role")
+        return self.token_role
+
+
+class _Entry:
+    __slots__ = ("digest", "principal", "expires_at")
+
+    def __init__(self, digest: bytes, principal: Principal, expires_at: float):
+        self.digest = digest
+        self.principal = principal
+        self.expires_at = expires_at
+
+
+class PrincipalCache:
+    """Bounded LRU + TTL cache of verified principals keyed by token jti"""
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS,
+                 enabled: bool = PRINCIPAL_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, jti: Optional[str], token: str) -> Optional[Principal]:
+        """Return the cached principal if this exact token was verified before"""
+        if not self.enabled or not jti:
+            return None
+        digest = token_digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(jti)
+            if entry is None or entry.digest != digest:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                self._remove(jti)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(jti)
+            self.hits += 1
+            return entry.principal
+
+    def put(self, token: str, principal: Principal):
+        """Cache a verified principal until the TTL or the token expiry, whichever is first"""
+        if not self.enabled or not principal.jti or self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if principal.expires_at is not None:
+            expires_at = min(expires_at, principal.expires_at)
+        entry = _Entry(token_digest(token), principal, expires_at)
+        with self._lock:
+            if principal.jti in self._entries:
+                self._remove(principal.jti)
+            self._entries[principal.jti] = entry
+            self._by_user.setdefault(principal.user_id, set()).add(principal.jti)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_token(self, jti: Optional[str]):
+        """Drop the principal of one token (e.g. a revoked session)"""
+        if not jti:
+            return
+        with self._lock:
+            if jti in self._entries:
+                self._remove(jti)
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """Drop every cached principal of a user"""
+        with self._lock:
+            for jti in list(self._by_user.get(user_id, ())):
+                self._remove(jti)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "users": len(self._by_user),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _remove(self, jti: str):
+        # Caller must hold self._lock
+        entry = self._entries.pop(jti)
+        user_jtis = self._by_user.get(entry.principal.user_id)
+        if user_jtis is not None:
+            user_jtis.discard(jti)
+            if not user_jtis:
+                del self._by_user[entry.principal.user_id]
+
+
+# Global instance
+principal_cache = PrincipalCache()
+
+
+def get_principal_cache() -> PrincipalCache:
+    """Get the global principal cache"""
+    return principal_cache
+
+
+_USER_COLUMNS = [attr.key for attr in inspect(models.User).column_attrs]
+
+
+def snapshot_user(user: models.User) -> Dict[str, Any]:
+    """Column values of a loaded user, for caching"""
+    return {key: deepcopy(getattr(user, key)) for key in _USER_COLUMNS}
+
+
+def attach_user(db: Session, user_state: Dict[str, Any]) -> models.User:
+    """
+    Rebuild a cached user in the given session without querying the database.
+
+    The result is a regular persistent instance: changes to it are flushed
+    (and invalidate the cache) like those of a loaded user.
+    """
+    user = inspect(models.User).class_manager.new_instance()
+    for key, value in user_state.items():
+        # JSON columns (settings) are mutable; never share them between requests
+        set_committed_value(user, key, deepcopy(value) if isinstance(value, (dict, list)) else value)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
+# Invalidate on ORM changes once they are committed, so a concurrent request
+# cannot re-cache the old row between the invalidation and the commit
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session: Session, flush_context):
+    users: Set[int] = session.info.setdefault(_PENDING_USERS_KEY, set())
+    tokens: Set[str] = session.info.setdefault(_PENDING_TOKENS_KEY, set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.User) and obj.id is not None:
+            users.add(obj.id)
+        elif isinstance(obj, models.UserSession) and obj.revoked and obj.token_jti:
+            tokens.add(obj.token_jti)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidations(session: Session):
+    users: Iterable[int] = session.info.pop(_PENDING_USERS_KEY, ())
+    tokens: Iterable[str] = session.info.pop(_PENDING_TOKENS_KEY, ())
+    for user_id in users:
+        principal_cache.invalidate_user(user_id)
+    for jti in tokens:
+        principal_cache.invalidate_token(jti)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session: Session):
+    session.info.pop(_PENDING_USERS_KEY, None)
+    session.info.pop(_PENDING_TOKENS_KEY, None)
@@ -8,20 +8,25 @@ Provides configurable rate limiting for API endpoints to prevent:
 
 Enhanced with:
 - Per-user rate limiting for authenticated endpoints
-- Progressive delays for repeated violations
-- Role-based rate limits
+- Progressive penalties for repeated violations (429 with Retry-After)
+- Role-based rate limits (precompiled per route and role, see enforce_role_rate_limits)
 - Real-time monitoring and alerts
+- Sliding-window-counter limits in a pluggable storage backend
+  (RATE_LIMIT_STORAGE_URI: memory:// or sqlite:///path, see rate_limit_storage)
 """
 
 import os
 import time
-from typing import Optional, Dict, Any
+from math import ceil
+from typing import Any, Callable, Dict, Iterable, Optional
+from limits import RateLimitItem, parse
+from limits.storage import storage_from_string
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from fastapi import Request, HTTPException
-from jose import jwt, JWTError
-from .auth import SECRET_KEY, ALGORITHM
+from . import rate_limit_storage  # noqa: F401 - registers the sqlite:// storage scheme
+from .auth import get_request_principal
 
 
 # Get rate limit configuration from environment variables
@@ -39,6 +44,11 @@ ADMIN_API_RATE_LIMIT = os.getenv("ADMIN_API_RATE_LIMIT", "500/minute")
 # Progressive delay configuration
 PROGRESSIVE_DELAY_BASE = int(os.getenv("PROGRESSIVE_DELAY_BASE", "2"))  # Base delay in seconds
 PROGRESSIVE_DELAY_MAX = int(os.getenv("PROGRESSIVE_DELAY_MAX", "300"))  # Max delay in seconds
+VIOLATION_WINDOW_SECONDS = int(os.getenv("VIOLATION_WINDOW_SECONDS", "3600"))  # Violations are forgotten after this
+
+# Counter storage and algorithm. Use sqlite:///path when running several workers on one host.
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
 
 
 def get_client_ip(request: Request) -> str:
@@ -70,18 +80,11 @@ def get_user_id_from_token(request: Request) -> Optional[int]:
     """
     Extract user ID from JWT token in Authorization header.
     Returns None if no valid token found.
-    """
-    auth_header = request.headers.get("authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return None
 
-    token = auth_header.split(" ")[1]
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        return int(user_id) if user_id else None
-    except (JWTError, ValueError):
-        return None
+    Shares the verified principal (and its cache) with auth.get_current_user.
+    """
+    principal = get_request_principal(request)
+    return principal.user_id if principal else None
 
 
 def get_rate_limit_key(request: Request) -> str:
@@ -98,58 +101,53 @@ def get_rate_limit_key(request: Request) -> str:
 
 
 # Create limiter with custom key function
-limiter = Limiter(key_func=get_rate_limit_key)
+limiter = Limiter(key_func=get_rate_limit_key, storage_uri=RATE_LIMIT_STORAGE_URI, strategy=RATE_LIMIT_STRATEGY)
 
 
-# Global storage for violation tracking (in production, use Redis)
-_violation_counts: Dict[str, Dict[str, Any]] = {}
+# Violation counters and penalties live in the same kind of storage as the
+# limits, so they expire on their own and are shared between workers
+violation_storage = storage_from_string(RATE_LIMIT_STORAGE_URI)
 
 
 def get_progressive_delay(key: str, endpoint: str) -> float:
     """
-    Calculate progressive delay based on violation history.
-    Returns delay in seconds (0 if no delay needed).
+    Get the remaining penalty for a key after repeated violations.
+    Returns seconds until requests are accepted again (0 if not penalized).
     """
-    now = time.time()
-    violation_key = f"{key}:{endpoint}"
-
-    if violation_key not in _violation_counts:
-        _violation_counts[violation_key] = {
-            "count": 0,
-            "last_violation": 0,
-            "reset_time": now + 3600  # Reset after 1 hour
-        }
+    penalty_key = f"penalty/{key}/{endpoint}"
+    if violation_storage.get(penalty_key) <= 0:
+        return 0
+    return max(0.0, violation_storage.get_expiry(penalty_key) - time.time())
 
-    violation_data = _violation_counts[violation_key]
-
-    # Reset if window expired
-    if now > violation_data["reset_time"]:
-        violation_data["count"] = 0
-        violation_data["reset_time"] = now + 3600
-
-    # Calculate delay based on violation count
-    if violation_data["count"] > 0:
-        delay = min(PROGRESSIVE_DELAY_BASE * (2 ** (violation_data["count"] - 1)), PROGRESSIVE_DELAY_MAX)
-        return delay
-
-    return 0
 
+def record_violation(key: str, endpoint: str) -> float:
+    """
+    Record a rate limit violation and start a penalty that doubles with every
+    violation within VIOLATION_WINDOW_SECONDS (capped at PROGRESSIVE_DELAY_MAX).
+    Returns the penalty in seconds.
+    """
+    count = violation_storage.incr(f"violations/{key}/{endpoint}", VIOLATION_WINDOW_SECONDS)
+    delay = min(PROGRESSIVE_DELAY_BASE * (2 ** (count - 1)), PROGRESSIVE_DELAY_MAX)
+    penalty_key = f"penalty/{key}/{endpoint}"
+    violation_storage.clear(penalty_key)
+    violation_storage.incr(penalty_key, delay)
+    return delay
 
-def record_violation(key: str, endpoint: str):
-    """Record a rate limit violation for progressive delay calculation."""
-    now = time.time()
-    violation_key = f"{key}:{endpoint}"
 
-    if violation_key not in _violation_counts:
-        _violation_counts[violation_key] = {
-            "count": 0,
-            "last_violation": 0,
-            "reset_time": now + 3600
-        }
+def enforce_progressive_delay(key: str, endpoint: str):
+    """
+    Reject a penalized key with 429 and Retry-After.
 
-    violation_data = _violation_counts[violation_key]
-    violation_data["count"] += 1
-    violation_data["last_violation"] = now
+    Penalties used to be served by sleeping in the request thread, which
+    held a worker for up to PROGRESSIVE_DELAY_MAX seconds per request.
+    """
+    delay = get_progressive_delay(key, endpoint)
+    if delay > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(max(1, ceil(delay)))}
+        )
 
 
 def get_user_rate_limit(user_role: Optional[str] = None) -> str:
@@ -160,9 +158,22 @@ def get_user_rate_limit(user_role: Optional[str] = None) -> str:
         return USER_API_RATE_LIMIT
 
 
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """slowapi's 429 response, with a Retry-After header for the limit that was hit."""
+    response = _rate_limit_exceeded_handler(request, exc)
+    current_limit = getattr(request.state, "view_rate_limit", None)
+    if current_limit and "Retry-After" not in response.headers:
+        try:
+            reset_at, _ = limiter.limiter.get_window_stats(current_limit[0], *current_limit[1])
+            response.headers["Retry-After"] = str(max(1, ceil(reset_at - time.time())))
+        except Exception:
+            pass
+    return response
+
+
 def get_rate_limit_exceeded_handler():
     """Return the rate limit exceeded handler for FastAPI exception handling."""
-    return _rate_limit_exceeded_handler
+    return rate_limit_exceeded_handler
 
 
 def get_limiter():
@@ -192,10 +203,8 @@ def limit_with_progressive_delay(rate_limit: str, endpoint_name: str = None):
                 key = get_rate_limit_key(request)
                 endpoint = endpoint_name or f"{func.__module__}.{func.__name__}"
 
-                # Check for progressive delay
-                delay = get_progressive_delay(key, endpoint)
-                if delay > 0:
-                    time.sleep(delay)
+                # Reject while a progressive penalty is active
+                enforce_progressive_delay(key, endpoint)
 
             try:
                 result = limited_func(*args, **kwargs)
@@ -241,35 +250,89 @@ def limit_sensitive(func):
     return limiter.limit(SENSITIVE_API_RATE_LIMIT)(func)
 
 
-def limit_authenticated_api(func):
+# Role-based limits for authenticated requests. Each route gets its own
+# role -> RateLimitItem table, parsed once when the app is assembled.
+ROLE_RATE_LIMITS = {"admin": ADMIN_API_RATE_LIMIT, "user": USER_API_RATE_LIMIT}
+
+
+class RoleLimits:
+    """Precompiled per-role limits of one route"""
+
+    __slots__ = ("scope", "items", "default")
+
+    def __init__(self, scope: str, limits: Dict[str, str]):
+        self.scope = scope
+        self.items: Dict[str, RateLimitItem] = {role: parse(value) for role, value in limits.items()}
+        self.default = self.items["user"]
+
+    def for_role(self, role: Optional[str]) -> RateLimitItem:
+        return self.items.get(role, self.default)
+
+
+# Endpoint function -> RoleLimits (filled by limit_authenticated_api and compile_role_limits)
+_endpoint_role_limits: Dict[Callable, RoleLimits] = {}
+_endpoint_role_overrides: Dict[Callable, Dict[str, str]] = {}
+
+
+def limit_authenticated_api(func: Callable = None, **role_limits: str):
     """
-    Rate limit decorator for authenticated API endpoints.
-    Uses user-based limits and progressive delays.
+    Give an endpoint its own per-role limits for authenticated requests, e.g.
+    @limit_authenticated_api(user="30/minute", admin="120/minute").
+    Roles that are not given use ROLE_RATE_LIMITS. Place it directly below
+    the route decorator.
+
+    The endpoint itself is not wrapped; compile_role_limits builds its limit
+    items once and enforce_role_rate_limits applies them.
     """
-    def decorator(request: Request, *args, **kwargs):
-        # Get user role for role-based limits
-        user_id = get_user_id_from_token(request)
-        user_role = None
+    def decorator(endpoint: Callable) -> Callable:
+        _endpoint_role_overrides[endpoint] = role_limits
+        return endpoint
+    return decorator(func) if func is not None else decorator
 
-        if user_id:
-            # In a real implementation, you'd fetch user role from database
-            # For now, we'll use a simple check or assume regular user
-            user_role = "user"  # This should be fetched from DB
 
-        rate_limit = get_user_rate_limit(user_role)
-        endpoint_name = f"authenticated_api_{func.__name__}"
+def compile_role_limits(routes: Iterable[Any]):
+    """Build the per-role limit items of every API route (call after including all routers)"""
+    for route in routes:
+        endpoint = getattr(route, "endpoint", None)
+        methods = getattr(route, "methods", None)
+        if endpoint is None or not methods or endpoint in _endpoint_role_limits:
+            continue
+        scope = f"{','.join(sorted(methods))} {route.path}"
+        limits = {**ROLE_RATE_LIMITS, **_endpoint_role_overrides.get(endpoint, {})}
+        _endpoint_role_limits[endpoint] = RoleLimits(scope, limits)
 
-        # Apply progressive delay
-        key = get_rate_limit_key(request)
-        delay = get_progressive_delay(key, endpoint_name)
-        if delay > 0:
-            time.sleep(delay)
 
-        try:
-            limited_func = limiter.limit(rate_limit)(func)
-            return limited_func(request, *args, **kwargs)
-        except RateLimitExceeded:
-            record_violation(key, endpoint_name)
-            raise
+def enforce_role_rate_limits(request: Request):
+    """
+    App-wide dependency applying the matched route's limit for the caller's role.
 
-    return decorator
+    Runs once per request after routing, so the route's precompiled limits
+    are a dict lookup, and it reuses the principal verified for the request
+    (shared with get_current_user and the slowapi key function). Anonymous
+    requests are left to the IP-based slowapi limits. Repeated violations
+    earn progressive penalties (429 with Retry-After).
+
+    A plain def, so FastAPI runs it in the threadpool: token decoding and the
+    synchronous storage hit (which may wait on a locked SQLite database)
+    must not block the event loop.
+    """
+    if not limiter.enabled:
+        return
+    role_limits = _endpoint_role_limits.get(request.scope.get("endpoint"))
+    if role_limits is None:
+        return
+    principal = get_request_principal(request)
+    if principal is None:
+        return
+
+    key = f"user:{principal.user_id}"
+    enforce_progressive_delay(key, role_limits.scope)
+    item = role_limits.for_role(principal.role)
+    if not limiter.limiter.hit(item, key, role_limits.scope):
+        record_violation(key, role_limits.scope)
+        reset_at, _ = limiter.limiter.get_window_stats(item, key, role_limits.scope)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded: {item}",
+            headers={"Retry-After": str(max(1, ceil(reset_at - time.time())))}
+        )
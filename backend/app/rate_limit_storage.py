@@ -0,0 +1,186 @@
+"""
+Rate Limit Storage Module
+
+Storage backends for the slowapi/limits rate limiter (RATE_LIMIT_STORAGE_URI):
+
+- memory://                      limits' in-process MemoryStorage; counters
+                                 expire with their window (single worker)
+- sqlite:///path/to/ratelimit.db SQLiteStorage below; one file shared by all
+                                 worker processes on a host
+
+Both support the sliding-window-counter strategy (RATE_LIMIT_STRATEGY), which
+weights the previous window's count by how much of it still overlaps the
+sliding window, so bursts across a window boundary are not let through
+twice. Every counter carries an expiry; idle keys are deleted once expired
+instead of accumulating forever.
+"""
+
+import sqlite3
+import threading
+import time
+from math import floor
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+from limits.storage import SlidingWindowCounterSupport, Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+
+# Seconds between sweeps of expired counters
+SQLITE_PURGE_INTERVAL = 60
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Rate limit counters in a SQLite file, shared between worker processes.
+
+    Every decision is one short IMMEDIATE transaction, so concurrent workers
+    never both take the last slot of a window. The database runs in WAL mode
+    so readers do not block the writer.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, timeout: float = 5.0, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri)
+        # sqlite:///relative.db -> "relative.db", sqlite:////abs/path.db -> "/abs/path.db"
+        self.path = parsed.path[1:] if parsed.path.startswith("/") else parsed.path
+        if not self.path:
+            raise ValueError("SQLite rate limit storage requires a file path, e.g. sqlite:///ratelimit.db")
+        self.timeout = timeout
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_counters ("
+                "key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_rate_limit_counters_expires_at "
+                "ON rate_limit_counters (expires_at)"
+            )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _ImmediateTransaction(self._connection())
+
+    @staticmethod
+    def _get(conn: sqlite3.Connection, key: str, now: float) -> Tuple[int, Optional[float]]:
+        row = conn.execute(
+            "SELECT value, expires_at FROM rate_limit_counters WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    @staticmethod
+    def _incr(conn: sqlite3.Connection, key: str, expiry: float, amount: int, now: float):
+        # A counter whose expiry has passed starts over with a new expiry
+        conn.execute(
+            "INSERT INTO rate_limit_counters (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END",
+            (key, amount, now + expiry, now, now)
+        )
+
+    def _purge_expired(self, conn: sqlite3.Connection, now: float):
+        if now - self._last_purge >= SQLITE_PURGE_INTERVAL:
+            self._last_purge = now
+            conn.execute("DELETE FROM rate_limit_counters WHERE expires_at <= ?", (now,))
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        with self._transaction() as conn:
+            self._purge_expired(conn, now)
+            self._incr(conn, key, expiry, amount, now)
+            return self._get(conn, key, now)[0]
+
+    def get(self, key: str) -> int:
+        return self._get(self._connection(), key, time.time())[0]
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        expires_at = self._get(self._connection(), key, now)[1]
+        return expires_at if expires_at is not None else now
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM rate_limit_counters").rowcount
+
+    def clear(self, key: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_limit_counters WHERE key = ?", (key,))
+
+    def acquire_sliding_window_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        with self._transaction() as conn:
+            self._purge_expired(conn, now)
+            previous_count, previous_ttl, current_count, _ = self._sliding_window(
+                conn, previous_key, current_key, expiry, now
+            )
+            weighted_count = previous_count * previous_ttl / expiry + current_count
+            if floor(weighted_count) + amount > limit:
+                return False
+            # The current window is the previous one for the next window, so keep it twice as long
+            self._incr(conn, current_key, 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key: str, expiry: int) -> Tuple[int, float, int, float]:
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._sliding_window(self._connection(), previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key: str, expiry: int) -> None:
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM rate_limit_counters WHERE key IN (?, ?)", (previous_key, current_key))
+
+    def _sliding_window(self, conn: sqlite3.Connection, previous_key: str, current_key: str,
+                        expiry: int, now: float) -> Tuple[int, float, int, float]:
+        previous_count = self._get(conn, previous_key, now)[0]
+        current_count = self._get(conn, current_key, now)[0]
+        if previous_count == 0:
+            previous_ttl = 0.0
+        else:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -1,6 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from .. import models, schemas, crud
 from ..database import get_db
 from ..auth import get_current_user
@@ -8,10 +7,23 @@ from ..rate_limit import limiter, SENSITIVE_API_RATE_LIMIT
 from ..smtp_encryption import encrypt_smtp_password, decrypt_smtp_password
 from ..backup import backup_manager
 from ..api_key_manager import APIKeyManager
+from ..secret_cache import secret_cache
+from ..principal_cache import principal_cache
+from ..session_revocation import revocation_index
+from ..geoip import geoip_provider
+from ..settings_cache import settings_cache
+from ..dashboard_rollups import dashboard_cache
+from ..audit_archive import audit_archiver
+from ..pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from ..history_writer import history_writer
+from ..audit_writer import audit_writer
+from ..code_stream import code_stream_scheduler
+from ..password_hashing import password_hasher
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
+from typing import Optional
 
 router = APIRouter()
 
@@ -295,12 +307,86 @@ def get_locked_accounts(
     ]
 
 
+@router.get("/cache/stats")
+def get_cache_stats(
+    current_user: models.User = Depends(is_admin)
+):
+    """Get hit/miss counters for in-process caches (admin only)"""
+    return {
+        "secret_cache": secret_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "revoked_sessions": revocation_index.stats(),
+        "geoip": geoip_provider.stats(),
+        "settings": settings_cache.stats(),
+        "dashboard": dashboard_cache.stats()
+    }
+
+
+@router.get("/writers/stats")
+def get_writer_stats(
+    current_user: models.User = Depends(is_admin)
+):
+    """Get queue depth and throughput for background write buffers (admin only)"""
+    return {
+        "history_writer": history_writer.stats(),
+        "audit_writer": audit_writer.stats()
+    }
+
+
+@router.get("/streams/stats")
+def get_stream_stats(
+    current_user: models.User = Depends(is_admin)
+):
+    """Get open code streams and scheduler activity (admin only)"""
+    return {
+        "code_streams": code_stream_scheduler.stats()
+    }
+
+
+@router.get("/passwords/stats")
+def get_password_hashing_stats(
+    current_user: models.User = Depends(is_admin)
+):
+    """Get password hashing pool usage, queue wait and hash time (admin only)"""
+    return {
+        "password_hashing": password_hasher.stats()
+    }
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    """Parse an ISO 8601 date query parameter"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} format")
+
+
+def _parse_cursor(cursor: Optional[str]):
+    """Decode a pagination cursor query parameter"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _set_next_cursor(response: Response, logs: list, limit: int):
+    """Return the cursor of the next page in a header when this page is full"""
+    if logs and len(logs) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(logs[-1]["created_at"], logs[-1]["id"])
+
+
 @router.get("/audit-logs", response_model=list[schemas.AuditLogResponse])
 @limiter.limit(SENSITIVE_API_RATE_LIMIT)
 def get_audit_logs(
     request: Request,
+    response: Response,
     limit: int = 100,
     offset: int = 0,
+    cursor: str = None,
     user_id: int = None,
     action: str = None,
     status: str = None,
@@ -309,7 +395,12 @@ def get_audit_logs(
     current_user: models.User = Depends(is_admin),
     db: Session = Depends(get_db)
 ):
-    """Get audit logs with optional filtering (admin only)"""
+    """
+    Get audit logs with optional filtering (admin only)
+
+    Pages are newest first; pass the X-Next-Cursor header of a full page as
+    cursor to get the next one (offset still works but is slow on deep pages).
+    """
     from .. import crud
     
     # Validate limit and offset
@@ -317,20 +408,11 @@ def get_audit_logs(
         limit = 1000
     if offset < 0:
         offset = 0
+    position = _parse_cursor(cursor)
     
     # Parse dates if provided
-    start_datetime = None
-    end_datetime = None
-    if start_date:
-        try:
-            start_datetime = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        except:
-            raise HTTPException(status_code=400, detail="Invalid start_date format")
-    if end_date:
-        try:
-            end_datetime = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        except:
-            raise HTTPException(status_code=400, detail="Invalid end_date format")
+    start_datetime = _parse_date(start_date, "start_date")
+    end_datetime = _parse_date(end_date, "end_date")
     
     # Get audit logs with filters
     audit_logs = crud.get_audit_logs(
@@ -341,8 +423,10 @@ def get_audit_logs(
         start_date=start_datetime,
         end_date=end_datetime,
         limit=limit,
-        offset=offset
+        offset=offset,
+        cursor=position
     )
+    _set_next_cursor(response, audit_logs, limit)
     
     return audit_logs
 
@@ -350,9 +434,11 @@ def get_audit_logs(
 @router.get("/audit-logs/user/{user_id}", response_model=list[schemas.AuditLogResponse])
 def get_user_audit_logs(
     request: Request,
+    response: Response,
     user_id: int,
     limit: int = 100,
     offset: int = 0,
+    cursor: str = None,
     current_user: models.User = Depends(is_admin),
     db: Session = Depends(get_db)
 ):
@@ -370,16 +456,21 @@ def get_user_audit_logs(
     if offset < 0:
         offset = 0
     
+    position = _parse_cursor(cursor)
+    
     # Get audit logs
-    logs = crud.get_audit_logs(db, user_id=user_id, limit=limit, offset=offset)
+    logs = crud.get_audit_logs(db, user_id=user_id, limit=limit, offset=offset, cursor=position)
+    _set_next_cursor(response, logs, limit)
     
     return logs
 
 
 @router.get("/activity", response_model=list[schemas.AuditLogResponse])
 def get_all_activity(
+    response: Response,
     limit: int = 50,
     offset: int = 0,
+    cursor: str = None,
     action: str = None,
     status: str = None,
     user_id: int = None,
@@ -392,6 +483,7 @@ def get_all_activity(
         limit = 500
     if offset < 0:
         offset = 0
+    position = _parse_cursor(cursor)
     
     # Get audit logs with filters
     logs = crud.get_audit_logs(
@@ -400,8 +492,10 @@ def get_all_activity(
         action=action,
         status=status,
         limit=limit, 
-        offset=offset
+        offset=offset,
+        cursor=position
     )
+    _set_next_cursor(response, logs, limit)
     
     return logs
 
@@ -411,161 +505,13 @@ def get_dashboard_stats(
     current_user: models.User = Depends(is_admin),
     db: Session = Depends(get_db)
 ):
-    """Get dashboard statistics (admin only)"""
-    from .. import crud
-    
-    # Count total users
-    total_users = db.query(models.User).count()
-    
-    # Count active users (created or used in last 7 days)
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    active_users = db.query(models.User).filter(
-        models.User.created_at >= seven_days_ago
-    ).count()
-    
-    # Count total 2FA accounts
-    total_accounts = db.query(models.Application).count()
-    
-    # Count users with 2FA enabled
-    users_with_2fa = db.query(models.User).filter(
-        models.User.totp_enabled == True
-    ).count()
-    
-    # Get recent activity (last 7 days)
-    recent_logins = db.query(models.AuditLog).filter(
-        models.AuditLog.action == "login_success",
-        models.AuditLog.created_at >= seven_days_ago
-    ).count()
-    
-    recent_failed_logins = db.query(models.AuditLog).filter(
-        models.AuditLog.action == "login_failed",
-        models.AuditLog.created_at >= seven_days_ago
-    ).count()
-    
-    # Top 5 active users (by login count in last 7 days)
-    top_users = db.query(
-        models.User.email,
-        models.AuditLog.user_id,
-        func.count(models.AuditLog.id).label('login_count')
-    ).join(
-        models.AuditLog,
-        models.User.id == models.AuditLog.user_id
-    ).filter(
-        models.AuditLog.action == "login_success",
-        models.AuditLog.created_at >= seven_days_ago
-    ).group_by(models.User.email, models.AuditLog.user_id).order_by(
-        func.count(models.AuditLog.id).desc()
-    ).limit(5).all()
-    
-    # Account distribution by category
-    category_distribution = db.query(
-        models.Application.category,
-        func.count(models.Application.id).label('count')
-    ).group_by(
-        models.Application.category
-    ).all()
-    
-    # Security alerts - locked accounts
-    locked_accounts = db.query(models.User).filter(
-        models.User.locked_until != None,
-        models.User.locked_until > datetime.utcnow()
-    ).count()
-    
-    # Recent activity (last 10 events)
-    try:
-        recent_events = db.query(
-            models.AuditLog.action,
-            models.AuditLog.created_at,
-            models.User.email,
-            models.AuditLog.status
-        ).join(
-            models.User,
-            models.AuditLog.user_id == models.User.id
-        ).order_by(
-            models.AuditLog.created_at.desc()
-        ).limit(10).all()
-    except Exception as e:
-        print(f"[ERROR] Error fetching recent events: {str(e)}")
-        recent_events = []
-    
-    # Login trend (last 7 days by day)
-    try:
-        login_trend = db.query(
-            func.date(models.AuditLog.created_at).label('date'),
-            func.count(models.AuditLog.id).label('count')
-        ).filter(
-            models.AuditLog.action == "login_success",
-            models.AuditLog.created_at >= seven_days_ago
-        ).group_by(
-            func.date(models.AuditLog.created_at)
-        ).order_by(
-            func.date(models.AuditLog.created_at)
-        ).all()
-    except Exception as e:
-        print(f"[ERROR] Error fetching login trend: {str(e)}")
-        login_trend = []
-    
-    # Calculate 2FA coverage percentage
-    two_fa_coverage = (users_with_2fa / total_users * 100) if total_users > 0 else 0
-    
-    # Get locked accounts details
-    locked_accounts_details = db.query(
-        models.User.id,
-        models.User.email,
-        models.User.locked_until,
-        models.User.failed_login_attempts,
-        models.User.last_failed_login
-    ).filter(
-        models.User.locked_until != None,
-        models.User.locked_until > datetime.utcnow()
-    ).all()
-    
-    response_data = {
-        "total_users": total_users,
-        "active_users_7d": active_users,
-        "total_accounts": total_accounts,
-        "users_with_2fa": users_with_2fa,
-        "two_fa_coverage_percent": round(two_fa_coverage, 1),
-        "recent_logins_7d": recent_logins,
-        "recent_failed_logins_7d": recent_failed_logins,
-        "locked_accounts": locked_accounts,
-        "locked_accounts_details": [
-            {
-                "id": user.id,
-                "email": user.email,
-                "locked_until": user.locked_until.isoformat(),
-                "failed_login_attempts": user.failed_login_attempts,
-                "last_failed_login": user.last_failed_login.isoformat() if user.last_failed_login else None
-            }
-            for user in locked_accounts_details
-        ],
-        "top_active_users": [
-            {"email": email, "login_count": login_count} 
-            for email, _, login_count in top_users
-        ],
-        "account_distribution_by_category": [
-            {"category": category, "count": count} 
-            for category, count in category_distribution
-        ],
-        "recent_events": [
-            {
-                "action": action,
-                "email": email,
-                "status": status,
-                "created_at": created_at.isoformat()
-            }
-            for action, created_at, email, status in recent_events
-        ],
-        "login_trend": [
-            {"date": str(date), "count": count}
-            for date, count in login_trend
-        ]
-    }
-    
-    # Log response for debugging
-    print(f"[DEBUG] Dashboard stats response: {response_data}")
-    
-    return response_data
+    """
+    Get dashboard statistics (admin only)
+
+    Login and account counts come from the rollup tables (see
+    dashboard_rollups); the response is cached for DASHBOARD_CACHE_TTL_SECONDS.
+    """
+    return dashboard_cache.get(db)
 
 
 # Backup Management Endpoints
@@ -892,59 +838,158 @@ def import_users_bulk(
 @limiter.limit(SENSITIVE_API_RATE_LIMIT)
 def export_audit_logs_csv(
     request: Request,
-    limit: int = 10000,
+    format: str = "csv",
+    gzip: bool = False,
+    start_date: str = None,
+    end_date: str = None,
+    user_id: int = None,
+    action: str = None,
+    status: str = None,
+    limit: Optional[int] = None,
     offset: int = 0,
     current_user: models.User = Depends(is_admin),
     db: Session = Depends(get_db)
 ):
-    """Export audit logs as CSV (admin only)"""
-    import csv
-    from io import StringIO
+    """
+    Export audit logs as CSV or NDJSON, optionally gzipped (admin only)
+
+    Rows are streamed as they are read (see audit_export), so exports are
+    not capped; use start_date/end_date and the filters to narrow them.
+    """
     from fastapi.responses import StreamingResponse
+    from starlette.background import BackgroundTask
+    from ..audit_export import EXPORT_FORMATS, export_filename, export_media_type, stream_export
+    
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format; use one of: {', '.join(EXPORT_FORMATS)}")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    filters = {
+        "start_date": _parse_date(start_date, "start_date"),
+        "end_date": _parse_date(end_date, "end_date"),
+        "user_id": user_id,
+        "action": action,
+        "status": status,
+        "limit": limit,
+        "offset": max(offset, 0)
+    }
+    admin_id = current_user.id
+    # The request's session is released when the handler returns; the
+    # stream reads through its own
+    export_db = Session(bind=db.get_bind())
+    
+    def log_export(record_count: int, completed: bool):
+        crud.create_audit_log(
+            export_db,
+            user_id=admin_id,
+            action="audit_logs_exported",
+            status="success" if completed else "failed",
+            reason=None if completed else "Export interrupted",
+            details={
+                "record_count": record_count,
+                "format": format,
+                "gzip": gzip,
+                "filters": {key: str(value) for key, value in filters.items() if value}
+            }
+        )
+    
+    stream = stream_export(export_db, format, gzip, on_complete=log_export, **filters)
+    return StreamingResponse(
+        stream,
+        media_type=export_media_type(format, gzip),
+        headers={"Content-Disposition": f"attachment; filename={export_filename(format, gzip)}"},
+        # Runs after the response even if the client disconnected mid-stream
+        background=BackgroundTask(stream.aclose)
+    )
+
+@router.get("/audit-archive/search", response_model=list[schemas.AuditLogResponse])
+@limiter.limit(SENSITIVE_API_RATE_LIMIT)
+def search_audit_archive(
+    request: Request,
+    response: Response,
+    limit: int = 100,
+    cursor: str = None,
+    user_id: int = None,
+    action: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    current_user: models.User = Depends(is_admin)
+):
+    """
+    Search audit logs moved to the archive by the retention job (admin only)
+
+    Newest first, paged with X-Next-Cursor like /audit-logs. Only archive
+    segments whose index matches the time range, user and action are read.
+    """
+    if limit > 1000:
+        limit = 1000
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    logs = audit_archiver.search(
+        start_date=_parse_date(start_date, "start_date"),
+        end_date=_parse_date(end_date, "end_date"),
+        user_id=user_id,
+        action=action,
+        limit=limit,
+        cursor=_parse_cursor(cursor)
+    )
+    _set_next_cursor(response, logs, limit)
+    return logs
+
+
+@router.get("/audit-archive/segments")
+@limiter.limit(SENSITIVE_API_RATE_LIMIT)
+def list_audit_archive_segments(
+    request: Request,
+    current_user: models.User = Depends(is_admin)
+):
+    """List archive segments with their index summaries (admin only)"""
+    return {
+        "stats": audit_archiver.stats(),
+        "segments": [
+            {
+                "segment": index["segment"],
+                "day": index["day"],
+                "rows": index["rows"],
+                "start": index["start"],
+                "end": index["end"],
+                "min_id": index["min_id"],
+                "max_id": index["max_id"],
+                "user_id_min": index["user_id_min"],
+                "user_id_max": index["user_id_max"],
+                "actions": index["actions"],
+                "blocks": len(index["blocks"])
+            }
+            for index in audit_archiver.indexes()
+        ]
+    }
+
+
+@router.post("/audit-archive/run")
+@limiter.limit(SENSITIVE_API_RATE_LIMIT)
+def run_audit_archive(
+    request: Request,
+    older_than_days: Optional[int] = None,
+    current_user: models.User = Depends(is_admin),
+    db: Session = Depends(get_db)
+):
+    """Archive audit logs older than the retention period now (admin only)"""
+    try:
+        summary = audit_archiver.archive(db, older_than_days=older_than_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if summary["skipped"]:
+        raise HTTPException(status_code=409, detail="An archive run is already in progress")
     
-    # Get audit logs
-    logs = db.query(models.AuditLog).order_by(
-        models.AuditLog.created_at.desc()
-    ).limit(limit).offset(offset).all()
-    
-    # Create CSV
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow([
-        "ID", "User ID", "User Email", "Action", "Resource Type", "Resource ID",
-        "IP Address", "Status", "Reason", "Created At", "Details"
-    ])
-    
-    # Write rows
-    for log in logs:
-        user = db.query(models.User).filter(models.User.id == log.user_id).first() if log.user_id else None
-        writer.writerow([
-            log.id,
-            log.user_id,
-            user.email if user else "",
-            log.action,
-            log.resource_type or "",
-            log.resource_id or "",
-            log.ip_address or "",
-            log.status,
-            log.reason or "",
-            log.created_at.isoformat(),
-            str(log.details or "")
-        ])
-    
-    # Log the export
     crud.create_audit_log(
         db,
         user_id=current_user.id,
-        action="audit_logs_exported",
-        status="success",
-        details={"record_count": len(logs)}
+        action="audit_logs_archived",
+        details={
+            "cutoff": summary["cutoff"],
+            "rows_archived": summary["rows_archived"],
+            "rows_deleted": summary["rows_deleted"],
+            "segments": len(summary["segments"])
+        }
     )
-    
-    return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=audit_logs.csv"}
-    )
\ No newline at end of file
+    return summary
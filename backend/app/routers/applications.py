@@ -1,10 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 from ..database import get_db
-from .. import models, schemas, crud, auth, utils, secrets_encryption
+from .. import models, schemas, crud, auth, utils, envelope_encryption
 from ..rate_limit import limiter, API_RATE_LIMIT, SENSITIVE_API_RATE_LIMIT
+from ..secret_cache import secret_cache
+from ..history_writer import history_writer
+from ..code_stream import (
+    code_stream_scheduler, format_event, StreamLimitExceeded,
+    CODE_STREAM_MAX_SECONDS, CODE_STREAM_HEARTBEAT_SECONDS
+)
+from ..otp_engine import DEFAULT_PERIOD
+import asyncio
 import os
 import json
+import time
 
 router = APIRouter()
 
@@ -222,35 +234,155 @@ def import_applications(
         )
         raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
 
+@router.get("/codes", response_model=schemas.ApplicationCodesResponse)
+@limiter.limit(API_RATE_LIMIT)
+def get_codes(
+    request: Request,
+    ids: list[int] = Query(None, description="Only return codes for these application IDs"),
+    category: str = Query(None, description="Filter by category"),
+    include_hotp: bool = Query(False, description="Also generate HOTP codes (advances their counters)"),
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get current OTP codes for all of the user's applications in one request"""
+    query = db.query(models.Application).filter(models.Application.user_id == current_user.id)
+    if ids:
+        query = query.filter(models.Application.id.in_(ids))
+    if category:
+        query = query.filter(models.Application.category == category)
+    if not include_hotp:
+        query = query.filter(or_(models.Application.otp_type.is_(None), models.Application.otp_type != "HOTP"))
+    applications = query.order_by(models.Application.display_order).all()
+
+    decrypted_secrets = envelope_encryption.decrypt_application_secrets(db, applications)
+
+    # Generate every code against the same timestamp so they share a period
+    now = time.time()
+    ip_address = request.client.host if request.client else None
+    user_agent = request.headers.get('user-agent')
+    codes = []
+    for app, secret in zip(applications, decrypted_secrets):
+        if not secret:
+            continue
+        if app.otp_type == "HOTP":
+            counter = crud.advance_hotp_counter(db, app.id, commit=False)
+            codes.append(schemas.ApplicationCode(
+                id=app.id,
+                otp_type="HOTP",
+                code=utils.generate_totp_code(secret, "HOTP", counter),
+                counter=counter
+            ))
+        else:
+            window = utils.get_totp_window(secret, for_time=now)
+            codes.append(schemas.ApplicationCode(id=app.id, otp_type="TOTP", **window))
+
+    if include_hotp and any(code.otp_type == "HOTP" for code in codes):
+        db.commit()
+
+    # History is written behind by the background writer
+    history_writer.record_many(
+        db, [code.id for code in codes], current_user.id, ip_address, user_agent
+    )
+
+    return schemas.ApplicationCodesResponse(server_time=int(now), codes=codes)
+
+def _load_stream_accounts(db: Session, user_id: int, ip_address: str, user_agent: str) -> list:
+    """Decrypt a user's TOTP secrets for a code stream, then release the DB connection"""
+    try:
+        applications = db.query(models.Application).filter(
+            models.Application.user_id == user_id,
+            or_(models.Application.otp_type.is_(None), models.Application.otp_type != "HOTP")
+        ).order_by(models.Application.display_order).all()
+        decrypted_secrets = envelope_encryption.decrypt_application_secrets(db, applications)
+        accounts = [
+            (app.id, secret, DEFAULT_PERIOD)
+            for app, secret in zip(applications, decrypted_secrets) if secret
+        ]
+        history_writer.record_many(db, [app_id for app_id, _, _ in accounts], user_id, ip_address, user_agent)
+        return accounts
+    finally:
+        # The stream can stay open for an hour; don't hold a pooled connection
+        db.close()
+
+@router.get("/codes/stream")
+@limiter.limit(API_RATE_LIMIT)
+async def stream_codes(
+    request: Request,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Server-Sent Events stream of rolling TOTP codes.
+
+    Sends a "codes" event with every account's code immediately and then at
+    each period boundary, ": keepalive" comments in between, "resync" when the
+    user's accounts change and "reconnect" when the stream reaches its
+    maximum duration.
+    """
+    user_id = current_user.id
+    accounts = await run_in_threadpool(
+        _load_stream_accounts, db, user_id,
+        request.client.host if request.client else None,
+        request.headers.get('user-agent')
+    )
+    try:
+        subscription = code_stream_scheduler.subscribe(user_id, accounts)
+    except StreamLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    async def event_stream():
+        try:
+            yield format_event("codes", subscription.codes_at(time.time()))
+            deadline = time.monotonic() + CODE_STREAM_MAX_SECONDS
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield format_event("reconnect", {"reason": "max_duration"})
+                    return
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(), timeout=min(CODE_STREAM_HEARTBEAT_SECONDS, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield event
+                if event.startswith("event: resync"):
+                    return
+        finally:
+            code_stream_scheduler.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/{app_id}/code")
 @limiter.limit(API_RATE_LIMIT)
 def get_code(request: Request, app_id: int, current_user: models.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
     app = crud.get_application(db, app_id)
     if not app or app.user_id != current_user.id:
         raise HTTPException(status_code=404)
-    decrypted_secret = secrets_encryption.decrypt_secret(app.secret)
+    decrypted_secret = envelope_encryption.decrypt_application_secret(db, app)
     
     # Generate code based on OTP type
     if app.otp_type == "HOTP":
-        # Increment counter and generate code
-        code = utils.generate_totp_code(decrypted_secret, app.otp_type, app.counter)
-        # Update counter in database for HOTP
-        app.counter += 1
-        db.commit()
+        # Advance the counter atomically and generate the code for the value it replaced
+        counter = crud.advance_hotp_counter(db, app.id)
+        code = utils.generate_totp_code(decrypted_secret, app.otp_type, counter)
     else:
         # TOTP
         code = utils.generate_totp_code(decrypted_secret, app.otp_type, app.counter)
     
-    # Log code generation for audit trail
-    from ..models import CodeGenerationHistory
-    history_entry = CodeGenerationHistory(
+    # Log code generation for audit trail (written behind by the background writer)
+    history_writer.record(
+        db,
         application_id=app_id,
         user_id=current_user.id,
         ip_address=request.client.host if request.client else None,
         user_agent=request.headers.get('user-agent')
     )
-    db.add(history_entry)
-    db.commit()
     
     return {"code": code}
 
@@ -360,6 +492,7 @@ def bulk_delete_applications(
     # Delete the accounts
     deleted_count = 0
     for account in accounts_to_delete:
+        secret_cache.invalidate(account.id)
         db.delete(account)
         deleted_count += 1
         
@@ -375,6 +508,7 @@ def bulk_delete_applications(
         )
     
     db.commit()
+    code_stream_scheduler.notify_user(current_user.id)
     
     return {
         "message": f"Successfully deleted {deleted_count} accounts",
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import HTMLResponse
 from sqlalchemy.orm import Session
 from ..database import get_db
-from .. import models, schemas, crud, auth, secrets_encryption
+from .. import models, schemas, crud, auth, secrets_encryption, side_effects
 from ..rate_limit import limiter, limit_login, limit_signup, limit_totp_verify, TOTP_VERIFY_RATE_LIMIT
 from ..oidc_state import generate_secure_state, store_oidc_state, validate_oidc_state
 from ..notifications import email_service
@@ -110,7 +110,7 @@ def signup(request: Request, user: schemas.UserCreate, db: Session = Depends(get
     
     # Generate token - sub must be a string
     access_token = auth.create_access_token(
-        data={"sub": str(db_user.id)},
+        data={"sub": str(db_user.id), "role": db_user.role},
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -119,11 +119,18 @@ def signup(request: Request, user: schemas.UserCreate, db: Session = Depends(get
 @router.post("/login", response_model=schemas.Token)
 @limit_login
 def login(request: Request, credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+    """
+    Password login.
+
+    Reads the global settings and the user once, writes the lockout state,
+    session, audit log and notification in a single transaction, and only
+    then sends emails and security monitor events (side_effects.dispatch).
+    """
     # Get client IP address
     client_ip = request.client.host if request.client else "127.0.0.1"
     
     # Check access restrictions
-    global_settings = crud.get_global_settings(db)
+    global_settings = crud.get_global_settings_snapshot(db)
     from ..access_restrictions import check_access_restrictions
     access_allowed, restriction_reason = check_access_restrictions(client_ip, global_settings)
     
@@ -142,7 +149,7 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
             detail=f"Access denied: {restriction_reason}"
         )
     
-    # Get user by email first to check lockout status
+    # Get user by email once: lockout check, authentication and lockout tracking
     user = crud.get_user_by_email(db, credentials.email)
     
     # Check if account is locked
@@ -163,58 +170,12 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
         )
     
     # Authenticate user
-    user = crud.authenticate_user(db, credentials.email, credentials.password)
-    if not user:
+    if not crud.check_user_password(user, credentials.password):
         # Authentication failed - handle lockout logic
-        failed_user = crud.get_user_by_email(db, credentials.email)  # Get user again for lockout tracking
-        if failed_user and not failed_user.is_sso_user:  # Only lock local users
-            # Increment failed login attempts
-            failed_user.failed_login_attempts = (failed_user.failed_login_attempts or 0) + 1
-            failed_user.last_failed_login = datetime.utcnow()
-            
-            # Check if we should lock the account
-            MAX_FAILED_ATTEMPTS = int(os.getenv("MAX_FAILED_LOGIN_ATTEMPTS", "5"))
-            LOCKOUT_DURATION_MINUTES = int(os.getenv("ACCOUNT_LOCKOUT_MINUTES", "15"))
-            
-            if failed_user.failed_login_attempts >= MAX_FAILED_ATTEMPTS:
-                # Lock the account
-                failed_user.locked_until = datetime.utcnow() + timedelta(minutes=LOCKOUT_DURATION_MINUTES)
-                
-                crud.create_audit_log(
-                    db,
-                    user_id=failed_user.id,
-                    action="account_locked",
-                    ip_address=client_ip,
-                    status="warning",
-                    reason="Too many failed login attempts",
-                    details={
-                        "failed_attempts": failed_user.failed_login_attempts,
-                        "locked_until": failed_user.locked_until.isoformat(),
-                        "lockout_duration_minutes": LOCKOUT_DURATION_MINUTES
-                    }
-                )
-                # Send email alert about account lock
-                email_service.send_brute_force_alert(failed_user, failed_user.failed_login_attempts)
-                # Create in-app notification
-                crud.create_in_app_notification(
-                    db,
-                    user_id=failed_user.id,
-                    notification_type="security_alert",
-                    title="Account Locked",
-                    message=f"Your account has been locked due to {failed_user.failed_login_attempts} failed login attempts. It will unlock in 15 minutes."
-                )
-            else:
-                crud.create_audit_log(
-                    db,
-                    user_id=failed_user.id,
-                    action="login_failed",
-                    ip_address=client_ip,
-                    status="failed",
-                    reason="Invalid password",
-                    details={"failed_attempts": failed_user.failed_login_attempts}
-                )
-            
+        if user and not user.is_sso_user:  # Only lock local users
+            _record_failed_login(db, user, client_ip)
             db.commit()
+            side_effects.dispatch(db)
         
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
@@ -223,10 +184,8 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
         user.failed_login_attempts = 0
         user.locked_until = None
         user.last_failed_login = None
-        db.commit()
     
-    # Get global settings to check 2FA enforcement
-    global_settings = crud.get_global_settings(db)
+    # Check 2FA enforcement
     totp_enforcement = global_settings.totp_enforcement  # optional, admin_only, or required_all
     
     # Check if user needs to enroll in 2FA
@@ -242,7 +201,7 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
     if requires_enrollment:
         # Generate a temporary token valid only for 2FA setup (valid for 15 minutes)
         access_token = auth.create_access_token(
-            data={"sub": str(user.id)},
+            data={"sub": str(user.id), "role": user.role},
             expires_delta=timedelta(minutes=15)
         )
         # Log the login attempt requiring 2FA enrollment
@@ -251,8 +210,11 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
             user_id=user.id,
             action="login_2fa_enrollment_required",
             ip_address=client_ip,
-            status="success"
+            status="success",
+            commit=False
         )
+        db.commit()
+        side_effects.dispatch(db)
         return {
             "access_token": access_token,
             "token_type": "bearer",
@@ -265,71 +227,124 @@ def login(request: Request, credentials: schemas.UserLogin, db: Session = Depend
         # The frontend will need to provide the TOTP code in a separate request
         # Return status 202 (Accepted) to indicate 2FA is required
         # Log the login attempt with 2FA pending
+        user_id = user.id
         crud.create_audit_log(
             db,
-            user_id=user.id,
+            user_id=user_id,
             action="login_2fa_pending",
             ip_address=client_ip,
-            status="success"
+            status="success",
+            commit=False
         )
+        db.commit()
+        side_effects.dispatch(db)
         return {
-            "access_token": f"2fa_required_{user.id}",
+            "access_token": f"2fa_required_{user_id}",
             "token_type": "2fa_pending"
         }
     
     # Generate token - sub must be a string
-    access_token = auth.create_access_token(
-        data={"sub": str(user.id)},
+    user_id = user.id
+    access_token, token_jti, expires_at = auth.issue_access_token(
+        data={"sub": str(user_id), "role": user.role},
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
-    # Create user session for tracking
-    try:
-        from jose import jwt
-        payload = jwt.decode(access_token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        token_jti = payload.get('jti')
-        expires_at = payload.get('exp')
-        if token_jti and expires_at:
-            crud.create_user_session(
-                db,
-                user_id=user.id,
-                token_jti=token_jti,
-                ip_address=client_ip,
-                user_agent=request.headers.get('user-agent'),
-                expires_at=datetime.utcfromtimestamp(expires_at)
-            )
-    except Exception as e:
-        # Don't fail login if session creation fails
-        print(f"Warning: Failed to create user session: {str(e)}")
+    # Session, audit log and notification are committed together below
+    user_agent = request.headers.get('user-agent', '')
+    crud.create_user_session(
+        db,
+        user_id=user_id,
+        token_jti=token_jti,
+        ip_address=client_ip,
+        user_agent=request.headers.get('user-agent'),
+        expires_at=expires_at,
+        commit=False
+    )
     
     # Log successful login
     crud.create_audit_log(
         db,
-        user_id=user.id,
+        user_id=user_id,
         action="login_success",
         ip_address=client_ip,
-        status="success"
+        status="success",
+        commit=False
     )
     
     # Create in-app notification for new login
-    from ..notifications import InAppNotificationService
-    user_agent = request.headers.get('user-agent', '')
+    now = datetime.utcnow()
     device_info = f"{getBrowserInfo(user_agent)} on {getDeviceFromUserAgent(user_agent)}"
-    InAppNotificationService.create_notification(
+    crud.create_in_app_notification(
         db,
-        user_id=user.id,
+        user_id=user_id,
         notification_type="login_alert",
         title="New Login Detected",
-        message=f"You logged in from {device_info} at {datetime.utcnow().strftime('%H:%M UTC')}. If this wasn't you, please change your password immediately.",
+        message=f"You logged in from {device_info} at {now.strftime('%H:%M UTC')}. If this wasn't you, please change your password immediately.",
         details={
             "ip_address": client_ip,
             "device_info": device_info,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+            "timestamp": now.isoformat()
+        },
+        commit=False
     )
     
+    db.commit()
+    side_effects.dispatch(db)
+    
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _record_failed_login(db: Session, user: models.User, client_ip: str):
+    """Count a failed password attempt and lock the account at the threshold (caller commits)"""
+    # Increment failed login attempts
+    user.failed_login_attempts = (user.failed_login_attempts or 0) + 1
+    user.last_failed_login = datetime.utcnow()
+    
+    # Check if we should lock the account
+    MAX_FAILED_ATTEMPTS = int(os.getenv("MAX_FAILED_LOGIN_ATTEMPTS", "5"))
+    LOCKOUT_DURATION_MINUTES = int(os.getenv("ACCOUNT_LOCKOUT_MINUTES", "15"))
+    
+    if user.failed_login_attempts >= MAX_FAILED_ATTEMPTS:
+        # Lock the account
+        user.locked_until = datetime.utcnow() + timedelta(minutes=LOCKOUT_DURATION_MINUTES)
+        
+        crud.create_audit_log(
+            db,
+            user_id=user.id,
+            action="account_locked",
+            ip_address=client_ip,
+            status="warning",
+            reason="Too many failed login attempts",
+            details={
+                "failed_attempts": user.failed_login_attempts,
+                "locked_until": user.locked_until.isoformat(),
+                "lockout_duration_minutes": LOCKOUT_DURATION_MINUTES
+            },
+            commit=False
+        )
+        # Send email alert about account lock once the lockout is committed
+        side_effects.defer(db, email_service.send_brute_force_alert, user, user.failed_login_attempts)
+        # Create in-app notification
+        crud.create_in_app_notification(
+            db,
+            user_id=user.id,
+            notification_type="security_alert",
+            title="Account Locked",
+            message=f"Your account has been locked due to {user.failed_login_attempts} failed login attempts. It will unlock in 15 minutes.",
+            commit=False
+        )
+    else:
+        crud.create_audit_log(
+            db,
+            user_id=user.id,
+            action="login_failed",
+            ip_address=client_ip,
+            status="failed",
+            reason="Invalid password",
+            details={"failed_attempts": user.failed_login_attempts},
+            commit=False
+        )
+
 @router.get("/me", response_model=schemas.User)
 def get_current_user(current_user: models.User = Depends(auth.get_current_user)):
     return current_user
@@ -352,7 +367,7 @@ def check_users_exist(db: Session = Depends(get_db)):
 def get_login_settings(db: Session = Depends(get_db)):
     """Get public login settings (unauthenticated endpoint)"""
     try:
-        settings = db.query(models.GlobalSettings).first()
+        settings = crud.get_global_settings_snapshot(db)
         smtp_config = db.query(models.SMTPConfig).first()
         smtp_enabled = smtp_config.enabled if smtp_config else False
         
@@ -423,14 +438,14 @@ def suggest_username(data: dict, db: Session = Depends(get_db)):
 def get_login_page_theme(db: Session = Depends(get_db)):
     """Get the login page theme (public endpoint, no auth required)"""
     from .. import crud
-    settings = crud.get_global_settings(db)
+    settings = crud.get_global_settings_snapshot(db)
     return {"theme": settings.login_page_theme}
 
 @router.get("/settings")
 def get_auth_settings(db: Session = Depends(get_db)):
     """Get public auth settings (public endpoint, no auth required)"""
     from .. import crud
-    settings = crud.get_global_settings(db)
+    settings = crud.get_global_settings_snapshot(db)
     return {
         "signup_enabled": settings.signup_enabled,
         "theme": settings.login_page_theme
@@ -439,7 +454,7 @@ def get_auth_settings(db: Session = Depends(get_db)):
 @router.get("/oidc/config")
 def get_oidc_config(db: Session = Depends(get_db)):
     """Get OIDC configuration (public endpoint for frontend)"""
-    config = crud.get_oidc_config(db)
+    config = crud.get_oidc_config_snapshot(db)
     if not config.enabled:
         return {"enabled": False}
     return {
@@ -453,7 +468,7 @@ def get_oidc_config(db: Session = Depends(get_db)):
 @router.get("/oidc/login")
 async def oidc_login(request: Request, db: Session = Depends(get_db)):
     """Initiate OIDC login flow"""
-    config = crud.get_oidc_config(db)
+    config = crud.get_oidc_config_snapshot(db)
     if not config.enabled:
         raise HTTPException(status_code=400, detail="OIDC not enabled")
     
@@ -506,7 +521,7 @@ async def oidc_login(request: Request, db: Session = Depends(get_db)):
 @router.get("/oidc/callback")
 async def oidc_callback(code: str, state: str, request: Request, db: Session = Depends(get_db)):
     """Handle OIDC callback - exchanges authorization code for token"""
-    config = crud.get_oidc_config(db)
+    config = crud.get_oidc_config_snapshot(db)
     if not config.enabled:
         raise HTTPException(status_code=400, detail="OIDC not enabled")
     
@@ -586,7 +601,7 @@ async def oidc_callback(code: str, state: str, request: Request, db: Session = D
             
             # Generate token
             access_token = auth.create_access_token(
-                data={"sub": str(user.id)},
+                data={"sub": str(user.id), "role": user.role},
                 expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
             )
             
@@ -618,7 +633,7 @@ async def oidc_callback(code: str, state: str, request: Request, db: Session = D
 @router.get("/oidc/logout")
 async def oidc_logout(db: Session = Depends(get_db)):
     """Get OIDC logout URL"""
-    config = crud.get_oidc_config(db)
+    config = crud.get_oidc_config_snapshot(db)
     if not config.enabled or not config.logout_endpoint:
         return {"logout_url": None}
     
@@ -844,7 +859,7 @@ def verify_login_2fa(request: Request, data: dict, db: Session = Depends(get_db)
     
     # Generate token - sub must be a string
     access_token = auth.create_access_token(
-        data={"sub": str(user.id)},
+        data={"sub": str(user.id), "role": user.role},
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -852,7 +867,7 @@ def verify_login_2fa(request: Request, data: dict, db: Session = Depends(get_db)
     try:
         from jose import jwt
         from ..session_utils import parse_user_agent, create_session_fingerprint
-        from ..access_restrictions import access_restrictions
+        from ..geoip import geoip_provider
         
         payload = jwt.decode(access_token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         token_jti = payload.get('jti')
@@ -868,11 +883,9 @@ def verify_login_2fa(request: Request, data: dict, db: Session = Depends(get_db)
             city = None
             
             try:
-                geo_info = access_restrictions._get_country_code(client_ip)
-                if geo_info:
-                    country_code = geo_info
-                    # Note: City lookup would require a more advanced geo-IP service
-            except:
+                # Offline lookup (no network call); city is not in the GeoIP database
+                country_code = geoip_provider.country_code(client_ip)
+            except Exception:
                 pass  # Geo lookup failure shouldn't block login
             
             # Create enhanced session
@@ -1063,7 +1076,7 @@ def password_reset_confirm(request: Request, reset_confirm: schemas.PasswordRese
     
     # Generate new token for automatic login after reset
     access_token = auth.create_access_token(
-        data={"sub": str(updated_user.id)},
+        data={"sub": str(updated_user.id), "role": updated_user.role},
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     
@@ -1081,18 +1094,8 @@ def get_user_sessions(
     sessions = crud.get_user_sessions(db, current_user.id)
     
     # Find current session by checking JWT token
-    current_session_id = None
-    if hasattr(request.state, 'user') and hasattr(request.state.user, 'token_jti'):
-        current_session_id = request.state.user.token_jti
-    elif request.headers.get('authorization'):
-        # Try to extract JTI from current token
-        try:
-            from jose import jwt
-            token = request.headers.get('authorization').replace('Bearer ', '')
-            payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-            current_session_id = payload.get('jti')
-        except:
-            pass
+    principal = auth.get_request_principal(request)
+    current_session_id = principal.jti if principal else None
     
     return schemas.SessionListResponse(
         sessions=sessions,
@@ -1158,16 +1161,13 @@ def logout_all_sessions(
     db: Session = Depends(get_db)
 ):
     """Revoke all user sessions except the current one."""
-    # Find current session
+    # Find current session (revocation is enforced, so it must be excluded by id)
+    principal = auth.get_request_principal(request)
     current_session_id = None
-    if request.headers.get('authorization'):
-        try:
-            from jose import jwt
-            token = request.headers.get('authorization').replace('Bearer ', '')
-            payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-            current_session_id = payload.get('jti')
-        except:
-            pass
+    if principal and principal.jti:
+        current_session_id = db.query(models.UserSession.id).filter(
+            models.UserSession.token_jti == principal.jti
+        ).scalar()
     
     crud.revoke_all_user_sessions(db, current_user.id, exclude_session_id=current_session_id)
     
@@ -1212,7 +1212,7 @@ def verify_backup_code(request: Request, data: dict, db: Session = Depends(get_d
         
         # Generate token
         access_token = auth.create_access_token(
-            data={"sub": str(user.id)},
+            data={"sub": str(user.id), "role": user.role},
             expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
         )
         
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from ..database import get_db
 from .. import models, schemas, crud, auth
+from ..dashboard_rollups import adjust_categories
 
 router = APIRouter()
 
@@ -201,7 +203,12 @@ def delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Delete all associated applications first
+    # Delete all associated applications first (a bulk delete bypasses the
+    # ORM events that keep the category rollup up to date)
+    categories = db.query(models.Application.category, func.count(models.Application.id)).filter(
+        models.Application.user_id == user_id
+    ).group_by(models.Application.category).all()
+    adjust_categories(db, {category: -count for category, count in categories})
     db.query(models.Application).filter(models.Application.user_id == user_id).delete()
     
     # Delete the user
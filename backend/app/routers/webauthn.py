@@ -326,7 +326,7 @@ def complete_authentication(
         )
         
         # Generate JWT token
-        access_token = auth.create_access_token(data={"sub": str(user.id)})
+        access_token = auth.create_access_token(data={"sub": str(user.id), "role": user.role})
         
         return {
             "access_token": access_token,
@@ -364,8 +364,8 @@ def delete_credential(
             raise HTTPException(status_code=404, detail="Credential not found")
         
         # Get global WebAuthn enforcement settings
-        global_settings = db.query(models.GlobalSettings).first()
-        webauthn_enforcement = global_settings.webauthn_enforcement if global_settings else "optional"
+        global_settings = crud.get_global_settings_snapshot(db)
+        webauthn_enforcement = global_settings.webauthn_enforcement or "optional"
         
         # Check if this is the user's last security key
         other_webauthn = db.query(models.WebAuthnCredential).filter(
@@ -81,6 +81,23 @@ class QRExtractionResponse(BaseModel):
     color: str
 
 
+class ApplicationCode(BaseModel):
+    """Current OTP code for a single application"""
+    id: int
+    otp_type: str
+    code: str
+    period: Optional[int] = None  # TOTP only
+    remaining_seconds: Optional[int] = None  # TOTP only
+    next_code: Optional[str] = None  # TOTP only
+    counter: Optional[int] = None  # HOTP only: counter the code was generated from
+
+
+class ApplicationCodesResponse(BaseModel):
+    """Codes for all of a user's applications, generated at server_time"""
+    server_time: int
+    codes: List[ApplicationCode]
+
+
 class SMTPConfigBase(BaseModel):
     enabled: bool
     host: Optional[str] = None
@@ -0,0 +1,176 @@
+"""
+Decrypted Secret Cache Module
+
+Opt-in, in-process cache of decrypted application OTP secrets for the
+code-generation hot path. Users refresh the same accounts every period, so
+without a cache every refresh pays a Fernet decrypt.
+
+Security properties:
+- Disabled unless SECRET_CACHE_ENABLED=true
+- Bounded by SECRET_CACHE_MAX_ENTRIES (LRU) and SECRET_CACHE_TTL_SECONDS
+- Entries are keyed by (application id, SHA256 of the ciphertext), so a
+  changed secret never returns a stale value
+- Plaintext is held in bytearrays that are zeroed when evicted
+- Invalidated by crud.update_application / delete_application and cleared
+  whenever the encryption key ring is reloaded
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import secrets_encryption
+
+
+SECRET_CACHE_ENABLED = os.getenv("SECRET_CACHE_ENABLED", "false").lower() == "true"
+SECRET_CACHE_MAX_ENTRIES = int(os.getenv("SECRET_CACHE_MAX_ENTRIES", "1024"))
+SECRET_CACHE_TTL_SECONDS = float(os.getenv("SECRET_CACHE_TTL_SECONDS", "300"))
+
+
+def _ciphertext_digest(ciphertext: str) -> bytes:
+    return hashlib.sha256(ciphertext.encode()).digest()
+
+
+def _zero(buffer: bytearray):
+    buffer[:] = bytes(len(buffer))
+
+
+class _Entry:
+    __slots__ = ("digest", "secret", "expires_at")
+
+    def __init__(self, digest: bytes, secret: bytearray, expires_at: float):
+        self.digest = digest
+        self.secret = secret
+        self.expires_at = expires_at
+
+
+class SecretCache:
+    """Bounded LRU + TTL cache of decrypted secrets keyed by application id"""
+
+    def __init__(self, max_entries: int = SECRET_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = SECRET_CACHE_TTL_SECONDS,
+                 enabled: bool = SECRET_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, app_id: int, ciphertext: str) -> Optional[str]:
+        """Return the cached plaintext for this ciphertext, or None"""
+        if not self.enabled:
+            return None
+        digest = _ciphertext_digest(ciphertext)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(app_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.digest != digest or entry.expires_at <= now:
+                self._evict(app_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(app_id)
+            self.hits += 1
+            return entry.secret.decode()
+
+    def put(self, app_id: int, ciphertext: str, secret: str):
+        """Cache a decrypted secret, evicting the least recently used entry if full"""
+        if not self.enabled or not secret or self.max_entries <= 0:
+            return
+        entry = _Entry(
+            _ciphertext_digest(ciphertext),
+            bytearray(secret.encode()),
+            time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            if app_id in self._entries:
+                self._evict(app_id)
+            self._entries[app_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def get_or_decrypt(self, app_id: int, ciphertext: str,
+                       decrypt: Callable[[str], str] = None) -> str:
+        """Return the cached plaintext or decrypt (and cache) it"""
+        secret = self.get(app_id, ciphertext)
+        if secret is None:
+            secret = (decrypt or secrets_encryption.decrypt_secret)(ciphertext)
+            self.put(app_id, ciphertext, secret)
+        return secret
+
+    def get_or_decrypt_many(self, items: Iterable[Tuple[int, str]],
+                            decrypt_many: Callable[[List[str]], List[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        Resolve many (app_id, ciphertext) pairs, decrypting all misses in one batch.
+
+        decrypt_many receives the missing ciphertexts and must return the
+        plaintexts in order, with None for entries it cannot decrypt.
+        Entries that cannot be decrypted yield None.
+        """
+        items = list(items)
+        results: List[Optional[str]] = [self.get(app_id, ciphertext) for app_id, ciphertext in items]
+        missing = [i for i, secret in enumerate(results) if secret is None]
+        if missing:
+            tokens = [items[i][1] for i in missing]
+            if decrypt_many:
+                decrypted = decrypt_many(tokens)
+            else:
+                decrypted = secrets_encryption.decrypt_many(tokens, ignore_errors=True)
+            for i, secret in zip(missing, decrypted):
+                results[i] = secret
+                if secret:
+                    self.put(items[i][0], items[i][1], secret)
+        return results
+
+    def invalidate(self, app_id: int):
+        """Drop the cached secret for one application"""
+        with self._lock:
+            if app_id in self._entries:
+                self._evict(app_id)
+
+    def clear(self):
+        """Drop (and zero) every cached secret"""
+        with self._lock:
+            for app_id in list(self._entries):
+                self._evict(app_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _evict(self, app_id: int):
+        # Caller must hold self._lock
+        entry = self._entries.pop(app_id)
+        _zero(entry.secret)
+        self.evictions += 1
+
+
+# Global instance
+secret_cache = SecretCache()
+
+# Secrets decrypted under an old key ring must not outlive a key rotation
+secrets_encryption.add_key_ring_listener(secret_cache.clear)
+
+
+def get_secret_cache() -> SecretCache:
+    """Get the global decrypted secret cache"""
+    return secret_cache
@@ -9,13 +9,107 @@ protecting against database breaches and complete system compromise.
 
 Key Rotation Strategy:
 - ENCRYPTION_KEY: Primary encryption key for all secrets
+- PREVIOUS_ENCRYPTION_KEYS: Optional comma-separated list of retired keys that
+  are still accepted for decryption while secrets are being re-encrypted
 - Keep keys secure in environment variables or secure key management service
+
+Keys are loaded once into a process-wide KeyRing (a MultiFernet over the
+primary and previous keys). Call reload_key_ring() or send SIGHUP to the
+process to pick up a changed key without restarting.
+
+Ciphertext Formats:
+- "a1:" + base64url(nonce | AES-256-GCM ciphertext+tag): compact format
+  written by default. The AES key is derived from the Fernet key with HKDF.
+  A 16 character OTP secret is stored in 62 characters instead of ~140.
+- "gAAAAAB...": legacy Fernet tokens, still read and written when
+  SECRET_FORMAT=fernet
+- Raw bytes (version byte | nonce | ciphertext+tag) via encrypt_bytes /
+  decrypt_bytes, for binary columns
+Old formats are always readable and are replaced whenever a row is rewritten.
 """
 
 import os
-from cryptography.fernet import Fernet, InvalidToken
+import signal
+import threading
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
-from typing import Optional
+from typing import Callable, Iterable, List, Optional, Union
+
+
+SECRET_FORMAT = os.getenv("SECRET_FORMAT", "aead").lower()  # aead or fernet
+
+# Prefix of Fernet tokens encrypted directly with the master key ring
+FERNET_PREFIX = "gAAAAAB"
+# Prefix of AES-GCM tokens encrypted with the master key ring
+AEAD_PREFIX = "a1:"
+# Prefixes of secrets encrypted with a per-user data key (see envelope_encryption)
+ENVELOPE_PREFIX = "e1:"
+ENVELOPE_AEAD_PREFIX = "e2:"
+
+AEAD_VERSION = 1
+_AEAD_NONCE_SIZE = 12
+_AEAD_KDF_INFO = b"authnode2fa secrets aes-256-gcm v1"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class AEADCipher:
+    """
+    AES-256-GCM cipher keyed from a Fernet key.
+
+    The AES key is derived with HKDF so the Fernet key material is never
+    used directly by two different algorithms.
+    """
+
+    __slots__ = ("_aead",)
+
+    def __init__(self, fernet_key: Union[str, bytes]):
+        key_material = base64.urlsafe_b64decode(fernet_key)
+        aes_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=_AEAD_KDF_INFO).derive(key_material)
+        self._aead = AESGCM(aes_key)
+
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        """Encrypt to raw bytes: version | nonce | ciphertext+tag"""
+        nonce = os.urandom(_AEAD_NONCE_SIZE)
+        return bytes([AEAD_VERSION]) + nonce + self._aead.encrypt(nonce, data, None)
+
+    def decrypt_bytes(self, blob: bytes) -> bytes:
+        """
+        Decrypt raw bytes produced by encrypt_bytes.
+
+        Raises:
+            InvalidTag: If the data was not encrypted with this key or was modified
+        """
+        if not blob or blob[0] != AEAD_VERSION:
+            raise InvalidTag()
+        return self._aead.decrypt(blob[1:1 + _AEAD_NONCE_SIZE], blob[1 + _AEAD_NONCE_SIZE:], None)
+
+    def encrypt_text(self, secret: str, prefix: str) -> str:
+        """Encrypt to prefix + base64url(nonce | ciphertext+tag)"""
+        return prefix + _b64encode(self.encrypt_bytes(secret.encode())[1:])
+
+    def decrypt_text(self, token: str, prefix: str) -> str:
+        """
+        Decrypt a token produced by encrypt_text.
+
+        Raises:
+            InvalidTag: If the token was not encrypted with this key or was modified
+        """
+        try:
+            blob = bytes([AEAD_VERSION]) + _b64decode(token[len(prefix):])
+        except ValueError:
+            raise InvalidTag()
+        return self.decrypt_bytes(blob).decode()
 
 
 def get_encryption_key() -> str:
@@ -126,6 +220,229 @@ def get_encryption_key() -> str:
         raise ValueError(f"Failed to generate encryption key: {str(e)}")
 
 
+def get_previous_encryption_keys() -> List[str]:
+    """
+    Retrieve retired encryption keys that are still valid for decryption.
+
+    Keys are read from the comma-separated PREVIOUS_ENCRYPTION_KEYS
+    environment variable, newest first.
+
+    Returns:
+        List of base64-encoded Fernet keys (may be empty)
+
+    Raises:
+        ValueError: If any of the keys is invalid
+    """
+    raw = os.getenv("PREVIOUS_ENCRYPTION_KEYS", "")
+    keys = [k.strip() for k in raw.split(",") if k.strip()]
+    for key in keys:
+        try:
+            Fernet(key.encode())
+        except Exception as e:
+            raise ValueError(f"Invalid key in PREVIOUS_ENCRYPTION_KEYS: {str(e)}")
+    return keys
+
+
+class KeyRing:
+    """
+    Immutable set of Fernet keys used to encrypt and decrypt secrets.
+
+    The first key is the primary key and is used for all new encryptions.
+    Any additional keys are only used to decrypt tokens created before a
+    key rotation. New secrets are written in the compact AES-GCM format
+    unless secret_format is "fernet"; both formats are always readable.
+    """
+
+    def __init__(self, keys: List[str], secret_format: str = None):
+        if not keys:
+            raise ValueError("KeyRing requires at least one key")
+        secret_format = (secret_format or SECRET_FORMAT).lower()
+        if secret_format not in ("aead", "fernet"):
+            raise ValueError(f"Unknown SECRET_FORMAT: {secret_format}")
+        self.keys = list(keys)
+        self.secret_format = secret_format
+        self._fernets = [Fernet(k.encode() if isinstance(k, str) else k) for k in self.keys]
+        self._cipher = MultiFernet(self._fernets)
+        self._aeads = [AEADCipher(k) for k in self.keys]
+
+    @classmethod
+    def load(cls) -> "KeyRing":
+        """Build a key ring from the configured primary and previous keys."""
+        primary = get_encryption_key()
+        previous = [k for k in get_previous_encryption_keys() if k != primary]
+        return cls([primary] + previous)
+
+    @property
+    def primary_key(self) -> str:
+        return self.keys[0]
+
+    def encrypt(self, secret: str) -> str:
+        """Encrypt a single secret with the primary key."""
+        if not secret:
+            return ""
+        try:
+            if self.secret_format == "fernet":
+                return self._cipher.encrypt(secret.encode()).decode()
+            return self._aeads[0].encrypt_text(secret, AEAD_PREFIX)
+        except Exception as e:
+            raise ValueError(f"Failed to encrypt secret: {str(e)}")
+
+    def decrypt(self, encrypted_secret: str) -> str:
+        """Decrypt a single token (either format) using any key in the ring."""
+        if not encrypted_secret:
+            return ""
+        try:
+            if encrypted_secret.startswith(AEAD_PREFIX):
+                for aead in self._aeads:
+                    try:
+                        return aead.decrypt_text(encrypted_secret, AEAD_PREFIX)
+                    except InvalidTag:
+                        continue
+                raise InvalidToken
+            return self._cipher.decrypt(encrypted_secret.encode()).decode()
+        except InvalidToken:
+            raise ValueError(
+                "Failed to decrypt secret. This usually means the ENCRYPTION_KEY has changed. "
+                "If you changed the key, you need to migrate your encrypted secrets."
+            )
+        except Exception as e:
+            raise ValueError(f"Failed to decrypt secret: {str(e)}")
+
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        """Encrypt to raw bytes (version | nonce | ciphertext+tag) for binary columns."""
+        return self._aeads[0].encrypt_bytes(data)
+
+    def decrypt_bytes(self, blob: bytes) -> bytes:
+        """Decrypt raw bytes produced by encrypt_bytes using any key in the ring."""
+        for aead in self._aeads:
+            try:
+                return aead.decrypt_bytes(blob)
+            except InvalidTag:
+                continue
+        raise ValueError("Failed to decrypt secret: data was not encrypted with any known key")
+
+    def encrypt_many(self, secrets: Iterable[str]) -> List[str]:
+        """Encrypt a batch of secrets, preserving order."""
+        encrypt = self.encrypt
+        return [encrypt(secret) for secret in secrets]
+
+    def decrypt_many(self, encrypted_secrets: Iterable[str], ignore_errors: bool = False) -> List[Optional[str]]:
+        """
+        Decrypt a batch of tokens, preserving order.
+
+        If ignore_errors is True, tokens that cannot be decrypted yield None
+        instead of aborting the whole batch.
+        """
+        results = []
+        for token in encrypted_secrets:
+            try:
+                results.append(self.decrypt(token))
+            except ValueError:
+                if not ignore_errors:
+                    raise
+                results.append(None)
+        return results
+
+    def needs_reencryption(self, encrypted_secret: str) -> bool:
+        """Check if a token is in an older format than the one this ring writes."""
+        if not encrypted_secret:
+            return False
+        prefix = FERNET_PREFIX if self.secret_format == "fernet" else AEAD_PREFIX
+        return not encrypted_secret.startswith(prefix)
+
+    def rotate(self, encrypted_secret: str) -> str:
+        """Re-encrypt a token under the primary key (in the current format)."""
+        if not encrypted_secret:
+            return ""
+        try:
+            return self.encrypt(self.decrypt(encrypted_secret))
+        except ValueError:
+            raise ValueError("Failed to rotate secret: token was not encrypted with any known key")
+
+
+_key_ring: Optional[KeyRing] = None
+_key_ring_lock = threading.Lock()
+_key_ring_listeners: List[Callable[[], None]] = []
+
+
+def add_key_ring_listener(callback: Callable[[], None]):
+    """
+    Register a callback to run after the key ring is reloaded.
+
+    Used by caches of decrypted data so nothing decrypted under a previous
+    key ring survives a rotation.
+    """
+    _key_ring_listeners.append(callback)
+
+
+def get_key_ring() -> KeyRing:
+    """
+    Get the process-wide key ring, loading it on first use.
+
+    Returns:
+        The current KeyRing instance
+    """
+    ring = _key_ring
+    if ring is None:
+        with _key_ring_lock:
+            ring = _key_ring
+            if ring is None:
+                ring = _load_key_ring()
+    return ring
+
+
+def _load_key_ring() -> KeyRing:
+    global _key_ring
+    _key_ring = KeyRing.load()
+    return _key_ring
+
+
+def reload_key_ring() -> KeyRing:
+    """
+    Reload keys from the environment / key file and swap in a new key ring.
+
+    In-flight calls keep using the ring they already hold; the swap itself is
+    a single reference assignment.
+
+    Returns:
+        The newly loaded KeyRing
+    """
+    with _key_ring_lock:
+        ring = _load_key_ring()
+    for callback in list(_key_ring_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Warning: Key ring reload listener failed: {str(e)}")
+    return ring
+
+
+def install_reload_signal_handler(signum: int = None) -> bool:
+    """
+    Reload the key ring when the process receives SIGHUP (or signum).
+
+    Must be called from the main thread. Returns False on platforms without
+    the signal (e.g. Windows) or when called from another thread.
+    """
+    if signum is None:
+        signum = getattr(signal, "SIGHUP", None)
+    if signum is None:
+        return False
+
+    def _handle_reload(received_signum, frame):
+        try:
+            reload_key_ring()
+            print("Reloaded encryption key ring")
+        except Exception as e:
+            print(f"Warning: Failed to reload encryption key ring: {str(e)}")
+
+    try:
+        signal.signal(signum, _handle_reload)
+    except ValueError:
+        return False
+    return True
+
+
 def encrypt_secret(secret: str) -> str:
     """
     Encrypt a secret (OTP key, password, etc.) for secure storage.
@@ -134,21 +451,15 @@ def encrypt_secret(secret: str) -> str:
         secret: The plain text secret to encrypt
         
     Returns:
-        Encrypted secret string (Fernet token)
+        Encrypted secret string ("a1:" AES-GCM token, or Fernet token when
+        SECRET_FORMAT=fernet)
         
     Raises:
         ValueError: If encryption key is not configured
     """
     if not secret:
         return ""
-    
-    try:
-        key = get_encryption_key()
-        cipher = Fernet(key)
-        encrypted = cipher.encrypt(secret.encode())
-        return encrypted.decode()
-    except Exception as e:
-        raise ValueError(f"Failed to encrypt secret: {str(e)}")
+    return get_key_ring().encrypt(secret)
 
 
 def decrypt_secret(encrypted_secret: str) -> str:
@@ -166,36 +477,57 @@ def decrypt_secret(encrypted_secret: str) -> str:
     """
     if not encrypted_secret:
         return ""
-    
-    try:
-        key = get_encryption_key()
-        cipher = Fernet(key)
-        decrypted = cipher.decrypt(encrypted_secret.encode())
-        return decrypted.decode()
-    except InvalidToken:
-        raise ValueError(
-            "Failed to decrypt secret. This usually means the ENCRYPTION_KEY has changed. "
-            "If you changed the key, you need to migrate your encrypted secrets."
-        )
-    except Exception as e:
-        raise ValueError(f"Failed to decrypt secret: {str(e)}")
+    return get_key_ring().decrypt(encrypted_secret)
+
+
+def encrypt_many(secrets: Iterable[str]) -> List[str]:
+    """
+    Encrypt a batch of secrets with a single key ring lookup.
+
+    Args:
+        secrets: Plain text secrets
+
+    Returns:
+        Encrypted secrets in the same order
+    """
+    return get_key_ring().encrypt_many(secrets)
+
+
+def decrypt_many(encrypted_secrets: Iterable[str], ignore_errors: bool = False) -> List[Optional[str]]:
+    """
+    Decrypt a batch of secrets with a single key ring lookup.
+
+    Args:
+        encrypted_secrets: Encrypted secret strings
+        ignore_errors: Return None for undecryptable entries instead of raising
+
+    Returns:
+        Decrypted secrets in the same order
+    """
+    return get_key_ring().decrypt_many(encrypted_secrets, ignore_errors=ignore_errors)
 
 
 def is_encrypted(value: str) -> bool:
     """
     Check if a value is encrypted (basic check).
     
-    Encrypted Fernet tokens start with "gAAAAAB"
+    Encrypted Fernet tokens start with "gAAAAAB", AES-GCM tokens with "a1:"
+    and envelope-encrypted secrets with "e1:" or "e2:"
     
     Args:
         value: The value to check
         
     Returns:
-        True if value appears to be a Fernet encrypted token, False otherwise
+        True if value appears to be an encrypted token, False otherwise
     """
     if not value:
         return False
-    return value.startswith("gAAAAAB")
+    return value.startswith((FERNET_PREFIX, AEAD_PREFIX, ENVELOPE_PREFIX, ENVELOPE_AEAD_PREFIX))
+
+
+def is_master_key_token(value: str) -> bool:
+    """Check if a value was encrypted directly with the master key ring (any format)"""
+    return bool(value) and value.startswith((FERNET_PREFIX, AEAD_PREFIX))
 
 
 def encrypt_if_needed(secret: str) -> str:
@@ -219,6 +551,9 @@ def rotate_encryption_key(old_secrets: list[str], new_key: str) -> list[str]:
     Rotate encryption key for a list of secrets.
     
     This is used during key rotation to re-encrypt all secrets with the new key.
+    Secrets are decrypted with the current key ring and re-encrypted with
+    new_key in the configured SECRET_FORMAT; the process-wide key ring is
+    left untouched.
     
     Args:
         old_secrets: List of secrets encrypted with old key
@@ -227,18 +562,16 @@ def rotate_encryption_key(old_secrets: list[str], new_key: str) -> list[str]:
     Returns:
         List of secrets encrypted with new key
     """
+    ring = get_key_ring()
+    new_ring = KeyRing([new_key], secret_format=ring.secret_format)
     rotated = []
     for secret in old_secrets:
+        if not secret:
+            rotated.append(secret)
+            continue
         try:
-            # Decrypt with current key
-            decrypted = decrypt_secret(secret)
-            # Re-encrypt with new key (by temporarily setting ENCRYPTION_KEY)
-            old_key = os.getenv("ENCRYPTION_KEY")
-            os.environ["ENCRYPTION_KEY"] = new_key
-            encrypted = encrypt_secret(decrypted)
-            if old_key:
-                os.environ["ENCRYPTION_KEY"] = old_key
-            rotated.append(encrypted)
+            decrypted = ring.decrypt(secret)
+            rotated.append(new_ring.encrypt(decrypted))
         except Exception as e:
             print(f"Warning: Could not rotate secret: {str(e)}")
             rotated.append(secret)  # Keep original if rotation fails
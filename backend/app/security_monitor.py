@@ -13,24 +13,116 @@ Monitors audit logs and triggers alerts via email when suspicious patterns are d
 
 import os
 import time
-from typing import Dict, List, Any, Optional
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
 import threading
 
 
+class RingCounter:
+    """
+    Event count over a sliding window, kept in a fixed ring of time buckets.
+
+    add() and count() are O(1) amortized: each bucket is cleared once when
+    the window moves past it. Events are counted with bucket granularity, so
+    the window covers between (buckets - 1) and buckets bucket lengths.
+    """
+
+    __slots__ = ("bucket_seconds", "counts", "head", "total")
+
+    def __init__(self, window_seconds: float, buckets: int):
+        self.bucket_seconds = window_seconds / buckets
+        self.counts = array("l", [0]) * buckets
+        self.head = 0  # Index of the newest bucket (time // bucket_seconds)
+        self.total = 0
+
+    def add(self, now: float, amount: int = 1) -> int:
+        """Count events at time now; returns the count in the window"""
+        self._advance(now)
+        self.counts[self.head % len(self.counts)] += amount
+        self.total += amount
+        return self.total
+
+    def count(self, now: float) -> int:
+        """Number of events in the window ending now"""
+        self._advance(now)
+        return self.total
+
+    def _advance(self, now: float):
+        index = int(now // self.bucket_seconds)
+        steps = index - self.head
+        if steps <= 0:
+            return
+        size = len(self.counts)
+        if steps >= size:
+            self.counts = array("l", [0]) * size
+            self.total = 0
+        else:
+            for i in range(self.head + 1, index + 1):
+                slot = i % size
+                self.total -= self.counts[slot]
+                self.counts[slot] = 0
+        self.head = index
+
+
+class UserLogins:
+    """
+    Recent login activity of one user, in bounded memory.
+
+    ips holds the most recently seen IPs (least recent first) and is capped
+    at max_ips entries, enough to tell whether the unusual-IP threshold is
+    reached; logins counts login events over the hour.
+    """
+
+    __slots__ = ("ips", "logins", "max_ips")
+
+    def __init__(self, max_ips: int, window: Tuple[int, int]):
+        self.ips: "OrderedDict[str, float]" = OrderedDict()
+        self.logins = RingCounter(*window)
+        self.max_ips = max_ips
+
+    def add(self, ip: str, now: float):
+        self.ips[ip] = now
+        self.ips.move_to_end(ip)
+        while len(self.ips) > self.max_ips:
+            self.ips.popitem(last=False)
+        self.logins.add(now)
+
+    def expire(self, now: float, max_age: float = 3600):
+        """Forget IPs not seen for max_age seconds; O(1) per forgotten IP"""
+        while self.ips and next(iter(self.ips.values())) <= now - max_age:
+            self.ips.popitem(last=False)
+
+
 class SecurityMonitor:
     """Monitors security events and triggers alerts for suspicious activity"""
 
+    # (window seconds, buckets) of each counter
+    BRUTE_FORCE_WINDOW = (60, 12)  # Failed logins per IP
+    USER_FAILURE_WINDOW = (300, 10)  # Failed logins per user
+    HOURLY_WINDOW = (3600, 60)  # Password reset requests, 2FA disables
+    USER_LOGIN_WINDOW = (3600, 12)  # Login events per user (coarse: one per tracked user)
+    USER_FAILURE_THRESHOLD = 3
+
     def __init__(self, db_session_factory=None):
         self.db_session_factory = db_session_factory
         self.alert_cooldowns: Dict[str, float] = {}  # alert_type -> last_alert_time
-        self.event_queues: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
 
         # Monitoring thresholds (configurable via environment)
         self.BRUTE_FORCE_THRESHOLD = int(os.getenv("BRUTE_FORCE_THRESHOLD", "5"))  # Failed logins per minute
         self.UNUSUAL_IP_THRESHOLD = int(os.getenv("UNUSUAL_IP_THRESHOLD", "3"))  # Different IPs per hour per user
         self.ALERT_COOLDOWN_MINUTES = int(os.getenv("ALERT_COOLDOWN_MINUTES", "15"))  # Min time between alerts
+        self.MAX_TRACKED_KEYS = int(os.getenv("SECURITY_MONITOR_MAX_TRACKED_KEYS", "100000"))  # IPs/users per counter map
+
+        # Counters, all guarded by self._lock
+        self._lock = threading.Lock()
+        self.failed_by_ip: Dict[str, RingCounter] = {}
+        self.failed_by_user: Dict[int, RingCounter] = {}
+        self.login_ips_by_user: Dict[int, UserLogins] = {}  # user -> recent IPs and login count
+        self.password_resets = RingCounter(*self.HOURLY_WINDOW)
+        self.twofa_disables = RingCounter(*self.HOURLY_WINDOW)
+        self.events_seen = 0
 
         # Start monitoring thread
         self.monitoring_active = False
@@ -54,20 +146,23 @@ class SecurityMonitor:
         """
         Log a security event for monitoring.
         This should be called from audit logging functions.
-        """
-        event = {
-            'timestamp': time.time(),
-            'type': event_type,
-            'user_id': user_id,
-            'ip_address': ip_address,
-            'details': details or {}
-        }
-
-        # Add to event queue
-        self.event_queues[event_type].append(event)
 
-        # Check for immediate alerts
-        self._check_immediate_alerts(event)
+        Updates the counters for the event in constant time and raises any
+        alert whose threshold it crosses.
+        """
+        alerts = self._record_event(event_type, user_id, ip_address, time.time())
+        for alert_type, alert_details in alerts:
+            self._trigger_alert(alert_type, alert_details)
+
+    def stats(self) -> Dict[str, Any]:
+        """Number of tracked IPs/users and events seen"""
+        with self._lock:
+            return {
+                "events_seen": self.events_seen,
+                "tracked_ips": len(self.failed_by_ip),
+                "tracked_users": len(self.failed_by_user),
+                "users_with_login_ips": len(self.login_ips_by_user)
+            }
 
     def _monitor_loop(self):
         """Main monitoring loop that runs in background thread"""
@@ -79,109 +174,117 @@ class SecurityMonitor:
                 print(f"Security monitoring error: {e}")
                 time.sleep(60)
 
-    def _check_immediate_alerts(self, event: Dict[str, Any]):
-        """Check for alerts that should be triggered immediately"""
-        event_type = event['type']
-
-        # Brute force detection
-        if event_type == 'login_failed':
-            failed_logins = [e for e in self.event_queues['login_failed']
-                           if e['timestamp'] > time.time() - 60]  # Last minute
-
-            if len(failed_logins) >= self.BRUTE_FORCE_THRESHOLD:
-                # Group by IP to see if it's targeted
-                ip_counts = defaultdict(int)
-                for login in failed_logins:
-                    ip_counts[login.get('ip_address', 'unknown')] += 1
-
-                # Alert if any IP has many failures
-                for ip, count in ip_counts.items():
-                    if count >= self.BRUTE_FORCE_THRESHOLD:
-                        self._trigger_alert('brute_force_attack', {
-                            'ip_address': ip,
-                            'failed_attempts': count,
-                            'time_window': '1 minute'
-                        })
-
-        # Multiple failed logins for same user
-        elif event_type == 'login_failed' and event.get('user_id'):
-            user_id = event['user_id']
-            user_failures = [e for e in self.event_queues['login_failed']
-                           if e.get('user_id') == user_id and e['timestamp'] > time.time() - 300]  # Last 5 minutes
-
-            if len(user_failures) >= 3:
-                self._trigger_alert('multiple_user_failures', {
-                    'user_id': user_id,
-                    'failed_attempts': len(user_failures),
-                    'time_window': '5 minutes'
-                })
+    def _record_event(self, event_type: str, user_id: Optional[int], ip_address: Optional[str],
+                      now: float) -> List[Tuple[str, Dict[str, Any]]]:
+        """Update the counters for one event; returns the alerts to raise"""
+        alerts = []
+        with self._lock:
+            self.events_seen += 1
+
+            if event_type == 'login_failed':
+                # Brute force detection: failures from one IP in the last minute
+                ip = ip_address or 'unknown'
+                failures = self._counter(self.failed_by_ip, ip, self.BRUTE_FORCE_WINDOW).add(now)
+                if failures >= self.BRUTE_FORCE_THRESHOLD:
+                    alerts.append(('brute_force_attack', {
+                        'ip_address': ip,
+                        'failed_attempts': failures,
+                        'time_window': '1 minute'
+                    }))
+
+                # Multiple failed logins for same user
+                if user_id:
+                    failures = self._counter(self.failed_by_user, user_id, self.USER_FAILURE_WINDOW).add(now)
+                    if failures >= self.USER_FAILURE_THRESHOLD:
+                        alerts.append(('multiple_user_failures', {
+                            'user_id': user_id,
+                            'failed_attempts': failures,
+                            'time_window': '5 minutes'
+                        }))
+
+            if event_type in ('login_success', 'login_failed') and user_id:
+                # Users logging in from many different IPs in the last hour
+                logins = self.login_ips_by_user.get(user_id)
+                if logins is None:
+                    self._make_room(self.login_ips_by_user)
+                    logins = self.login_ips_by_user[user_id] = UserLogins(
+                        max(1, self.UNUSUAL_IP_THRESHOLD), self.USER_LOGIN_WINDOW
+                    )
+                logins.add(ip_address or 'unknown', now)
+                if len(logins.ips) >= self.UNUSUAL_IP_THRESHOLD:
+                    logins.expire(now)
+                    if len(logins.ips) >= self.UNUSUAL_IP_THRESHOLD:
+                        alerts.append(('unusual_login_pattern', {
+                            'user_id': str(user_id),
+                            'unique_ips': len(logins.ips),
+                            'total_logins': logins.logins.count(now),
+                            'time_window': '1 hour'
+                        }))
+
+            elif event_type == 'password_reset_requested':
+                self.password_resets.add(now)
+            elif event_type == '2fa_disabled':
+                self.twofa_disables.add(now)
+        return alerts
+
+    def _counter(self, counters: Dict[Any, RingCounter], key: Any,
+                 window: Tuple[int, int]) -> RingCounter:
+        # Caller must hold self._lock
+        counter = counters.get(key)
+        if counter is None:
+            self._make_room(counters)
+            counter = counters[key] = RingCounter(*window)
+        return counter
+
+    def _make_room(self, counters: Dict[Any, Any]):
+        # Caller must hold self._lock; evicts the longest-tracked key when full
+        if len(counters) >= self.MAX_TRACKED_KEYS:
+            del counters[next(iter(counters))]
 
     def _analyze_patterns(self):
-        """Analyze patterns in recent events to detect suspicious activity"""
+        """Check the hourly counters and drop IPs/users with no recent activity"""
         now = time.time()
-        one_hour_ago = now - 3600
-
-        # Analyze login patterns
-        login_events = []
-        for event_type in ['login_success', 'login_failed']:
-            login_events.extend([
-                e for e in self.event_queues[event_type]
-                if e['timestamp'] > one_hour_ago
-            ])
-
-        # Group by user and IP
-        user_ip_patterns: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
-
-        for event in login_events:
-            user_id = str(event.get('user_id', 'unknown'))
-            ip = event.get('ip_address', 'unknown')
-            user_ip_patterns[user_id][ip] += 1
-
-        # Check for users logging in from many different IPs
-        for user_id, ip_counts in user_ip_patterns.items():
-            if len(ip_counts) >= self.UNUSUAL_IP_THRESHOLD:
-                total_logins = sum(ip_counts.values())
-                self._trigger_alert('unusual_login_pattern', {
-                    'user_id': user_id,
-                    'unique_ips': len(ip_counts),
-                    'total_logins': total_logins,
+        alerts = []
+        with self._lock:
+            # Check for password reset abuse
+            reset_requests = self.password_resets.count(now)
+            if reset_requests >= 10:  # Many reset requests
+                alerts.append(('password_reset_spike', {
+                    'reset_requests': reset_requests,
+                    'time_window': '1 hour'
+                }))
+
+            # Check for 2FA disable attempts
+            disable_events = self.twofa_disables.count(now)
+            if disable_events >= 3:  # Multiple 2FA disables
+                alerts.append(('multiple_2fa_disables', {
+                    'disable_events': disable_events,
                     'time_window': '1 hour'
-                })
-
-        # Check for password reset abuse
-        password_reset_events = [
-            e for e in self.event_queues.get('password_reset_requested', [])
-            if e['timestamp'] > one_hour_ago
-        ]
-
-        if len(password_reset_events) >= 10:  # Many reset requests
-            self._trigger_alert('password_reset_spike', {
-                'reset_requests': len(password_reset_events),
-                'time_window': '1 hour'
-            })
-
-        # Check for 2FA disable attempts
-        disable_2fa_events = [
-            e for e in self.event_queues.get('2fa_disabled', [])
-            if e['timestamp'] > one_hour_ago
-        ]
-
-        if len(disable_2fa_events) >= 3:  # Multiple 2FA disables
-            self._trigger_alert('multiple_2fa_disables', {
-                'disable_events': len(disable_2fa_events),
-                'time_window': '1 hour'
-            })
+                }))
+
+            # Forget idle keys so the maps only hold recent attackers/users
+            for counters in (self.failed_by_ip, self.failed_by_user):
+                for key in [key for key, counter in counters.items() if counter.count(now) == 0]:
+                    del counters[key]
+            for user_id, logins in list(self.login_ips_by_user.items()):
+                logins.expire(now)
+                if not logins.ips:
+                    del self.login_ips_by_user[user_id]
+
+        for alert_type, alert_details in alerts:
+            self._trigger_alert(alert_type, alert_details)
 
     def _trigger_alert(self, alert_type: str, details: Dict[str, Any]):
         """Trigger a security alert with cooldown to prevent spam"""
         now = time.time()
-        last_alert = self.alert_cooldowns.get(alert_type, 0)
+        with self._lock:
+            last_alert = self.alert_cooldowns.get(alert_type, 0)
 
-        # Check cooldown
-        if now - last_alert < (self.ALERT_COOLDOWN_MINUTES * 60):
-            return  # Too soon since last alert
+            # Check cooldown
+            if now - last_alert < (self.ALERT_COOLDOWN_MINUTES * 60):
+                return  # Too soon since last alert
 
-        self.alert_cooldowns[alert_type] = now
+            self.alert_cooldowns[alert_type] = now
 
         # Log the alert
         print(f"SECURITY ALERT: {alert_type.upper()} - {details}")
@@ -0,0 +1,192 @@
+"""
+Session Revocation Module
+
+In-memory index of revoked session token ids (UserSession.token_jti) that
+auth.get_current_user consults on every request, so a revoked token is
+rejected without a database round-trip.
+
+- Loaded from user_sessions at startup, updated by crud.revoke_session and
+  crud.revoke_all_user_sessions
+- Exact set (jti -> token expiry) rather than a bloom filter: a false
+  positive would log out a valid session
+- Entries are pruned once the token has expired, since an expired token is
+  rejected anyway, so the index only holds revocations of live tokens
+- A background thread re-reads the table every
+  SESSION_REVOCATION_RESYNC_SECONDS, so revocations made by other workers
+  are enforced here after at most that interval
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models
+
+
+SESSION_REVOCATION_RESYNC_SECONDS = float(os.getenv("SESSION_REVOCATION_RESYNC_SECONDS", "30"))
+
+# Longest possible token lifetime (auth.ACCESS_TOKEN_EXPIRE_MINUTES); bounds
+# sessions stored without an expiry
+_MAX_TOKEN_LIFETIME = timedelta(days=1)
+
+
+def _to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    """Naive UTC datetime (as stored in user_sessions) to epoch seconds"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class RevocationIndex:
+    """Set of revoked token ids with their expiry, for O(1) lookups"""
+
+    def __init__(self, resync_seconds: float = SESSION_REVOCATION_RESYNC_SECONDS,
+                 session_factory=None):
+        self.resync_seconds = resync_seconds
+        self.session_factory = session_factory
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.loads = 0
+        self.last_load_at: Optional[float] = None
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """Check if a token id has been revoked (and has not expired yet)"""
+        if not jti:
+            return False
+        expires_at = self._revoked.get(jti)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            return False
+        with self._lock:
+            self.rejected += 1
+        return True
+
+    def add(self, jti: Optional[str], expires_at: Optional[datetime] = None):
+        """Mark one token id as revoked"""
+        self.add_many([(jti, expires_at)])
+
+    def add_many(self, revoked: Iterable[Tuple[Optional[str], Optional[datetime]]]):
+        """Mark token ids as revoked, given (jti, expires_at) pairs"""
+        default_expiry = time.time() + _MAX_TOKEN_LIFETIME.total_seconds()
+        with self._lock:
+            for jti, expires_at in revoked:
+                if jti:
+                    self._revoked[jti] = _to_timestamp(expires_at) or default_expiry
+
+    def load(self, db: Session) -> int:
+        """
+        Read every revoked, unexpired session from the database.
+
+        Loaded entries are merged with the current ones (a revocation is
+        never undone), and expired entries are pruned.
+
+        Returns:
+            Number of revoked tokens in the index
+        """
+        now = datetime.utcnow()
+        rows = (
+            db.query(models.UserSession.token_jti, models.UserSession.expires_at, models.UserSession.created_at)
+            .filter(
+                models.UserSession.revoked == True,
+                models.UserSession.token_jti.isnot(None),
+                or_(
+                    models.UserSession.expires_at > now,
+                    and_(models.UserSession.expires_at.is_(None),
+                         models.UserSession.created_at > now - _MAX_TOKEN_LIFETIME)
+                )
+            )
+            .all()
+        )
+        loaded = {
+            jti: _to_timestamp(expires_at or created_at + _MAX_TOKEN_LIFETIME)
+            for jti, expires_at, created_at in rows
+        }
+        cutoff = time.time()
+        with self._lock:
+            merged = {jti: exp for jti, exp in self._revoked.items() if exp > cutoff}
+            merged.update(loaded)
+            self._revoked = merged
+            self.loads += 1
+            self.last_load_at = cutoff
+            return len(merged)
+
+    def start(self):
+        """Start the background resync thread"""
+        if self.running:
+            return
+        if not self.session_factory:
+            raise ValueError("RevocationIndex requires a session factory")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="session-revocation-resync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the background resync thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def resync(self):
+        """Reload the index from the database"""
+        db = self.session_factory()
+        try:
+            self.load(db)
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size and resync activity"""
+        with self._lock:
+            return {
+                "revoked_tokens": len(self._revoked),
+                "resync_seconds": self.resync_seconds,
+                "loads": self.loads,
+                "seconds_since_load": round(time.time() - self.last_load_at, 1) if self.last_load_at else None,
+                "rejected_requests": self.rejected
+            }
+
+    def _run(self):
+        while not self._stop_event.wait(self.resync_seconds):
+            try:
+                self.resync()
+            except Exception as e:
+                print(f"Session revocation resync error: {e}")
+
+
+# Global instance
+revocation_index = RevocationIndex()
+
+
+def get_revocation_index() -> RevocationIndex:
+    """Get the global revoked-session index"""
+    return revocation_index
+
+
+def initialize_revocation_index(db_session_factory):
+    """Load the revoked sessions and keep the index in sync with the database"""
+    revocation_index.session_factory = db_session_factory
+    try:
+        revocation_index.resync()
+    except Exception as e:
+        # Tables may not exist yet (fresh install before migrations)
+        print(f"Warning: could not load revoked sessions: {e}")
+    revocation_index.start()
+
+
+def shutdown_revocation_index():
+    """Stop the background resync"""
+    revocation_index.stop()
@@ -0,0 +1,178 @@
+"""
+Settings Cache Module
+
+In-process cache of the singleton configuration rows (GlobalSettings,
+OIDCConfig, PasswordPolicy). They are read on every login and by public
+endpoints such as /api/auth/settings, but change only when an admin edits
+them.
+
+- Readers get a SettingsSnapshot: a detached, read-only copy of the row's
+  columns (JSON lists are frozen into tuples), safe to share between requests
+- Each row carries a version column bumped by crud.update_global_settings,
+  update_oidc_config and update_password_policy; those functions also drop
+  the local snapshot immediately
+- Other workers notice a change by polling the version (one single-column
+  SELECT) at most every SETTINGS_CACHE_POLL_SECONDS, which bounds how long
+  they may serve the previous settings
+- Snapshots are kept per database engine, so separate databases (tests,
+  scripts) never share settings
+- Code that modifies settings must keep using the ORM rows returned by
+  crud.get_global_settings / get_oidc_config / get_password_policy
+"""
+
+import os
+import threading
+import time
+import weakref
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+
+SETTINGS_CACHE_ENABLED = os.getenv("SETTINGS_CACHE_ENABLED", "true").lower() == "true"
+SETTINGS_CACHE_POLL_SECONDS = float(os.getenv("SETTINGS_CACHE_POLL_SECONDS", "5"))
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    return value
+
+
+class SettingsSnapshot:
+    """Read-only copy of a settings row, with the same attribute names"""
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values: Dict[str, Any]):
+        object.__setattr__(self, "_values", values)
+
+    @classmethod
+    def from_row(cls, row) -> "SettingsSnapshot":
+        """Copy the column values of an ORM row"""
+        return cls({
+            attr.key: _freeze(getattr(row, attr.key))
+            for attr in inspect(row).mapper.column_attrs
+        })
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError("Settings snapshots are read-only; update the row through crud")
+
+    def __delattr__(self, name: str):
+        raise AttributeError("Settings snapshots are read-only; update the row through crud")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self._values)
+
+    def __repr__(self) -> str:
+        return f"<SettingsSnapshot id={self._values.get('id')} version={self._values.get('version')}>"
+
+
+class _Entry:
+    __slots__ = ("snapshot", "checked_at")
+
+    def __init__(self, snapshot: SettingsSnapshot, checked_at: float):
+        self.snapshot = snapshot
+        self.checked_at = checked_at
+
+
+class SettingsCache:
+    """Per-process snapshots of singleton settings rows, revalidated by version"""
+
+    def __init__(self, poll_seconds: float = SETTINGS_CACHE_POLL_SECONDS,
+                 enabled: bool = SETTINGS_CACHE_ENABLED):
+        self.poll_seconds = poll_seconds
+        self.enabled = enabled
+        # engine -> model -> entry
+        self._entries: "weakref.WeakKeyDictionary[Any, Dict[type, _Entry]]" = weakref.WeakKeyDictionary()
+        # Bumped by invalidate(); a load that raced with an update is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.polls = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def get(self, db: Session, model: type, loader: Callable[[Session], Any]) -> SettingsSnapshot:
+        """
+        Snapshot of a settings row.
+
+        Args:
+            db: Session used for the version poll and, on a miss, the load
+            model: Settings model (with id and version columns)
+            loader: Get-or-create function returning the ORM row
+        """
+        if not self.enabled:
+            return SettingsSnapshot.from_row(loader(db))
+
+        bind = db.get_bind()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(bind, {}).get(model)
+            generation = self._generation
+            if entry is not None and now - entry.checked_at < self.poll_seconds:
+                self.hits += 1
+                return entry.snapshot
+
+        if entry is not None:
+            snapshot = entry.snapshot
+            version = db.query(model.version).filter(model.id == snapshot.id).scalar()
+            if version == snapshot.version:
+                with self._lock:
+                    entry.checked_at = now
+                    self.polls += 1
+                return snapshot
+
+        snapshot = SettingsSnapshot.from_row(loader(db))
+        with self._lock:
+            self.reloads += 1
+            if self._generation == generation:
+                self._entries.setdefault(bind, {})[model] = _Entry(snapshot, now)
+        return snapshot
+
+    def invalidate(self, model: Optional[type] = None):
+        """Drop the snapshots of one settings model (all of them if None)"""
+        with self._lock:
+            self.invalidations += 1
+            self._generation += 1
+            for models_by_type in self._entries.values():
+                if model is None:
+                    models_by_type.clear()
+                else:
+                    models_by_type.pop(model, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache size and hit/poll/reload counters"""
+        with self._lock:
+            reads = self.hits + self.polls + self.reloads
+            return {
+                "enabled": self.enabled,
+                "poll_seconds": self.poll_seconds,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "hits": self.hits,
+                "polls": self.polls,
+                "reloads": self.reloads,
+                "invalidations": self.invalidations,
+                "hit_rate": round((self.hits + self.polls) / reads, 4) if reads else 0.0
+            }
+
+
+# Global settings cache instance
+settings_cache = SettingsCache()
+
+
+def get_settings_cache() -> SettingsCache:
+    """Get the global settings cache"""
+    return settings_cache
@@ -0,0 +1,60 @@
+"""
+Deferred Side Effects Module
+
+Work that must only happen once a database transaction has committed:
+security monitor events, alert emails. Lets a handler write several rows in
+one transaction (crud functions called with commit=False) without raising
+alerts for changes that end up rolled back.
+
+    crud.create_audit_log(db, ..., commit=False)   # defers its monitor event
+    defer(db, email_service.send_brute_force_alert, user, attempts)
+    db.commit()
+    dispatch(db)
+
+- Callbacks queued in a transaction become ready when it commits and are
+  dropped when it rolls back
+- dispatch() runs the ready callbacks outside the commit, so they may read
+  (expired) ORM attributes; failures are logged and never reach the caller
+"""
+
+from typing import Callable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+_PENDING_KEY = "side_effects_pending"
+_READY_KEY = "side_effects_ready"
+
+
+def defer(db: Session, func: Callable, *args, **kwargs):
+    """Queue a callback to run after the session's current transaction commits"""
+    db.info.setdefault(_PENDING_KEY, []).append((func, args, kwargs))
+
+
+def dispatch(db: Session) -> int:
+    """
+    Run the callbacks of committed transactions.
+
+    Returns:
+        Number of callbacks run
+    """
+    ready: List[Tuple[Callable, tuple, dict]] = db.info.pop(_READY_KEY, [])
+    for func, args, kwargs in ready:
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            print(f"Deferred side effect {getattr(func, '__name__', func)} failed: {e}")
+    return len(ready)
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_ready(session: Session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        session.info.setdefault(_READY_KEY, []).extend(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session: Session):
+    session.info.pop(_PENDING_KEY, None)
@@ -1,7 +1,9 @@
 import pyotp
 import re
+import time
 import numpy as np
 from urllib.parse import unquote
+from . import otp_engine
 
 # Try to import QR decoding libraries
 try:
@@ -305,12 +307,28 @@ def get_service_color(service_name: str) -> str:
 
 def generate_totp_code(secret: str, otp_type: str = "TOTP", counter: int = 0) -> str:
     """Generate TOTP or HOTP code based on type"""
+    key = otp_engine.OTPKey(secret)
     if otp_type == "HOTP":
-        hotp = pyotp.HOTP(secret)
-        return hotp.at(counter)
+        return key.at_counter(counter)
     else:  # TOTP
-        totp = pyotp.TOTP(secret)
-        return totp.now()
+        return key.at()
+
+def get_totp_window(secret: str, for_time: float = None, interval: int = 30) -> dict:
+    """
+    Get the current and next TOTP code for a secret plus timing information.
+
+    Pass the same for_time for every secret in a batch so all codes belong to
+    the same period.
+    """
+    now = time.time() if for_time is None else for_time
+    key = otp_engine.OTPKey(secret, period=interval)
+    code, next_code = key.window(now, ahead=1)
+    return {
+        "code": code,
+        "next_code": next_code,
+        "period": interval,
+        "remaining_seconds": key.remaining_seconds(now)
+    }
 
 def generate_backup_key() -> str:
     return pyotp.random_base32()
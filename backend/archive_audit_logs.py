@@ -0,0 +1,79 @@
+"""
+Maintenance Script: Archive Old Audit Logs
+
+Moves audit logs older than the retention period out of the database into
+compressed segment files under AUDIT_ARCHIVE_DIR (see app/audit_archive.py),
+then deletes them in chunks. Archived logs can still be searched through
+/api/admin/audit-archive/search.
+
+Use this for the first archive of a large table, or instead of the background
+job (AUDIT_RETENTION_DAYS). Re-running after an interruption is safe: rows
+already written to a segment are deleted, not archived twice.
+
+Usage:
+    python archive_audit_logs.py --older-than-days 365 [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import models
+from app.database import SessionLocal
+from app.audit_archive import AUDIT_RETENTION_DAYS, audit_archiver
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=int, default=AUDIT_RETENTION_DAYS or None,
+                        required=not AUDIT_RETENTION_DAYS,
+                        help="archive logs older than this many days (default: AUDIT_RETENTION_DAYS)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the logs that would be archived")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("AUDIT LOG ARCHIVE")
+    print("=" * 60)
+
+    if args.older_than_days < 1:
+        print("Error: --older-than-days must be at least 1")
+        sys.exit(1)
+
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        if args.dry_run:
+            cutoff = datetime.utcnow() - timedelta(days=args.older_than_days)
+            count = db.query(models.AuditLog).filter(models.AuditLog.created_at < cutoff).count()
+            print(f"  {count} audit logs older than {cutoff.isoformat()} would be archived")
+            return
+        summary = audit_archiver.archive(db, older_than_days=args.older_than_days)
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    if summary["skipped"]:
+        print("  Another archive run is in progress; nothing done")
+        sys.exit(1)
+    print(f"  Cutoff: {summary['cutoff']}")
+    print(f"  Days: {summary['days']}")
+    print(f"  Rows archived: {summary['rows_archived']}")
+    print(f"  Rows deleted: {summary['rows_deleted']}")
+    print(f"  Segments written: {len(summary['segments'])} in {audit_archiver.directory}")
+    print(f"  Finished in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Maintenance Script: Rebuild Dashboard Rollups
+
+Recomputes the rollup tables behind /api/admin/dashboard/stats (daily login
+counts, per-user login counts, accounts per category) from audit_logs and
+applications. Run it once after upgrading an existing database, and whenever
+the rollups may have drifted (e.g. rows changed outside the application).
+
+The rebuild runs in a single transaction; audit events written while it runs
+are counted once they commit. Audit logs already moved to the archive
+(archive_audit_logs.py) are not counted, so rebuilding after archiving drops
+the login counts of archived days.
+
+Usage:
+    python backfill_rollups.py
+"""
+
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.dashboard_rollups import rebuild
+
+
+def main():
+    print("=" * 60)
+    print("DASHBOARD ROLLUP BACKFILL")
+    print("=" * 60)
+
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        counts = rebuild(db)
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    for table, rows in counts.items():
+        print(f"  {table}: {rows} rows")
+    print(f"  Rebuilt in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark: per-view history commits vs the write-behind history writer
+
+Simulates concurrent code views against a temporary SQLite database and
+reports views/sec when every view INSERTs and COMMITs its own
+CodeGenerationHistory row (the previous behaviour) and when views are queued
+in app.history_writer and bulk-inserted in the background.
+
+Usage:
+    python benchmarks/history_writer_benchmark.py [--views 5000] [--threads 8] [--batch-size 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from app import models
+from app.history_writer import HistoryWriter
+
+
+def run_views(session_factory, views: int, threads: int, record) -> float:
+    """Run `views` calls of record(db, i) spread across threads; return elapsed seconds"""
+    per_thread = views // threads
+
+    def worker():
+        db = session_factory()
+        try:
+            for i in range(per_thread):
+                record(db, i)
+        finally:
+            db.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start
+
+
+def count_rows(session_factory) -> int:
+    db = session_factory()
+    try:
+        return db.query(func.count(models.CodeGenerationHistory.id)).scalar()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--views", type=int, default=5000, help="code views to simulate")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent request threads")
+    parser.add_argument("--batch-size", type=int, default=200, help="history writer batch size")
+    parser.add_argument("--flush-ms", type=int, default=200, help="history writer flush interval")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            connect_args={"check_same_thread": False, "timeout": 30}
+        )
+        models.Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        views = args.views - args.views % args.threads
+        print(f"{views} code views across {args.threads} threads\n")
+
+        def direct(db, i):
+            db.add(models.CodeGenerationHistory(application_id=1, user_id=1, ip_address="127.0.0.1"))
+            db.commit()
+
+        elapsed = run_views(SessionLocal, views, args.threads, direct)
+        print(f"  {'commit per view':<32} {views / elapsed:10.0f} views/sec")
+
+        writer = HistoryWriter(
+            session_factory=SessionLocal,
+            batch_size=args.batch_size,
+            flush_interval_ms=args.flush_ms,
+            max_queue_size=views,
+            full_policy="block"
+        )
+        writer.start()
+        elapsed = run_views(
+            SessionLocal, views, args.threads,
+            lambda db, i: writer.record(db, application_id=1, user_id=1, ip_address="127.0.0.1")
+        )
+        request_rate = views / elapsed
+        start = time.perf_counter()
+        writer.stop()
+        drain_elapsed = elapsed + time.perf_counter() - start
+        print(f"  {'write-behind (request path)':<32} {request_rate:10.0f} views/sec")
+        print(f"  {'write-behind (until persisted)':<32} {views / drain_elapsed:10.0f} views/sec")
+
+        stats = writer.stats()
+        print(f"\n  batches={stats['batches']} avg_batch={stats['avg_batch_size']} "
+              f"dropped={stats['dropped']} failed={stats['failed']}")
+        print(f"  rows in table: {count_rows(SessionLocal)} (expected {views * 2})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: IP restriction checks against large range lists
+
+Checks random client addresses against blocklists of increasing size,
+comparing a linear scan over ipaddress.ip_network objects (parsed on every
+check, as before) with the compiled CIDR matcher.
+
+Usage:
+    python benchmarks/ip_restrictions_benchmark.py [--checks 2000] [--ranges 10,1000,10000]
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.access_restrictions import AccessRestrictions
+
+
+def linear_check(ip_address: str, cidrs) -> bool:
+    client_ip = ipaddress.ip_address(ip_address)
+    for cidr in cidrs:
+        if client_ip in ipaddress.ip_network(cidr, strict=False):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checks", type=int, default=2000, help="addresses checked per run")
+    parser.add_argument("--ranges", default="10,1000,10000", help="comma-separated blocklist sizes")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    addresses = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+                 for _ in range(args.checks)]
+    restrictions = AccessRestrictions()
+
+    print(f"{args.checks} checks per run\n")
+    print(f"  {'ranges':>8} {'linear us/check':>16} {'compiled us/check':>18} {'compile ms':>11}")
+    for size in (int(n) for n in args.ranges.split(",")):
+        cidrs = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24" for _ in range(size)]
+        settings = type("Settings", (), {
+            "id": 1, "version": size, "ip_restrictions_enabled": True,
+            "allowed_ip_ranges": [], "blocked_ip_ranges": cidrs
+        })()
+
+        linear_checks = addresses[:max(1, min(len(addresses), 200_000 // size))]
+        start = time.perf_counter()
+        for address in linear_checks:
+            linear_check(address, cidrs)
+        linear = (time.perf_counter() - start) / len(linear_checks)
+
+        start = time.perf_counter()
+        restrictions.compiled_ranges(settings)
+        compile_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for address in addresses:
+            restrictions.check_ip_restrictions(address, settings)
+        compiled = (time.perf_counter() - start) / len(addresses)
+
+        print(f"  {size:>8} {linear * 1e6:16.1f} {compiled * 1e6:18.2f} {compile_time * 1000:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: cost of one successful /api/auth/login
+
+Logs a local user in repeatedly against an in-memory SQLite database and
+reports the SQL statements and commits issued per login, and the latency
+with and without the time spent in Argon2 verification.
+
+Usage:
+    python benchmarks/login_benchmark.py [--logins 50]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ENCRYPTION_KEY", "ZmDfcTF7_60GrrY167zsiPd67pEvs0aGOv2oasOM1Pg=")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import auth, models
+from app.database import get_db
+from app.main import app
+from app.password_hashing import password_hasher
+from app.rate_limit import limiter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=50, help="number of logins to time")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    limiter.enabled = False
+
+    db = SessionLocal()
+    db.add(models.User(email="bench@example.com", username="bench", name="Bench", role="user",
+                       password_hash=auth.hash_password("Passw0rd!x"), is_sso_user=False))
+    db.add(models.GlobalSettings(login_page_theme="light"))
+    db.commit()
+    db.close()
+
+    counts = {"statements": 0, "commits": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(*_):
+        counts["statements"] += 1
+
+    @event.listens_for(engine, "commit")
+    def count_commit(*_):
+        counts["commits"] += 1
+
+    client = TestClient(app)
+    body = {"email": "bench@example.com", "password": "Passw0rd!x"}
+    client.post("/api/auth/login", json=body)  # warm up
+
+    statements, commits, total_ms, excl_hash_ms = [], [], [], []
+    for _ in range(args.logins):
+        counts["statements"] = counts["commits"] = 0
+        verify_before = password_hasher.stats()["operations"].get("verify", {})
+        start = time.perf_counter()
+        response = client.post("/api/auth/login", json=body)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert response.status_code == 200, response.text
+        verify_after = password_hasher.stats()["operations"]["verify"]
+        hash_ms = (verify_after["hash_time_avg_ms"] * verify_after["count"]
+                   - verify_before.get("hash_time_avg_ms", 0.0) * verify_before.get("count", 0))
+        statements.append(counts["statements"])
+        commits.append(counts["commits"])
+        total_ms.append(elapsed)
+        excl_hash_ms.append(elapsed - hash_ms)
+
+    print(f"{args.logins} successful logins\n")
+    print(f"  SQL statements per login: {statistics.mean(statements):.1f}")
+    print(f"  commits per login:        {statistics.mean(commits):.1f}")
+    print(f"  latency p50:              {statistics.median(total_ms):.2f} ms")
+    print(f"  latency p50 excl. Argon2: {statistics.median(excl_hash_ms):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: rate limit decisions per second
+
+Runs limiter.hit() against each storage/strategy combination with a mix of
+keys (one per simulated client), from one or more threads, and reports
+decisions per second and how many requests were allowed.
+
+Usage:
+    python benchmarks/rate_limit_benchmark.py [--decisions 50000] [--keys 1000] [--threads 1]
+                                              [--limit "100/minute"]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import STRATEGIES
+
+from app import rate_limit_storage  # noqa: F401 - registers sqlite://
+
+
+def run(storage_uri: str, strategy: str, args) -> tuple:
+    storage = storage_from_string(storage_uri)
+    limiter = STRATEGIES[strategy](storage)
+    item = parse(args.limit)
+    per_thread = args.decisions // args.threads
+    allowed = [0] * args.threads
+
+    def worker(index: int):
+        count = 0
+        for i in range(per_thread):
+            if limiter.hit(item, f"ip:10.0.{index}.{i % args.keys}", "benchmark"):
+                count += 1
+        allowed[index] = count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    storage.reset()
+    return per_thread * args.threads / elapsed, sum(allowed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decisions", type=int, default=50000, help="total limiter.hit() calls per run")
+    parser.add_argument("--keys", type=int, default=1000, help="distinct clients per thread")
+    parser.add_argument("--threads", type=int, default=1, help="concurrent threads")
+    parser.add_argument("--limit", default="100/minute", help="rate limit applied to every key")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_uri = f"sqlite:///{os.path.join(tmp, 'ratelimit.db')}"
+        runs = [
+            ("memory://", "fixed-window"),
+            ("memory://", "sliding-window-counter"),
+            (sqlite_uri, "fixed-window"),
+            (sqlite_uri, "sliding-window-counter"),
+        ]
+        print(f"{args.decisions} decisions, {args.keys} keys/thread, {args.threads} thread(s), limit {args.limit}\n")
+        print(f"  {'storage':<10} {'strategy':<24} {'decisions/sec':>14} {'allowed':>10}")
+        for uri, strategy in runs:
+            rate, allowed = run(uri, strategy, args)
+            print(f"  {uri.split(':')[0]:<10} {strategy:<24} {rate:14,.0f} {allowed:10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark: Fernet vs compact AES-GCM secret formats
+
+Measures encrypt/decrypt throughput of the legacy Fernet tokens, the "a1:"
+AES-GCM text format and the raw-bytes AES-GCM format, then fills a
+temporary SQLite applications table with each format and reports the
+average column length and total database size.
+
+Usage:
+    python benchmarks/secret_format_benchmark.py [--secrets 10000] [--rounds 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyotp
+from cryptography.fernet import Fernet
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, Table, Text, create_engine, func, select, text
+
+from app.secrets_encryption import KeyRing
+
+
+def best_time(func, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def table_size(values, binary: bool) -> tuple:
+    """Insert values into a fresh SQLite table; return (avg column bytes, database bytes)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "size.db")
+        engine = create_engine(f"sqlite:///{path}")
+        metadata = MetaData()
+        table = Table(
+            "applications", metadata,
+            Column("id", Integer, primary_key=True),
+            Column("secret", LargeBinary if binary else Text)
+        )
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(table.insert(), [{"secret": value} for value in values])
+        with engine.connect() as conn:
+            avg_length = conn.execute(select(func.avg(func.length(table.c.secret)))).scalar()
+            conn.execute(text("VACUUM"))
+        engine.dispose()
+        return avg_length, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--secrets", type=int, default=10000, help="number of OTP secrets")
+    parser.add_argument("--rounds", type=int, default=3, help="repetitions (best is reported)")
+    args = parser.parse_args()
+
+    key = Fernet.generate_key().decode()
+    fernet_ring = KeyRing([key], secret_format="fernet")
+    aead_ring = KeyRing([key], secret_format="aead")
+    secrets = [pyotp.random_base32() for _ in range(args.secrets)]
+    raw_secrets = [s.encode() for s in secrets]
+
+    formats = [
+        ("fernet (gAAAAAB...)", fernet_ring.encrypt_many, fernet_ring.decrypt_many, secrets, False),
+        ("aes-gcm text (a1:...)", aead_ring.encrypt_many, aead_ring.decrypt_many, secrets, False),
+        ("aes-gcm raw bytes",
+         lambda values: [aead_ring.encrypt_bytes(v) for v in values],
+         lambda blobs: [aead_ring.decrypt_bytes(b) for b in blobs],
+         raw_secrets, True),
+    ]
+
+    print(f"{args.secrets} secrets of {len(secrets[0])} characters\n")
+    print(f"  {'format':<24} {'encrypt':>12} {'decrypt':>12} {'avg column':>12} {'db size':>12}")
+    for label, encrypt, decrypt, plain, binary in formats:
+        tokens = encrypt(plain)
+        encrypt_us = best_time(lambda: encrypt(plain), args.rounds) / len(plain) * 1_000_000
+        decrypt_us = best_time(lambda: decrypt(tokens), args.rounds) / len(plain) * 1_000_000
+        avg_length, db_size = table_size(tokens, binary)
+        print(f"  {label:<24} {encrypt_us:9.2f} us {decrypt_us:9.2f} us "
+              f"{avg_length:10.1f} B {db_size / 1024:9.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Maintenance Script: Import a GeoIP Database
+
+Converts an IP range -> country CSV into the compact binary file that the
+application memory-maps for offline country lookups (geographic access
+restrictions, session locations). Supported CSV layouts:
+
+    start_ip,end_ip,country_code[,...]   e.g. DB-IP "IP to Country Lite",
+                                         IP2Location LITE DB1 (integer IPs)
+    network,country_code[,...]           CIDR ranges
+
+The output file is replaced atomically; restart the application (or call
+GeoIPProvider.reload()) to pick up a new file.
+
+Usage:
+    python import_geoip.py dbip-country-lite.csv [--output geoip.bin] [--check 8.8.8.8]
+"""
+
+import argparse
+import os
+import sys
+import time
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.geoip import GEOIP_DATABASE_PATH, GeoIPDatabase, import_csv
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="CSV file of IP ranges and country codes")
+    parser.add_argument("--output", default=GEOIP_DATABASE_PATH,
+                        help="database file to write (default: GEOIP_DATABASE_PATH)")
+    parser.add_argument("--check", action="append", default=[], metavar="IP",
+                        help="look up an address in the new database (repeatable)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("GEOIP DATABASE IMPORT")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    try:
+        counts = import_csv(args.csv, args.output)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    print(f"  IPv4 ranges: {counts['ipv4_ranges']}")
+    print(f"  IPv6 ranges: {counts['ipv6_ranges']}")
+    print(f"  Written to {args.output} ({os.path.getsize(args.output) / 1024:.0f} KiB) in {elapsed:.1f}s")
+
+    if args.check:
+        database = GeoIPDatabase(args.output)
+        try:
+            for ip in args.check:
+                print(f"  {ip}: {database.lookup(ip) or 'unknown'}")
+        finally:
+            database.close()
+
+    if not counts["ipv4_ranges"] and not counts["ipv6_ranges"]:
+        print("Warning: no ranges were imported; check the CSV layout")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Maintenance Script: Rotate Encryption Keys
+
+Re-encrypts every encrypted column (application OTP secrets, user TOTP
+secrets, SMTP passwords) under a new key, in keyset-paginated chunks with
+one commit per chunk. Progress is checkpointed so an interrupted run can be
+restarted with the same command and resumes where it stopped.
+
+Typical rotation:
+    1. Generate a new key:
+       python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+    2. Deploy with ENCRYPTION_KEY=<new key> and PREVIOUS_ENCRYPTION_KEYS=<old key>
+       (the application keeps reading secrets encrypted with the old key)
+    3. Run this script
+    4. Remove the old key from PREVIOUS_ENCRYPTION_KEYS
+
+Usage:
+    python rotate_encryption_keys.py [--chunk-size 1000] [--workers 4] [--processes]
+                                     [--checkpoint .key_rotation_checkpoint.json]
+                                     [--new-key KEY] [--old-keys KEY1,KEY2]
+                                     [--smtp-new-key KEY] [--only applications.secret]
+"""
+
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal
+from app.key_rotation import KeyRotator, default_targets
+
+
+def print_progress(stats):
+    print(f"  {stats.name}: {stats.rows} rows, {stats.rotated} rotated "
+          f"({stats.rows_per_second:.0f} rows/sec)", end="\r", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per chunk / transaction")
+    parser.add_argument("--workers", type=int, default=4, help="re-encryption workers")
+    parser.add_argument("--processes", action="store_true", help="use worker processes instead of threads")
+    parser.add_argument("--checkpoint", default=".key_rotation_checkpoint.json",
+                        help="checkpoint file used to resume an interrupted rotation")
+    parser.add_argument("--new-key", help="key to rotate to (default: ENCRYPTION_KEY)")
+    parser.add_argument("--old-keys", help="comma-separated keys to rotate from "
+                                           "(default: ENCRYPTION_KEY and PREVIOUS_ENCRYPTION_KEYS)")
+    parser.add_argument("--smtp-new-key", help="new key for SMTP passwords when SMTP_ENCRYPTION_KEY is set")
+    parser.add_argument("--only", action="append", help="only rotate this column (repeatable)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("ENCRYPTION KEY ROTATION")
+    print("=" * 60)
+
+    old_keys = [k.strip() for k in args.old_keys.split(",") if k.strip()] if args.old_keys else None
+    targets = default_targets(new_key=args.new_key, old_keys=old_keys, smtp_new_key=args.smtp_new_key)
+    if args.only:
+        targets = [t for t in targets if t.name in args.only]
+
+    rotator = KeyRotator(
+        SessionLocal,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        use_processes=args.processes,
+        checkpoint_path=args.checkpoint,
+        progress=print_progress
+    )
+
+    try:
+        results = rotator.run(targets)
+    except Exception as e:
+        print(f"\n❌ ROTATION FAILED: {str(e)}")
+        print(f"   Progress was saved to {args.checkpoint}; re-run the same command to resume.")
+        sys.exit(1)
+
+    print("\n" + "=" * 60)
+    print("ROTATION SUMMARY")
+    print("=" * 60)
+    failed = False
+    for stats in results:
+        print(f"\n{stats.name}:")
+        print(f"  Rows:      {stats.rows}")
+        print(f"  Rotated:   {stats.rotated}")
+        print(f"  Skipped:   {stats.skipped} (plain text or envelope-encrypted)")
+        print(f"  Conflicts: {stats.conflicts} (changed during rotation)")
+        print(f"  Failed:    {stats.failed}")
+        print(f"  Rate:      {stats.rows_per_second:.0f} rows/sec over {stats.chunks} chunks")
+        if stats.failed_ids:
+            failed = True
+            print(f"  ⚠️  Could not decrypt ids: {stats.failed_ids[:20]}"
+                  f"{' ...' if len(stats.failed_ids) > 20 else ''}")
+
+    if failed:
+        print("\n⚠️  Some values could not be decrypted with any configured key.")
+    else:
+        print("\n✅ All encrypted values now use the new key.")
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,21 @@ def db_session(engine):
     Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture
+def session_factory():
+    """Session factory on a fresh in-memory database shared by all its sessions and threads"""
+    engine = create_engine(
+        TEST_DATABASE_URL,
+        connect_args={
+            "check_same_thread": False,
+        },
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
 @pytest.fixture
 def client(db_session):
     """Create a test client"""
@@ -67,6 +67,64 @@ class TestApplications:
         assert len(data["code"]) == 6  # TOTP codes are 6 digits
         assert data["code"].isdigit()
 
+    def test_get_all_codes(self, session_factory, monkeypatch):
+        """Codes for all applications come back in one request; HOTP only on request"""
+        import pyotp
+        from cryptography.fernet import Fernet
+        from fastapi.testclient import TestClient
+        from app import models, secrets_encryption
+        from app.auth import get_current_user
+        from app.database import get_db
+        from app.main import app
+        from app.rate_limit import limiter
+
+        monkeypatch.setattr(secrets_encryption, "_key_ring", secrets_encryption.KeyRing([Fernet.generate_key().decode()]))
+        db = session_factory()
+        user = models.User(email="codes@example.com", username="codes", role="user")
+        db.add(user)
+        db.commit()
+        totp = models.Application(name="TOTP App", user_id=user.id, otp_type="TOTP",
+                                  secret=secrets_encryption.encrypt_secret("JBSWY3DPEHPK3PXP"))
+        hotp = models.Application(name="HOTP App", user_id=user.id, otp_type="HOTP", counter=4,
+                                  secret=secrets_encryption.encrypt_secret("GEZDGNBVGY3TQOJQ"))
+        db.add_all([totp, hotp])
+        db.commit()
+        user_id, totp_id, hotp_id = user.id, totp.id, hotp.id
+        db.close()
+
+        def override_get_db():
+            session = session_factory()
+            try:
+                yield session
+            finally:
+                session.close()
+
+        monkeypatch.setattr(limiter, "enabled", False)
+        monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user,
+                            lambda: models.User(id=user_id, email="codes@example.com", role="user"))
+        client = TestClient(app)
+        response = client.get("/api/applications/codes")
+        assert response.status_code == 200
+        data = response.json()
+        assert "server_time" in data
+        codes = {entry["id"]: entry for entry in data["codes"]}
+        assert list(codes) == [totp_id]
+
+        entry = codes[totp_id]
+        assert entry["otp_type"] == "TOTP"
+        assert entry["code"] == pyotp.TOTP("JBSWY3DPEHPK3PXP").at(data["server_time"])
+        assert len(entry["next_code"]) == 6
+        assert entry["period"] == 30
+        assert 1 <= entry["remaining_seconds"] <= 30
+
+        response = client.get("/api/applications/codes", params={"include_hotp": "true"})
+        assert response.status_code == 200
+        codes = {entry["id"]: entry for entry in response.json()["codes"]}
+        assert set(codes) == {totp_id, hotp_id}
+        assert codes[hotp_id]["otp_type"] == "HOTP"
+        assert codes[hotp_id]["code"] == pyotp.HOTP("GEZDGNBVGY3TQOJQ").at(codes[hotp_id]["counter"])
+
     def test_access_other_user_application(self, client, authenticated_client, test_application):
         """Test that users cannot access other users' applications"""
         # Create another user and application
@@ -228,3 +286,231 @@ class TestSearchAndFiltering:
         # Should include the original test app (Personal) plus the new Personal app
         personal_apps = [app for app in data if app["category"] == "Personal"]
         assert len(personal_apps) >= 2
+
+
+class TestCodeGeneration:
+    """Test OTP code generation helpers"""
+
+    def test_totp_window(self):
+        """Test current/next code and remaining time for a fixed timestamp"""
+        import pyotp
+        from app.utils import get_totp_window
+
+        secret = "JBSWY3DPEHPK3PXP"
+        window = get_totp_window(secret, for_time=1_000_000_010)
+
+        totp = pyotp.TOTP(secret)
+        assert window["code"] == totp.at(1_000_000_010)
+        assert window["next_code"] == totp.at(1_000_000_040)
+        assert window["period"] == 30
+        assert window["remaining_seconds"] == 30 - (1_000_000_010 % 30)
+
+    def test_otp_engine_rfc6238_vectors(self):
+        """Test SHA1/SHA256/SHA512 8-digit codes against the RFC 6238 test vectors"""
+        from app.otp_engine import OTPKey
+
+        seeds = {
+            "sha1": b"12345678901234567890",
+            "sha256": b"12345678901234567890123456789012",
+            "sha512": b"1234567890123456789012345678901234567890123456789012345678901234",
+        }
+        vectors = [
+            (59, {"sha1": "94287082", "sha256": "46119246", "sha512": "90693936"}),
+            (1111111109, {"sha1": "07081804", "sha256": "68084774", "sha512": "25091201"}),
+            (20000000000, {"sha1": "65353130", "sha256": "77737706", "sha512": "47863826"}),
+        ]
+
+        for digest, seed in seeds.items():
+            key = OTPKey(seed, digest=digest, digits=8)
+            for for_time, expected in vectors:
+                assert key.at(for_time) == expected[digest]
+
+    def test_otp_engine_matches_pyotp(self):
+        """Test windows, HOTP counters and custom periods against pyotp"""
+        import pyotp
+        from app import otp_engine
+
+        secret = "jbsw y3dp ehpk 3pxp"  # Lowercase and spaces are accepted
+        key = otp_engine.OTPKey(secret)
+        reference = pyotp.TOTP("JBSWY3DPEHPK3PXP")
+        now = 1_700_000_000
+
+        assert key.window(now, behind=1, ahead=1) == [
+            reference.at(now - 30), reference.at(now), reference.at(now + 30)
+        ]
+        assert key.verify(reference.at(now - 30), now, valid_window=1)
+        assert not key.verify(reference.at(now - 60), now, valid_window=1)
+
+        hotp = pyotp.HOTP("JBSWY3DPEHPK3PXP")
+        assert otp_engine.generate_codes([(key, 0), (key, 7)]) == [hotp.at(0), hotp.at(7)]
+
+        slow_key = otp_engine.OTPKey("JBSWY3DPEHPK3PXP", period=60)
+        assert slow_key.at(now) == pyotp.TOTP("JBSWY3DPEHPK3PXP", interval=60).at(now)
+
+        with pytest.raises(ValueError):
+            otp_engine.OTPKey("not base32!")
+
+    @pytest.mark.parametrize("update_returning", [True, False])
+    def test_hotp_counter_advance_is_atomic(self, tmp_path, update_returning):
+        """Concurrent HOTP requests never receive the same counter"""
+        import threading
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import crud, models
+
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'hotp.db'}",
+            connect_args={"check_same_thread": False, "timeout": 30}
+        )
+        # False exercises the UPDATE + SELECT ... FOR UPDATE fallback
+        engine.dialect.update_returning = update_returning
+        models.Base.metadata.create_all(bind=engine)
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        db = SessionLocal()
+        user = models.User(username="hotp", email="hotp@example.com", password_hash="x")
+        db.add(user)
+        db.commit()
+        app = models.Application(name="HOTP", secret="x", otp_type="HOTP", counter=0, user_id=user.id)
+        db.add(app)
+        db.commit()
+        app_id = app.id
+        db.close()
+
+        threads, per_thread = 8, 25
+        counters, errors = [], []
+        lock = threading.Lock()
+
+        def worker():
+            session = SessionLocal()
+            try:
+                for _ in range(per_thread):
+                    counter = crud.advance_hotp_counter(session, app_id)
+                    with lock:
+                        counters.append(counter)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                session.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        assert not errors
+        assert sorted(counters) == list(range(threads * per_thread))
+        db = SessionLocal()
+        assert db.get(models.Application, app_id).counter == threads * per_thread
+        assert crud.advance_hotp_counter(db, app_id + 1) is None
+        db.close()
+        engine.dispose()
+
+
+class TestCodeStream:
+    """Test the shared scheduler behind the code SSE stream"""
+
+    def test_scheduler_pushes_codes_at_period_boundary(self):
+        """Each subscription receives new codes when its accounts' period rolls over"""
+        import asyncio
+        import json
+        import pyotp
+        from app.code_stream import CodeStreamScheduler, StreamLimitExceeded
+
+        secret = "JBSWY3DPEHPK3PXP"
+
+        async def scenario():
+            scheduler = CodeStreamScheduler(max_per_user=2, max_total=10)
+            first = scheduler.subscribe(1, [(10, secret, 1), (11, secret, 2)])
+            second = scheduler.subscribe(1, [(12, secret, 1)])
+            with pytest.raises(StreamLimitExceeded):
+                scheduler.subscribe(1, [(13, secret, 1)])
+
+            event = await asyncio.wait_for(first.queue.get(), timeout=2.5)
+            other = await asyncio.wait_for(second.queue.get(), timeout=2.5)
+
+            scheduler.notify_user(1)
+            await asyncio.sleep(0)
+            resync = [second.queue.get_nowait() for _ in range(second.queue.qsize())][-1]
+
+            scheduler.unsubscribe(first)
+            scheduler.unsubscribe(second)
+            return event, other, resync, scheduler.stats()
+
+        event, other, resync, stats = asyncio.run(scenario())
+
+        assert event.startswith("event: codes\n")
+        payload = json.loads(event.split("data: ", 1)[1])
+        codes = {entry["id"]: entry for entry in payload["codes"]}
+        assert 10 in codes
+        assert codes[10]["code"] == pyotp.TOTP(secret, interval=1).at(payload["server_time"])
+        assert codes[10]["remaining_seconds"] == 1
+        assert "12" in other
+        assert resync.startswith("event: resync")
+        assert stats["streams"] == 0
+        assert stats["wakeups"] >= 1
+
+
+class TestHistoryWriter:
+    """Test the write-behind buffer for code generation history"""
+
+    def _count(self, session_factory):
+        from app import models
+
+        db = session_factory()
+        try:
+            return db.query(models.CodeGenerationHistory).count()
+        finally:
+            db.close()
+
+    def test_batches_and_flushes_on_stop(self, session_factory):
+        """Queued entries are bulk inserted and flushed when the writer stops"""
+        from app.history_writer import HistoryWriter
+
+        writer = HistoryWriter(session_factory=session_factory, batch_size=10, flush_interval_ms=50)
+        writer.start()
+        db = session_factory()
+        try:
+            assert writer.record_many(db, list(range(1, 26)), user_id=1, ip_address="127.0.0.1") == 25
+            assert writer.record(db, application_id=1, user_id=1)
+        finally:
+            db.close()
+        writer.stop()
+
+        assert not writer.running
+        assert self._count(session_factory) == 26
+        stats = writer.stats()
+        assert stats["written"] == 26
+        assert stats["queued"] == 0
+        assert stats["batches"] >= 3
+
+    def test_drop_policy_when_full(self, session_factory):
+        """A full queue drops entries instead of blocking the request"""
+        from app.history_writer import HistoryWriter
+
+        writer = HistoryWriter(session_factory=session_factory, max_queue_size=2, full_policy="drop")
+        # Pretend the thread is running without letting it drain the queue
+        writer._thread = type("Alive", (), {"is_alive": lambda self: True})()
+        db = session_factory()
+        try:
+            assert writer.record_many(db, [1, 2, 3], user_id=1) == 2
+        finally:
+            db.close()
+        assert writer.stats()["dropped"] == 1
+
+        writer._thread = None
+        assert writer.flush() == 2
+        assert self._count(session_factory) == 2
+
+    def test_writes_synchronously_when_not_running(self, session_factory):
+        """Without a background thread entries are committed with the caller's session"""
+        from app.history_writer import HistoryWriter
+
+        writer = HistoryWriter()
+        db = session_factory()
+        try:
+            assert writer.record(db, application_id=1, user_id=1)
+        finally:
+            db.close()
+        assert self._count(session_factory) == 1
@@ -0,0 +1,170 @@
+"""
+Tests for the audit log archive.
+"""
+
+import pytest
+from datetime import datetime, timedelta
+
+
+class TestAuditArchive:
+    """Test audit log retention into compressed archive segments"""
+
+    NOW = datetime(2026, 3, 31, 12, 0)
+
+    @pytest.fixture
+    def db(self, session_factory):
+        from app import models
+
+        db = session_factory()
+        # 3 rows per hour over 60 days for users 1-3, plus a few recent ones
+        start = self.NOW - timedelta(days=60)
+        db.add_all(
+            models.AuditLog(user_id=hour % 3 + 1, action="login_success" if hour % 2 else "login_failed",
+                            status="success", details={"hour": hour},
+                            created_at=start + timedelta(hours=hour, minutes=minute))
+            for hour in range(60 * 24) for minute in (0, 20, 40)
+        )
+        db.commit()
+        yield db
+        db.close()
+
+    @pytest.fixture
+    def archiver(self, tmp_path):
+        from app.audit_archive import AuditArchiver
+        return AuditArchiver(directory=str(tmp_path / "archive"), retention_days=30, chunk_size=500, block_rows=20)
+
+    def test_archive_moves_old_rows(self, db, archiver):
+        """Rows past retention end up in daily segments and leave the table"""
+        import gzip
+        import json
+        from app import models
+
+        cutoff = self.NOW - timedelta(days=30)
+        old = db.query(models.AuditLog).filter(models.AuditLog.created_at < cutoff).count()
+        total = db.query(models.AuditLog).count()
+        summary = archiver.archive(db, now=self.NOW)
+
+        assert summary["rows_archived"] == summary["rows_deleted"] == old
+        assert db.query(models.AuditLog).count() == total - old
+        assert db.query(models.AuditLog).filter(models.AuditLog.created_at < cutoff).count() == 0
+
+        indexes = archiver.indexes()
+        assert len(indexes) == 31  # 2026-01-30 (from noon) to 2026-03-01 (until noon)
+        assert sum(index["rows"] for index in indexes) == old
+        first = indexes[0]
+        assert first["day"] == "2026-01-30"
+        assert first["actions"] == ["login_failed", "login_success"]
+        assert (first["user_id_min"], first["user_id_max"]) == (1, 3)
+        assert first["start"] <= first["end"] < indexes[1]["start"]
+        # A segment is a valid gzip file of the rows, oldest first
+        with gzip.open(first["path"], "rt") as f:
+            rows = [json.loads(line) for line in f]
+        assert len(rows) == first["rows"] == 36
+        assert [row["created_at"] for row in rows] == sorted(row["created_at"] for row in rows)
+        assert rows[0]["details"] == {"hour": 0}
+
+    def test_search_reads_only_matching_blocks(self, db, archiver, monkeypatch):
+        """Searches skip segments and blocks by their index and page with cursors"""
+        import gzip
+        from app import audit_archive, models
+
+        start = datetime(2026, 2, 10, 7, 0)
+        end = datetime(2026, 2, 10, 9, 0)
+        expected = [row_id for (row_id,) in db.query(models.AuditLog.id).filter(
+            models.AuditLog.created_at.between(start, end), models.AuditLog.user_id == 2
+        ).order_by(models.AuditLog.created_at.desc())]
+        archiver.archive(db, now=self.NOW)
+        decompressed = []
+        real_decompress = gzip.decompress
+        monkeypatch.setattr(audit_archive.gzip, "decompress",
+                            lambda data: decompressed.append(len(data)) or real_decompress(data))
+
+        logs = archiver.search(start_date=start, end_date=end, user_id=2)
+        assert expected and [log["id"] for log in logs] == expected
+        assert len(decompressed) == 1  # one 20-row block (06:40-13:00) of one segment
+
+        # Paging across segments matches a single search
+        everything = archiver.search(user_id=1, action="login_failed", limit=10000)
+        paged, cursor = [], None
+        while True:
+            page = archiver.search(user_id=1, action="login_failed", limit=100, cursor=cursor)
+            paged.extend(page)
+            if len(page) < 100:
+                break
+            cursor = (page[-1]["created_at"], page[-1]["id"])
+        assert [log["id"] for log in paged] == [log["id"] for log in everything]
+        assert len(everything) == sum(1 for log in everything if log["created_at"] < self.NOW - timedelta(days=30))
+        assert everything[0]["created_at"] > everything[-1]["created_at"]
+
+    def test_search_merges_overlapping_segments(self, db, archiver):
+        """Segments that overlap in time still come back newest first"""
+        from app import models
+
+        archiver.archive(db, older_than_days=40, now=self.NOW)
+        # Rows written late with timestamps inside already archived days
+        db.add_all(models.AuditLog(user_id=1, action="login_success", status="success",
+                                   created_at=datetime(2026, 2, 5, hour, 10)) for hour in range(0, 24, 4))
+        db.commit()
+        archiver.archive(db, now=self.NOW)
+        day = [index for index in archiver.indexes() if index["day"] == "2026-02-05"]
+        assert len(day) == 2 and day[1]["start"] < day[0]["end"]
+
+        logs = archiver.search(user_id=1, limit=100000)
+        keys = [(log["created_at"], log["id"]) for log in logs]
+        assert keys == sorted(keys, reverse=True)
+        assert sum(1 for log in logs if log["created_at"].date() == datetime(2026, 2, 5).date()) == 24 + 6
+
+        # Paging through the merge matches the single search
+        paged, cursor = [], None
+        while True:
+            page = archiver.search(user_id=1, limit=50, cursor=cursor)
+            paged.extend(page)
+            if len(page) < 50:
+                break
+            cursor = (page[-1]["created_at"], page[-1]["id"])
+        assert [log["id"] for log in paged] == [log["id"] for log in logs]
+
+    def test_rerun_is_idempotent(self, db, archiver):
+        """Running again archives nothing twice; an interrupted delete is finished"""
+        from app import models
+
+        archiver.archive(db, now=self.NOW)
+        assert archiver.archive(db, now=self.NOW)["rows_archived"] == 0
+
+        # A row the previous run archived but did not delete
+        index = archiver.indexes()[5]
+        row = {key: value for key, value in archiver.search(start_date=datetime.fromisoformat(index["start"]),
+                                                             end_date=datetime.fromisoformat(index["end"]),
+                                                             limit=1)[0].items() if key != "details"}
+        db.add(models.AuditLog(**row))
+        db.commit()
+        summary = archiver.archive(db, now=self.NOW)
+        assert (summary["rows_archived"], summary["rows_deleted"]) == (0, 1)
+        assert len(archiver.indexes()) == 31
+
+        # The rest of a partly archived day goes into a second segment
+        summary = archiver.archive(db, now=self.NOW + timedelta(days=1))
+        assert summary["rows_archived"] == summary["rows_deleted"] == 72
+        assert len(archiver.indexes()) == 33
+        assert [index["rows"] for index in archiver.indexes() if index["day"] == "2026-03-01"] == [36, 36]
+
+    def test_admin_search_endpoint(self, db, archiver, monkeypatch):
+        """The admin search API returns archived rows and a next cursor"""
+        from fastapi.testclient import TestClient
+        from app import models
+        from app.main import app
+        from app.auth import get_current_user
+        from app.routers import admin
+
+        archiver.archive(db, now=self.NOW)
+        monkeypatch.setattr(admin, "audit_archiver", archiver)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user,
+                            lambda: models.User(id=99, email="a@example.com", role="admin"))
+        client = TestClient(app)
+        response = client.get("/api/admin/audit-archive/search",
+                              params={"user_id": 3, "start_date": "2026-02-01T00:00:00", "limit": 5})
+        assert response.status_code == 200
+        assert len(response.json()) == 5
+        assert all(log["user_id"] == 3 for log in response.json())
+        assert "X-Next-Cursor" in response.headers
+        assert client.get("/api/admin/audit-archive/search", params={"cursor": "!"}).status_code == 400
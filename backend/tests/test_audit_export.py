@@ -0,0 +1,169 @@
+"""
+Tests for the streaming audit log export.
+"""
+
+import pytest
+
+
+class TestAuditExport:
+    """Test the streaming audit log export"""
+
+    @pytest.fixture
+    def session_factory(self, session_factory):
+        """The shared session factory, with 500 audit rows"""
+        from app import models
+
+        db = session_factory()
+        user = models.User(email="export@example.com", username="export", role="user")
+        db.add(user)
+        db.commit()
+        db.add_all(models.AuditLog(user_id=user.id if i % 2 else None, action="login_success", status="success",
+                                   details={"i": i}) for i in range(500))
+        db.commit()
+        db.close()
+        return session_factory
+
+    @staticmethod
+    def _read(stream) -> bytes:
+        import anyio
+
+        async def consume():
+            return b"".join([chunk async for chunk in stream])
+        return anyio.run(consume)
+
+    def test_formats_and_single_query(self, session_factory):
+        """CSV and gzipped NDJSON carry the same rows, one joined query per batch"""
+        import csv
+        import gzip
+        import io
+        import json
+        from sqlalchemy import event
+        from app.audit_export import stream_export
+
+        db = session_factory()
+        statements = []
+        event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+        completions = []
+        body = self._read(stream_export(db, "csv", on_complete=lambda count, done: completions.append((count, done))))
+        assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
+        assert completions == [(500, True)]
+
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        assert rows[0][:3] == ["ID", "User ID", "User Email"]
+        assert len(rows) == 501
+        assert rows[1][2] == "export@example.com" and json.loads(rows[1][10]) == {"i": 499}
+
+        body = self._read(stream_export(session_factory(), "ndjson", compress=True, action="login_success", limit=10))
+        records = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+        assert [r["details"]["i"] for r in records] == list(range(499, 489, -1))
+
+    def test_rows_are_streamed_not_buffered(self, session_factory, monkeypatch):
+        """Output starts before all rows have been read"""
+        import anyio
+        from app import audit_export
+
+        monkeypatch.setattr(audit_export, "AUDIT_EXPORT_CHUNK_BYTES", 1024)
+        read = []
+        stream = audit_export.stream_export(session_factory(), "csv", batch_size=50,
+                                            on_complete=lambda count, done: read.append((count, done)))
+
+        async def first_chunk():
+            first = await stream.__anext__()
+            await stream.aclose()
+            return first
+
+        assert anyio.run(first_chunk).startswith(b"ID,")
+        assert read and read[0][0] < 100 and read[0][1] is False
+
+    def test_client_disconnect_ends_export(self, session_factory, monkeypatch):
+        """A disconnect mid-stream closes the export and logs it as interrupted"""
+        import anyio
+        from app import audit_export, models
+        from app.audit_writer import audit_writer
+        from app.auth import get_current_user
+        from app.database import get_db
+        from app.main import app
+        from app.rate_limit import limiter
+
+        def override_get_db():
+            session = session_factory()
+            try:
+                yield session
+            finally:
+                session.close()
+
+        monkeypatch.setattr(audit_export, "AUDIT_EXPORT_CHUNK_BYTES", 1024)
+        monkeypatch.setattr(limiter, "enabled", False)
+        monkeypatch.setattr(audit_writer, "is_sync", lambda action: True)
+        monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+        monkeypatch.setitem(app.dependency_overrides, get_current_user,
+                            lambda: models.User(id=1, email="export@example.com", role="admin"))
+        messages = []
+
+        async def export_then_disconnect():
+            disconnected = anyio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                messages.append(message)
+                if message["type"] == "http.response.body" and message.get("body"):
+                    disconnected.set()
+
+            path = "/api/admin/audit-logs/export"
+            with anyio.fail_after(10):
+                    await app({
+                    "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                    "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+                    "root_path": "", "headers": [(b"host", b"testserver")],
+                    "client": ("127.0.0.1", 50000), "server": ("testserver", 80)
+                }, receive, send)
+
+        anyio.run(export_then_disconnect)
+        assert messages[0]["status"] == 200
+        assert not any(message.get("more_body") is False for message in messages[1:])
+
+        db = session_factory()
+        entry = db.query(models.AuditLog).filter(models.AuditLog.action == "audit_logs_exported").one()
+        assert (entry.status, entry.reason) == ("failed", "Export interrupted")
+        assert 0 < entry.details["record_count"] < 500
+        db.close()
+
+    def test_writes_succeed_while_export_is_paused(self, tmp_path, monkeypatch):
+        """No read lock is held between chunks, so a SQLite file stays writable"""
+        import csv
+        import io
+        import anyio
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import audit_export, models
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}", connect_args={"check_same_thread": False})
+        writer = create_engine(f"sqlite:///{tmp_path / 'export.db'}", connect_args={"timeout": 0.2})
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add_all(models.AuditLog(action="login_success", status="success", details={"i": i}) for i in range(500))
+        db.commit()
+        db.close()
+        monkeypatch.setattr(audit_export, "AUDIT_EXPORT_CHUNK_BYTES", 1024)
+        stream = audit_export.stream_export(sessionmaker(bind=engine)(), "csv", batch_size=50)
+
+        async def export_with_pause():
+            chunks = [await stream.__anext__()]
+            # Client is slow: write from another connection mid-export
+            writes = sessionmaker(bind=writer)()
+            writes.add(models.AuditLog(action="login_failed", status="failed"))
+            writes.commit()
+            writes.close()
+            chunks.extend([chunk async for chunk in stream])
+            return b"".join(chunks)
+
+        try:
+            rows = list(csv.reader(io.StringIO(anyio.run(export_with_pause).decode())))
+            ids = [int(row[0]) for row in rows[1:]]
+            assert sorted(ids, reverse=True) == ids and set(ids) >= set(range(1, 501))
+        finally:
+            writer.dispose()
+            engine.dispose()
@@ -0,0 +1,173 @@
+"""
+Tests for audit log writing and pagination.
+"""
+
+import pytest
+import os
+
+
+class TestAuditWriter:
+    """Test the write-behind buffer for audit logs"""
+
+    @pytest.fixture
+    def monitored(self, monkeypatch):
+        from app import audit_writer, crud
+
+        events = []
+        feed = lambda record: events.append(record["action"])
+        monkeypatch.setattr(audit_writer, "feed_security_monitor", feed)
+        monkeypatch.setattr(crud, "feed_security_monitor", feed)
+        return events
+
+    def _actions(self, session_factory):
+        from app import models
+
+        db = session_factory()
+        try:
+            return sorted(action for (action,) in db.query(models.AuditLog.action))
+        finally:
+            db.close()
+
+    def test_async_records_are_batched_and_flushed_on_stop(self, session_factory, monitored, monkeypatch):
+        """Routine actions are queued; security-critical ones are written before returning"""
+        from app import crud
+        from app.audit_writer import AuditWriter
+
+        writer = AuditWriter(session_factory=session_factory, sync_actions={"account_locked"},
+                             batch_size=10, flush_interval_ms=60000)
+        monkeypatch.setattr(crud, "audit_writer", writer)
+        writer.start()
+        db = session_factory()
+        try:
+            for _ in range(3):
+                crud.create_audit_log(db, user_id=1, action="login_failed", ip_address="10.0.0.1")
+            crud.create_audit_log(db, user_id=1, action="account_locked", ip_address="10.0.0.1")
+            assert self._actions(session_factory) == ["account_locked"]
+            assert monitored == ["account_locked"]
+        finally:
+            db.close()
+        writer.stop()
+
+        assert self._actions(session_factory) == ["account_locked"] + ["login_failed"] * 3
+        assert monitored == ["account_locked"] + ["login_failed"] * 3
+        stats = writer.stats()
+        assert stats["written"] == 3
+        assert stats["written_sync"] == 1
+        assert stats["queued"] == 0
+
+    def test_full_queue_writes_synchronously(self, session_factory, monitored, monkeypatch):
+        """With the default policy a full queue never loses an audit record"""
+        from app import crud
+        from app.audit_writer import AuditWriter
+
+        writer = AuditWriter(session_factory=session_factory, sync_actions=(), max_queue_size=1)
+        # Pretend the thread is running without letting it drain the queue
+        writer._thread = type("Alive", (), {"is_alive": lambda self: True})()
+        monkeypatch.setattr(crud, "audit_writer", writer)
+        db = session_factory()
+        try:
+            crud.create_audit_log(db, action="first")
+            crud.create_audit_log(db, action="second")
+        finally:
+            db.close()
+        assert self._actions(session_factory) == ["second"]
+        assert writer.stats()["overflowed"] == 1
+
+        writer._thread = None
+        assert writer.flush() == 1
+        assert self._actions(session_factory) == ["first", "second"]
+
+
+class TestAuditLogPagination:
+    """Test keyset pagination of audit logs and the indexes behind it"""
+
+    FILTERS = [
+        ({}, "ix_audit_logs_created_at_id"),
+        ({"user_id": 3}, "ix_audit_logs_user_id_created_at"),
+        ({"action": "login_failed"}, "ix_audit_logs_action_created_at"),
+        ({"status": "failed"}, "ix_audit_logs_status_created_at"),
+    ]
+
+    def _captured_query(self, engine, db, **filters):
+        """SQL and parameters of crud.get_audit_logs for the filters"""
+        from datetime import datetime
+        from sqlalchemy import event
+        from app import crud
+
+        statements = []
+        capture = lambda conn, cursor, statement, parameters, context, many: statements.append((statement, parameters))
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            crud.get_audit_logs(db, limit=50, start_date=datetime(2025, 1, 1),
+                                cursor=(datetime(2026, 1, 1), 500), **filters)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        return statements[-1]
+
+    def test_cursor_pages_cover_every_row_once(self, session_factory):
+        """Pages continue after the cursor, including rows with equal timestamps"""
+        from datetime import datetime, timedelta
+        from app import crud, models
+        from app.pagination import decode_cursor, encode_cursor
+
+        db = session_factory()
+        start = datetime(2026, 1, 1)
+        # Three rows per timestamp so page boundaries fall between equal timestamps
+        db.add_all(models.AuditLog(action="login_success", status="success", user_id=1,
+                                   created_at=start + timedelta(seconds=i // 3)) for i in range(25))
+        db.commit()
+
+        seen, cursor = [], None
+        while True:
+            page = crud.get_audit_logs(db, user_id=1, limit=4, cursor=cursor)
+            seen.extend(log["id"] for log in page)
+            if len(page) < 4:
+                break
+            cursor = decode_cursor(encode_cursor(page[-1]["created_at"], page[-1]["id"]))
+
+        expected = [log.id for log in db.query(models.AuditLog).order_by(
+            models.AuditLog.created_at.desc(), models.AuditLog.id.desc())]
+        assert seen == expected
+        with pytest.raises(ValueError):
+            decode_cursor("not a cursor")
+        db.close()
+
+    def test_sqlite_plans_use_composite_indexes(self):
+        """Filtered, cursor-paginated queries search an index and never sort"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import models
+
+        engine = create_engine("sqlite://")
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        for filters, index in self.FILTERS:
+            statement, parameters = self._captured_query(engine, db, **filters)
+            with engine.connect() as conn:
+                plan = " | ".join(row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+            assert f"audit_logs USING INDEX {index}" in plan, plan
+            assert "TEMP B-TREE" not in plan, plan
+        db.close()
+
+    @pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set")
+    def test_postgresql_plans_use_composite_indexes(self):
+        """Same as the SQLite check, against the PostgreSQL planner"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import models
+
+        engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            for filters, index in self.FILTERS:
+                statement, parameters = self._captured_query(engine, db, **filters)
+                with engine.connect() as conn:
+                    # Empty test tables would otherwise always be scanned sequentially
+                    conn.exec_driver_sql("SET enable_seqscan = off")
+                    plan = " | ".join(row[0] for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters))
+                assert index in plan, plan
+                assert "Sort" not in plan, plan
+        finally:
+            db.close()
+            engine.dispose()
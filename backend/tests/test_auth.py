@@ -138,3 +138,77 @@ class TestAccountLockout:
             # Restore environment
             os.environ["MAX_FAILED_LOGIN_ATTEMPTS"] = original_max_attempts
             os.environ["ACCOUNT_LOCKOUT_MINUTES"] = original_lockout_minutes
+
+
+class TestLoginPipeline:
+    """Test the single-transaction login and its deferred side effects"""
+
+    def test_side_effects_run_only_after_commit(self, session_factory):
+        """Deferred callbacks are dropped on rollback and run once after commit"""
+        from app import models, side_effects
+
+        db = session_factory()
+        calls = []
+        db.add(models.User(email="rolled-back@example.com", username="rolled-back"))
+        db.flush()
+        side_effects.defer(db, calls.append, "rolled back")
+        db.rollback()
+        side_effects.defer(db, calls.append, "committed")
+        assert side_effects.dispatch(db) == 0
+        db.commit()
+        assert side_effects.dispatch(db) == 1
+        assert side_effects.dispatch(db) == 0
+        assert calls == ["committed"]
+        db.close()
+
+    def test_successful_login_commits_once(self, session_factory, monkeypatch):
+        """Session, audit log and notification are written in one commit"""
+        from fastapi.testclient import TestClient
+        from sqlalchemy import event
+        from app import auth, crud, models
+        from app.database import get_db
+        from app.main import app
+        from app.rate_limit import limiter
+
+        db = session_factory()
+        db.add(models.User(email="pipeline@example.com", username="pipeline", role="user",
+                           password_hash=auth.hash_password("Passw0rd!x"), is_sso_user=False,
+                           failed_login_attempts=2))
+        db.add(models.GlobalSettings(login_page_theme="light"))
+        db.commit()
+        db.close()
+
+        def override_get_db():
+            session = session_factory()
+            try:
+                yield session
+            finally:
+                session.close()
+
+        events = []
+        monkeypatch.setattr(crud, "feed_security_monitor", lambda record: events.append(record["action"]))
+        monkeypatch.setattr(limiter, "enabled", False)
+        monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+        engine = session_factory.kw["bind"]
+        commits = []
+        listener = lambda conn: commits.append(events[:])
+        event.listen(engine, "commit", listener)
+        try:
+            response = TestClient(app).post(
+                "/api/auth/login", json={"email": "pipeline@example.com", "password": "Passw0rd!x"}
+            )
+        finally:
+            event.remove(engine, "commit", listener)
+
+        assert response.status_code == 200
+        # The monitor heard about the login only after the single commit
+        assert commits == [[]]
+        assert events == ["login_success"]
+
+        db = session_factory()
+        user = db.query(models.User).one()
+        assert user.failed_login_attempts == 0
+        assert db.query(models.UserSession).filter_by(user_id=user.id).count() == 1
+        assert db.query(models.AuditLog).filter_by(action="login_success").count() == 1
+        assert db.query(models.InAppNotification).filter_by(user_id=user.id).count() == 1
+        db.close()
@@ -0,0 +1,89 @@
+"""
+Tests for the admin dashboard rollups.
+"""
+
+
+class TestDashboardRollups:
+    """Test the incrementally maintained counters behind the admin dashboard"""
+
+    def _rollups(self, db):
+        from app import models
+
+        return (
+            sorted((str(r.day), r.success_count, r.failure_count) for r in db.query(models.LoginDailyRollup)),
+            sorted((str(r.day), r.user_id, r.login_count) for r in db.query(models.UserLoginDailyRollup)),
+            sorted((r.category, r.account_count) for r in db.query(models.ApplicationCategoryRollup)
+                   if r.account_count)
+        )
+
+    def test_incremental_rollups_match_rebuild(self, session_factory, monkeypatch):
+        """Counters kept up to date by writes equal a full recomputation"""
+        from datetime import datetime, timedelta
+        from app import audit_writer, crud, models
+        from app.audit_writer import AuditWriter
+        from app.dashboard_rollups import rebuild
+
+        monkeypatch.setattr(audit_writer, "feed_security_monitor", lambda record: None)
+        monkeypatch.setattr(crud, "feed_security_monitor", lambda record: None)
+        db = session_factory()
+        users = [models.User(email=f"u{i}@example.com", username=f"u{i}", role="user") for i in range(3)]
+        db.add_all(users)
+        db.commit()
+
+        apps = [models.Application(name=f"A{i}", secret="s", user_id=users[i % 3].id,
+                                   category=["Work", "Personal", None][i % 3]) for i in range(9)]
+        db.add_all(apps)
+        db.commit()
+        apps[0].category = "Security"
+        db.delete(apps[1])
+        db.commit()
+        apps[2].category = "Work"  # attribute expired by the commit
+        db.commit()
+
+        # Written synchronously (writer not running) and in a background batch
+        crud.create_audit_log(db, user_id=users[0].id, action="login_success")
+        crud.create_audit_log(db, user_id=users[1].id, action="login_failed")
+        writer = AuditWriter(session_factory=session_factory)
+        yesterday = datetime.utcnow() - timedelta(days=1)
+        writer._write([
+            {"user_id": users[i % 3].id, "action": action, "created_at": yesterday, "details": None,
+             "resource_type": None, "resource_id": None, "ip_address": None, "user_agent": None,
+             "status": "success", "reason": None}
+            for i, action in enumerate(["login_success"] * 4 + ["login_failed"] * 2 + ["account_added"])
+        ])
+
+        incremental = self._rollups(db)
+        assert incremental[0][0][1:] == (4, 2)
+        assert incremental[2] == [("Personal", 4), ("Security", 1), ("Work", 3)]
+        rebuild(db)
+        assert self._rollups(db) == incremental
+        db.close()
+
+    def test_dashboard_stats_read_rollups_and_are_cached(self, session_factory):
+        """The endpoint payload is built from the rollups and reused within the TTL"""
+        from app import crud, models
+        from app.dashboard_rollups import DashboardCache
+
+        db = session_factory()
+        user = models.User(email="top@example.com", username="top", role="user", totp_enabled=True)
+        db.add(user)
+        db.commit()
+        db.add(models.Application(name="A", secret="s", user_id=user.id, category="Work"))
+        db.commit()
+        for _ in range(3):
+            crud.create_audit_log(db, user_id=user.id, action="login_success")
+
+        cache = DashboardCache(ttl_seconds=60)
+        stats = cache.get(db)
+        assert stats["total_users"] == 1
+        assert stats["two_fa_coverage_percent"] == 100.0
+        assert stats["total_accounts"] == 1
+        assert stats["recent_logins_7d"] == 3
+        assert stats["top_active_users"] == [{"email": "top@example.com", "login_count": 3}]
+        assert stats["account_distribution_by_category"] == [{"category": "Work", "count": 1}]
+        assert len(stats["recent_events"]) == 3
+
+        crud.create_audit_log(db, user_id=user.id, action="login_success")
+        assert cache.get(db) is stats
+        assert cache.stats()["hits"] == 1
+        db.close()
@@ -0,0 +1,107 @@
+"""
+Tests for rate limit storage and per-role rate limits.
+"""
+
+import pytest
+
+
+class TestRateLimitStorage:
+    """Test rate limit storage backends and progressive penalties"""
+
+    def test_sqlite_sliding_window_is_shared_between_workers(self, tmp_path):
+        """Two storages on one file (two workers) enforce a single limit"""
+        from limits import parse
+        from limits.strategies import SlidingWindowCounterRateLimiter
+        from app.rate_limit_storage import SQLiteStorage
+
+        uri = f"sqlite:///{tmp_path / 'ratelimit.db'}"
+        worker_a = SlidingWindowCounterRateLimiter(SQLiteStorage(uri))
+        worker_b = SlidingWindowCounterRateLimiter(SQLiteStorage(uri))
+        limit = parse("4/minute")
+
+        results = [limiter.hit(limit, "ip:1.2.3.4", "login") for limiter in (worker_a, worker_b) * 3]
+        assert results == [True, True, True, True, False, False]
+        assert worker_b.hit(limit, "ip:5.6.7.8", "login")
+
+    def test_sqlite_counters_expire(self, tmp_path, monkeypatch):
+        """Expired counters restart and idle keys are purged"""
+        from app import rate_limit_storage
+        from app.rate_limit_storage import SQLiteStorage
+
+        storage = SQLiteStorage(f"sqlite:///{tmp_path / 'ratelimit.db'}")
+        now = [1000.0]
+        monkeypatch.setattr(rate_limit_storage.time, "time", lambda: now[0])
+
+        assert storage.incr("idle", 10) == 1
+        assert storage.incr("idle", 10) == 2
+        assert storage.get_expiry("idle") == 1010.0
+
+        now[0] += 11
+        assert storage.get("idle") == 0
+        monkeypatch.setattr(rate_limit_storage, "SQLITE_PURGE_INTERVAL", 0)
+        assert storage.incr("other", 10) == 1
+        rows = storage._connection().execute("SELECT key FROM rate_limit_counters").fetchall()
+        assert rows == [("other",)]
+
+    def test_progressive_penalty_rejects_with_retry_after(self, monkeypatch):
+        """Repeated violations are rejected with a growing Retry-After instead of sleeping"""
+        from fastapi import HTTPException
+        from limits.storage import MemoryStorage
+        from app import rate_limit
+
+        monkeypatch.setattr(rate_limit, "violation_storage", MemoryStorage())
+        monkeypatch.setattr(rate_limit, "PROGRESSIVE_DELAY_BASE", 2)
+        monkeypatch.setattr(rate_limit, "PROGRESSIVE_DELAY_MAX", 5)
+
+        rate_limit.enforce_progressive_delay("ip:1.2.3.4", "login")
+        assert rate_limit.record_violation("ip:1.2.3.4", "login") == 2
+        assert rate_limit.record_violation("ip:1.2.3.4", "login") == 4
+        assert rate_limit.record_violation("ip:1.2.3.4", "login") == 5
+
+        with pytest.raises(HTTPException) as exc:
+            rate_limit.enforce_progressive_delay("ip:1.2.3.4", "login")
+        assert exc.value.status_code == 429
+        assert 1 <= int(exc.value.headers["Retry-After"]) <= 5
+        rate_limit.enforce_progressive_delay("ip:5.6.7.8", "login")
+
+
+class TestRoleRateLimits:
+    """Test precompiled per-role limits for authenticated requests"""
+
+    def test_limits_follow_the_role_claim(self):
+        """Each role gets its own limit; anonymous requests are not counted"""
+        import asyncio
+        from fastapi import Depends, FastAPI
+        from fastapi.testclient import TestClient
+        from app import auth, rate_limit
+
+        # Storage hits are blocking, so the dependency must run in the threadpool
+        assert not asyncio.iscoroutinefunction(rate_limit.enforce_role_rate_limits)
+        app = FastAPI(dependencies=[Depends(rate_limit.enforce_role_rate_limits)])
+
+        @app.get("/role-limited")
+        @rate_limit.limit_authenticated_api(user="2/minute", admin="4/minute")
+        def role_limited():
+            return {"ok": True}
+
+        rate_limit.compile_role_limits(app.routes)
+        compiled = rate_limit._endpoint_role_limits[role_limited]
+        assert str(compiled.for_role("admin")) == "4 per 1 minute"
+        assert compiled.for_role("auditor") is compiled.for_role("user")
+
+        client = TestClient(app)
+
+        def statuses(role, user_id, count):
+            token = auth.create_access_token({"sub": str(user_id), "role": role})
+            headers = {"Authorization": f"Bearer {token}"}
+            return [client.get("/role-limited", headers=headers).status_code for _ in range(count)]
+
+        assert statuses("user", 9001, 3) == [200, 200, 429]
+        assert statuses("admin", 9002, 5) == [200, 200, 200, 200, 429]
+        assert [client.get("/role-limited").status_code for _ in range(5)] == [200] * 5
+
+        response = client.get("/role-limited", headers={
+            "Authorization": f"Bearer {auth.create_access_token({'sub': '9001', 'role': 'user'})}"
+        })
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
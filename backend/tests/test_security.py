@@ -3,7 +3,9 @@ Tests for security features including access restrictions and rate limiting.
 """
 
 import pytest
+import os
 import time
+from datetime import datetime, timedelta
 
 
 class TestAccessRestrictions:
@@ -249,3 +251,873 @@ class TestSessionSecurity:
 
         # Should be suspicious because it's the first session with this fingerprint
         assert is_suspicious is True
+
+
+class TestSecretsEncryption:
+    """Test the cached secrets key ring"""
+
+    def test_key_ring_round_trip_and_batches(self):
+        """Test single and batch encryption through the key ring"""
+        from cryptography.fernet import Fernet
+        from app.secrets_encryption import KeyRing
+
+        ring = KeyRing([Fernet.generate_key().decode()])
+
+        token = ring.encrypt("JBSWY3DPEHPK3PXP")
+        assert token.startswith("a1:")
+        assert ring.decrypt(token) == "JBSWY3DPEHPK3PXP"
+
+        secrets = ["JBSWY3DPEHPK3PXP", "", "GEZDGNBVGY3TQOJQ"]
+        tokens = ring.encrypt_many(secrets)
+        assert tokens[1] == ""
+        assert ring.decrypt_many(tokens) == secrets
+
+    def test_key_ring_decrypts_with_previous_keys(self):
+        """Test that retired keys still decrypt and rotate to the primary key"""
+        from cryptography.fernet import Fernet
+        from app.secrets_encryption import KeyRing
+
+        old_key = Fernet.generate_key().decode()
+        new_key = Fernet.generate_key().decode()
+        old_token = KeyRing([old_key]).encrypt("JBSWY3DPEHPK3PXP")
+
+        ring = KeyRing([new_key, old_key])
+        assert ring.decrypt(old_token) == "JBSWY3DPEHPK3PXP"
+
+        rotated = ring.rotate(old_token)
+        assert KeyRing([new_key]).decrypt(rotated) == "JBSWY3DPEHPK3PXP"
+
+        # Tokens from unknown keys fail, or yield None when errors are ignored
+        with pytest.raises(ValueError):
+            KeyRing([new_key]).decrypt(old_token)
+        assert KeyRing([new_key]).decrypt_many([old_token], ignore_errors=True) == [None]
+
+    def test_compact_format_reads_legacy_fernet(self):
+        """AES-GCM tokens are compact, tamper-evident and legacy Fernet tokens stay readable"""
+        from cryptography.fernet import Fernet
+        from app.secrets_encryption import KeyRing
+
+        key = Fernet.generate_key().decode()
+        ring = KeyRing([key], secret_format="aead")
+        legacy_ring = KeyRing([key], secret_format="fernet")
+
+        token = ring.encrypt("JBSWY3DPEHPK3PXP")
+        legacy_token = legacy_ring.encrypt("JBSWY3DPEHPK3PXP")
+        assert (len(token), len(legacy_token)) == (62, 120)
+        assert ring.decrypt(legacy_token) == "JBSWY3DPEHPK3PXP"
+        assert legacy_ring.decrypt(token) == "JBSWY3DPEHPK3PXP"
+        assert ring.needs_reencryption(legacy_token) and not ring.needs_reencryption(token)
+        assert ring.rotate(legacy_token).startswith("a1:")
+
+        tampered = token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1]
+        with pytest.raises(ValueError):
+            ring.decrypt(tampered)
+
+        blob = ring.encrypt_bytes(b"JBSWY3DPEHPK3PXP")
+        assert blob[0] == 1 and len(blob) == 1 + 12 + 16 + 16
+        assert ring.decrypt_bytes(blob) == b"JBSWY3DPEHPK3PXP"
+        with pytest.raises(ValueError):
+            KeyRing([Fernet.generate_key().decode()]).decrypt_bytes(blob)
+
+    def test_reload_key_ring(self, monkeypatch):
+        """Test that the process-wide key ring is cached until reloaded"""
+        from cryptography.fernet import Fernet
+        from app import secrets_encryption
+
+        first_key = Fernet.generate_key().decode()
+        second_key = Fernet.generate_key().decode()
+
+        # Restore the original (unloaded) ring after the test
+        monkeypatch.setattr(secrets_encryption, "_key_ring", None)
+        monkeypatch.setenv("ENCRYPTION_KEY", first_key)
+        monkeypatch.delenv("PREVIOUS_ENCRYPTION_KEYS", raising=False)
+        ring = secrets_encryption.reload_key_ring()
+        assert secrets_encryption.get_key_ring() is ring
+        token = secrets_encryption.encrypt_secret("JBSWY3DPEHPK3PXP")
+
+        # Changing the environment alone does not affect the cached ring
+        monkeypatch.setenv("ENCRYPTION_KEY", second_key)
+        assert secrets_encryption.get_key_ring().primary_key == first_key
+
+        monkeypatch.setenv("PREVIOUS_ENCRYPTION_KEYS", first_key)
+        secrets_encryption.reload_key_ring()
+        assert secrets_encryption.get_key_ring().primary_key == second_key
+        assert secrets_encryption.decrypt_secret(token) == "JBSWY3DPEHPK3PXP"
+
+    def test_rotate_encryption_key_keeps_aead_format(self, monkeypatch):
+        """Rotated secrets are written in the configured format, not legacy Fernet"""
+        from cryptography.fernet import Fernet
+        from app import secrets_encryption
+        from app.secrets_encryption import AEAD_PREFIX, KeyRing
+
+        old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+        monkeypatch.setattr(secrets_encryption, "_key_ring", KeyRing([old_key], secret_format="aead"))
+        legacy = Fernet(old_key.encode()).encrypt(b"GEZDGNBVGY3TQOJQ").decode()
+        rotated = secrets_encryption.rotate_encryption_key(
+            [secrets_encryption.encrypt_secret("JBSWY3DPEHPK3PXP"), legacy, ""], new_key
+        )
+
+        assert all(token.startswith(AEAD_PREFIX) for token in rotated[:2])
+        assert rotated[2] == ""
+        new_ring = KeyRing([new_key])
+        assert [new_ring.decrypt(token) for token in rotated[:2]] == ["JBSWY3DPEHPK3PXP", "GEZDGNBVGY3TQOJQ"]
+
+
+class TestKeyRotation:
+    """Test the streaming key rotation engine"""
+
+    @pytest.fixture
+    def session_factory(self, tmp_path):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from app import models
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'rotation.db'}", connect_args={"check_same_thread": False})
+        models.Base.metadata.create_all(bind=engine)
+        yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        engine.dispose()
+
+    @staticmethod
+    def _new_key():
+        from cryptography.fernet import Fernet
+        return Fernet.generate_key().decode()
+
+    def _seed(self, session_factory, key, count):
+        from app import models
+        from app.secrets_encryption import KeyRing
+
+        ring = KeyRing([key])
+        db = session_factory()
+        user = models.User(username="rot", email="rot@example.com", totp_secret=ring.encrypt("USERSECRET"))
+        db.add(user)
+        db.commit()
+        for i in range(count):
+            db.add(models.Application(name=f"App {i}", secret=ring.encrypt(f"SECRET{i}"), user_id=user.id))
+        db.add(models.Application(name="Plain", secret="PLAINTEXTSECRET", user_id=user.id))
+        db.add(models.Application(name="Unknown", secret=KeyRing([self._new_key()]).encrypt("X"), user_id=user.id))
+        db.add(models.SMTPConfig(password=ring.encrypt("smtp-pass")))
+        db.commit()
+        db.close()
+
+    def test_rotates_all_columns_in_chunks(self, session_factory, tmp_path):
+        """Every encrypted column is re-encrypted chunk by chunk under the new key"""
+        from app import models
+        from app.key_rotation import KeyRotator, RotationTarget
+        from app.secrets_encryption import KeyRing
+
+        old_key, new_key = self._new_key(), self._new_key()
+        self._seed(session_factory, old_key, 10)
+        keys = [new_key, old_key]
+        targets = [
+            RotationTarget("applications.secret", models.Application, "secret", keys),
+            RotationTarget("users.totp_secret", models.User, "totp_secret", keys),
+            RotationTarget("smtp_config.password", models.SMTPConfig, "password", keys),
+        ]
+        checkpoint = tmp_path / "checkpoint.json"
+        results = KeyRotator(session_factory, chunk_size=3, workers=2, checkpoint_path=str(checkpoint)).run(targets)
+
+        apps = results[0]
+        assert (apps.rows, apps.rotated, apps.skipped, apps.failed, apps.chunks) == (12, 10, 1, 1, 4)
+        assert [r.rotated for r in results[1:]] == [1, 1]
+        assert apps.rows_per_second > 0
+        assert not checkpoint.exists()
+
+        new_ring = KeyRing([new_key])
+        db = session_factory()
+        secrets = [a.secret for a in db.query(models.Application).order_by(models.Application.id)]
+        assert new_ring.decrypt_many(secrets[:10]) == [f"SECRET{i}" for i in range(10)]
+        assert secrets[10] == "PLAINTEXTSECRET"
+        assert new_ring.decrypt(db.query(models.User).one().totp_secret) == "USERSECRET"
+        assert new_ring.decrypt(db.query(models.SMTPConfig).one().password) == "smtp-pass"
+        db.close()
+
+    def test_resumes_from_checkpoint(self, session_factory, tmp_path):
+        """A checkpoint written for the same new key skips already processed rows"""
+        import json
+        from app import models
+        from app.key_rotation import KeyRotator, RotationTarget, key_fingerprint
+        from app.secrets_encryption import KeyRing
+
+        old_key, new_key = self._new_key(), self._new_key()
+        self._seed(session_factory, old_key, 6)
+        checkpoint = tmp_path / "checkpoint.json"
+        checkpoint.write_text(json.dumps({
+            "key_fingerprint": key_fingerprint(new_key),
+            "positions": {"applications.secret": 4}
+        }))
+
+        target = RotationTarget("applications.secret", models.Application, "secret", [new_key, old_key])
+        stats = KeyRotator(session_factory, chunk_size=100, checkpoint_path=str(checkpoint)).run([target])[0]
+        assert stats.rotated == 2
+
+        db = session_factory()
+        secrets = [a.secret for a in db.query(models.Application).order_by(models.Application.id)]
+        db.close()
+        assert KeyRing([old_key]).decrypt_many(secrets[:4]) == [f"SECRET{i}" for i in range(4)]
+        assert KeyRing([new_key]).decrypt_many(secrets[4:6]) == ["SECRET4", "SECRET5"]
+
+
+class TestEnvelopeEncryption:
+    """Test per-user envelope encryption of application secrets"""
+
+    @pytest.fixture
+    def db(self, session_factory, monkeypatch):
+        from cryptography.fernet import Fernet
+        from app import models, secrets_encryption
+
+        master_key = Fernet.generate_key().decode()
+        monkeypatch.setattr(secrets_encryption, "_key_ring", secrets_encryption.KeyRing([master_key]))
+        session = session_factory()
+        session.add(models.User(username="env", email="env@example.com"))
+        session.commit()
+        session.info["master_key"] = master_key
+        yield session
+        session.close()
+
+    def test_secrets_use_wrapped_per_user_data_key(self, db):
+        """Secrets are encrypted with a data key stored wrapped by the master key"""
+        from app import envelope_encryption, models, secrets_encryption
+
+        user = db.query(models.User).one()
+        token = envelope_encryption.encrypt_for_user(db, user.id, "JBSWY3DPEHPK3PXP")
+        assert token.startswith("e2:")
+        assert secrets_encryption.is_encrypted(token)
+
+        db.refresh(user)
+        assert user.data_key.startswith("a1:")
+        data_key = secrets_encryption.decrypt_secret(user.data_key)
+        assert data_key not in token
+
+        # A fresh session (new request) unwraps the key again
+        envelope_encryption.clear_data_key_cache(db)
+        assert envelope_encryption.decrypt_for_user(db, user.id, token) == "JBSWY3DPEHPK3PXP"
+        assert user.id in db.info["envelope_data_keys"]
+
+    def test_new_data_key_joins_the_callers_transaction(self, db):
+        """Creating a data key does not commit the caller's pending changes"""
+        from app import envelope_encryption, models
+
+        user = db.query(models.User).one()
+        db.add(models.Application(name="Half built", user_id=user.id))
+        token = envelope_encryption.encrypt_for_user(db, user.id, "JBSWY3DPEHPK3PXP")
+        db.rollback()
+
+        assert db.query(models.Application).count() == 0
+        assert db.query(models.User.data_key).scalar() is None
+        assert "envelope_data_keys" not in db.info
+
+        token = envelope_encryption.encrypt_for_user(db, user.id, "JBSWY3DPEHPK3PXP")
+        db.add(models.Application(name="Built", user_id=user.id, secret=token))
+        db.commit()
+        envelope_encryption.clear_data_key_cache(db)
+        assert db.query(models.User.data_key).scalar()
+        assert envelope_encryption.decrypt_for_user(db, user.id, token) == "JBSWY3DPEHPK3PXP"
+
+    def test_legacy_secrets_migrate_on_read(self, db):
+        """Master-key tokens are decrypted and re-encrypted under the data key"""
+        from app import envelope_encryption, models, secrets_encryption
+
+        user = db.query(models.User).one()
+        legacy = models.Application(name="Legacy", user_id=user.id,
+                                    secret=secrets_encryption.encrypt_secret("GEZDGNBVGY3TQOJQ"))
+        broken = models.Application(name="Broken", user_id=user.id, secret="gAAAAABnot-a-token")
+        db.add_all([legacy, broken])
+        db.commit()
+
+        secrets = envelope_encryption.decrypt_application_secrets(db, [legacy, broken])
+        assert secrets == ["GEZDGNBVGY3TQOJQ", None]
+        db.refresh(legacy)
+        assert legacy.secret.startswith("e2:")
+        assert broken.secret == "gAAAAABnot-a-token"
+        assert envelope_encryption.decrypt_application_secret(db, legacy) == "GEZDGNBVGY3TQOJQ"
+
+    def test_fernet_envelope_secrets_upgrade_on_read(self, db, monkeypatch):
+        """Secrets in the older e1 (Fernet) envelope format are rewritten as e2"""
+        from app import envelope_encryption, models, secrets_encryption
+
+        user = db.query(models.User).one()
+        monkeypatch.setattr(secrets_encryption, "SECRET_FORMAT", "fernet")
+        app = models.Application(name="Old", user_id=user.id,
+                                 secret=envelope_encryption.encrypt_for_user(db, user.id, "JBSWY3DPEHPK3PXP"))
+        db.add(app)
+        db.commit()
+        assert app.secret.startswith("e1:")
+
+        monkeypatch.setattr(secrets_encryption, "SECRET_FORMAT", "aead")
+        assert envelope_encryption.decrypt_application_secret(db, app) == "JBSWY3DPEHPK3PXP"
+        db.refresh(app)
+        assert app.secret.startswith("e2:")
+        assert envelope_encryption.decrypt_for_user(db, user.id, app.secret) == "JBSWY3DPEHPK3PXP"
+
+    def test_master_key_rotation_rewraps_only_data_keys(self, db, monkeypatch):
+        """Rotating the master key leaves envelope-encrypted secrets untouched"""
+        from cryptography.fernet import Fernet
+        from sqlalchemy.orm import sessionmaker
+        from app import envelope_encryption, models, secrets_encryption
+        from app.key_rotation import KeyRotator, RotationTarget
+
+        user = db.query(models.User).one()
+        token = envelope_encryption.encrypt_for_user(db, user.id, "JBSWY3DPEHPK3PXP")
+        db.add(models.Application(name="App", user_id=user.id, secret=token))
+        db.commit()
+
+        old_key, new_key = db.info["master_key"], Fernet.generate_key().decode()
+        factory = sessionmaker(autocommit=False, autoflush=False, bind=db.get_bind())
+        data_keys, apps = KeyRotator(factory).run([
+            RotationTarget("users.data_key", models.User, "data_key", [new_key, old_key]),
+            RotationTarget("applications.secret", models.Application, "secret", [new_key, old_key]),
+        ])
+        assert (data_keys.rotated, apps.rotated, apps.skipped) == (1, 0, 1)
+
+        monkeypatch.setattr(secrets_encryption, "_key_ring", secrets_encryption.KeyRing([new_key]))
+        envelope_encryption.clear_data_key_cache(db)
+        db.expire_all()
+        app = db.query(models.Application).one()
+        assert app.secret == token
+        assert envelope_encryption.decrypt_for_user(db, user.id, app.secret) == "JBSWY3DPEHPK3PXP"
+
+
+class TestSecretCache:
+    """Test the decrypted secret cache"""
+
+    def test_hits_misses_and_ciphertext_change(self):
+        """Test that a changed ciphertext is never served from the cache"""
+        from app.secret_cache import SecretCache
+
+        cache = SecretCache(max_entries=10, ttl_seconds=60, enabled=True)
+        decrypt_calls = []
+
+        def decrypt(token):
+            decrypt_calls.append(token)
+            return "SECRET-" + token
+
+        assert cache.get_or_decrypt(1, "token-a", decrypt) == "SECRET-token-a"
+        assert cache.get_or_decrypt(1, "token-a", decrypt) == "SECRET-token-a"
+        assert decrypt_calls == ["token-a"]
+
+        # Same application, new ciphertext: must decrypt again
+        assert cache.get_or_decrypt(1, "token-b", decrypt) == "SECRET-token-b"
+        assert decrypt_calls == ["token-a", "token-b"]
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["size"] == 1
+
+    def test_eviction_zeroes_secret(self):
+        """Test LRU, TTL and explicit eviction zero the cached bytes"""
+        from app.secret_cache import SecretCache
+
+        cache = SecretCache(max_entries=2, ttl_seconds=60, enabled=True)
+        cache.put(1, "t1", "AAAA")
+        buffer = cache._entries[1].secret
+        cache.put(2, "t2", "BBBB")
+        cache.put(3, "t3", "CCCC")  # Evicts app 1 (least recently used)
+
+        assert cache.get(1, "t1") is None
+        assert buffer == bytearray(4)
+
+        buffer = cache._entries[2].secret
+        cache.invalidate(2)
+        assert cache.get(2, "t2") is None
+        assert buffer == bytearray(4)
+
+        expired = SecretCache(max_entries=2, ttl_seconds=0, enabled=True)
+        expired.put(1, "t1", "AAAA")
+        assert expired.get(1, "t1") is None
+
+    def test_disabled_cache_never_stores(self):
+        """Test that the cache is a pass-through unless enabled"""
+        from app.secret_cache import SecretCache
+
+        cache = SecretCache(enabled=False)
+        assert cache.get_or_decrypt(1, "token", lambda token: "plain") == "plain"
+        assert cache.stats()["size"] == 0
+
+    def test_key_ring_reload_clears_cache(self, monkeypatch):
+        """Test that reloading the key ring drops every cached secret"""
+        from cryptography.fernet import Fernet
+        from app import secrets_encryption
+        from app.secret_cache import secret_cache
+
+        monkeypatch.setattr(secrets_encryption, "_key_ring", None)
+        monkeypatch.setattr(secret_cache, "enabled", True)
+        monkeypatch.setenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+        secret_cache.put(42, "token", "JBSWY3DPEHPK3PXP")
+        secrets_encryption.reload_key_ring()
+        assert secret_cache.get(42, "token") is None
+
+
+class TestPrincipalCache:
+    """Test the cache of verified access tokens used by get_current_user"""
+
+    @pytest.fixture
+    def db(self, session_factory):
+        from app import models
+
+        session = session_factory()
+        session.add(models.User(username="principal", email="principal@example.com", role="user",
+                                settings={"theme": "light"}))
+        session.commit()
+        session.info["factory"] = session_factory
+        yield session
+        session.close()
+
+    def test_cached_principal_skips_token_decode_and_user_query(self, db, monkeypatch):
+        """A repeated token is neither decoded nor loaded from the database again"""
+        from sqlalchemy import event
+        from starlette.requests import Request
+        from fastapi.security import HTTPAuthorizationCredentials
+        from app import auth, models, principal_cache as module
+        from app.principal_cache import PrincipalCache
+
+        cache = PrincipalCache(max_entries=10, ttl_seconds=60, enabled=True)
+        monkeypatch.setattr(auth, "principal_cache", cache)
+        monkeypatch.setattr(module, "principal_cache", cache)
+        user = db.query(models.User).one()
+        token = auth.create_access_token({"sub": str(user.id)})
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+        def request():
+            return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+        first = auth.get_current_user(request(), credentials, db)
+        assert first.id == user.id
+
+        statements = []
+        event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+        monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: pytest.fail("token decoded twice"))
+
+        other_db = db.info["factory"]()
+        try:
+            cached = auth.get_current_user(request(), credentials, other_db)
+            assert cached.id == user.id and cached.email == "principal@example.com"
+            assert cached.settings == {"theme": "light"}
+            assert statements == []
+
+            # The attached user is a normal persistent instance
+            cached.settings = {"theme": "dark"}
+            other_db.commit()
+        finally:
+            other_db.close()
+        assert cache.stats()["hits"] == 1
+        # Changing the user invalidated its cached principal
+        assert cache.stats()["size"] == 0
+
+    def test_principals_are_invalidated_by_user_and_session_changes(self, db, monkeypatch):
+        """Role changes and revoked sessions drop cached principals once committed"""
+        from app import models, principal_cache as module
+        from app.principal_cache import Principal, PrincipalCache
+
+        cache = PrincipalCache(max_entries=10, ttl_seconds=60, enabled=True)
+        monkeypatch.setattr(module, "principal_cache", cache)
+        user = db.query(models.User).one()
+        cache.put("token-a", Principal(user.id, "jti-a", None))
+        cache.put("token-b", Principal(user.id, "jti-b", None))
+
+        assert cache.get("jti-a", "forged-token") is None
+
+        db.add(models.UserSession(user_id=user.id, token_jti="jti-a"))
+        db.commit()
+        session = db.query(models.UserSession).one()
+        session.revoked = True
+        db.flush()
+        assert cache.get("jti-a", "token-a") is not None
+        db.commit()
+        assert cache.get("jti-a", "token-a") is None
+        assert cache.get("jti-b", "token-b") is not None
+
+        user.role = "admin"
+        db.rollback()
+        user.role = "admin"
+        db.commit()
+        assert cache.get("jti-b", "token-b") is None
+
+    def test_entries_never_outlive_token_expiry(self):
+        """Test that an entry expires with its token even if the TTL is longer"""
+        import time
+        from app.principal_cache import Principal, PrincipalCache
+
+        cache = PrincipalCache(max_entries=10, ttl_seconds=3600, enabled=True)
+        cache.put("expired", Principal(1, "jti-expired", time.time() - 1))
+        cache.put("valid", Principal(1, "jti-valid", time.time() + 60))
+        assert cache.get("jti-expired", "expired") is None
+        assert cache.get("jti-valid", "valid").user_id == 1
+
+        cache.invalidate_user(1)
+        assert cache.stats()["size"] == 0
+
+
+class TestSessionRevocation:
+    """Test the in-memory index of revoked session tokens"""
+
+    @pytest.fixture
+    def db(self, session_factory):
+        from app import models
+
+        session = session_factory()
+        session.add(models.User(username="revoked", email="revoked@example.com"))
+        session.commit()
+        yield session
+        session.close()
+
+    def test_index_loads_revoked_unexpired_sessions(self, db):
+        """Only revoked sessions whose tokens are still valid are loaded"""
+        from datetime import datetime, timedelta
+        from app import models
+        from app.session_revocation import RevocationIndex
+
+        user = db.query(models.User).one()
+        later = datetime.utcnow() + timedelta(hours=1)
+        db.add_all([
+            models.UserSession(user_id=user.id, token_jti="revoked", expires_at=later, revoked=True),
+            models.UserSession(user_id=user.id, token_jti="active", expires_at=later, revoked=False),
+            models.UserSession(user_id=user.id, token_jti="expired", revoked=True,
+                               expires_at=datetime.utcnow() - timedelta(minutes=1)),
+        ])
+        db.commit()
+
+        index = RevocationIndex()
+        assert index.load(db) == 1
+        assert index.is_revoked("revoked")
+        assert not index.is_revoked("active")
+        assert not index.is_revoked("expired")
+
+        # Entries added locally survive a reload until their token expires
+        index.add("local", later)
+        index.add("stale", datetime.utcnow() - timedelta(seconds=1))
+        assert index.load(db) == 2
+        assert index.is_revoked("local")
+        assert "stale" not in index._revoked
+
+    def test_revoked_session_is_rejected_without_a_query(self, db, monkeypatch):
+        """get_current_user rejects a revoked token before touching the database"""
+        from datetime import datetime, timedelta
+        from fastapi import HTTPException
+        from fastapi.security import HTTPAuthorizationCredentials
+        from jose import jwt
+        from starlette.requests import Request
+        from app import auth, crud, models
+        from app.session_revocation import RevocationIndex
+
+        index = RevocationIndex()
+        monkeypatch.setattr(auth, "revocation_index", index)
+        monkeypatch.setattr(crud, "revocation_index", index)
+        user = db.query(models.User).one()
+        token = auth.create_access_token({"sub": str(user.id)})
+        jti = jwt.get_unverified_claims(token)["jti"]
+        session = crud.create_user_session(db, user.id, jti, expires_at=datetime.utcnow() + timedelta(days=1))
+
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        request = Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+        assert auth.get_current_user(request, credentials, db).id == user.id
+
+        crud.revoke_session(db, session.id)
+        request = Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+        with pytest.raises(HTTPException) as exc:
+            auth.get_current_user(request, credentials, None)
+        assert exc.value.status_code == 401
+        assert auth.get_request_principal(request) is None
+
+
+class TestPasswordHashing:
+    """Test the bounded Argon2 worker pool"""
+
+    def test_full_queue_is_rejected_immediately(self):
+        """Beyond workers + queue, callers fail fast instead of waiting"""
+        import threading
+        from app.password_hashing import PasswordHasher, PasswordHashingBusy
+
+        hasher = PasswordHasher(workers=1, queue_size=1)
+        release = threading.Event()
+        hasher.context = type("SlowContext", (), {"hash": staticmethod(lambda password: release.wait(5) and "h")})()
+        callers = [threading.Thread(target=hasher.hash, args=("pw",)) for _ in range(2)]
+        for caller in callers:
+            caller.start()
+        while hasher.stats()["in_flight"] < 2:
+            time.sleep(0.01)
+        try:
+            with pytest.raises(PasswordHashingBusy) as busy:
+                hasher.hash("pw")
+            assert busy.value.retry_after >= 1
+        finally:
+            release.set()
+            for caller in callers:
+                caller.join()
+            hasher.shutdown()
+
+        stats = hasher.stats()
+        assert stats["rejected"] == 1
+        assert stats["in_flight"] == 0
+        assert stats["operations"]["hash"]["count"] == 2
+        assert stats["operations"]["hash"]["queue_wait_max_ms"] > 0
+
+    def test_other_endpoints_respond_while_queue_is_full(self, session_factory, monkeypatch):
+        """Logins stuck on hashing leave request threads for unrelated endpoints"""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from fastapi.testclient import TestClient
+        from cryptography.fernet import Fernet
+        from app import auth, models, secrets_encryption
+        from app.database import get_db
+        from app.main import app
+        from app.password_hashing import PasswordHasher, configure_request_threadpool
+        from app.rate_limit import limiter
+
+        db = session_factory()
+        db.add(models.User(email="burst@example.com", username="burst", role="user",
+                           password_hash="$argon2id$stored", is_sso_user=False))
+        db.commit()
+        db.close()
+
+        def override_get_db():
+            session = session_factory()
+            try:
+                yield session
+            finally:
+                session.close()
+
+        # 8 request threads leave room for 2 callers on the hashing pool
+        hasher = PasswordHasher(workers=1, queue_size=32, max_threads=8 // 4)
+        assert (hasher.workers, hasher.queue_size) == (1, 1)
+        release = threading.Event()
+
+        def slow_verify(password, hashed):
+            release.wait(10)
+            return False, None
+
+        hasher.context = type("SlowContext", (), {"verify_and_update": staticmethod(slow_verify)})()
+        monkeypatch.setattr(auth, "password_hasher", hasher)
+        monkeypatch.setattr(limiter, "enabled", False)
+        monkeypatch.setitem(app.dependency_overrides, get_db, override_get_db)
+        # Startup loads the key ring; the test environment's ENCRYPTION_KEY is not a valid key
+        monkeypatch.setattr(secrets_encryption, "_key_ring", secrets_encryption.KeyRing([Fernet.generate_key().decode()]))
+
+        with TestClient(app) as client, ThreadPoolExecutor(max_workers=10) as callers:
+            client.portal.call(configure_request_threadpool, 8)
+            try:
+                logins = [callers.submit(client.post, "/api/auth/login",
+                                         json={"email": "burst@example.com", "password": "Passw0rd!x"})
+                          for _ in range(10)]
+                while hasher.stats()["in_flight"] < 2:
+                    time.sleep(0.01)
+                started = time.perf_counter()
+                response = callers.submit(client.get, "/api/auth/settings").result(timeout=5)
+                assert response.status_code == 200
+                assert time.perf_counter() - started < 5
+            finally:
+                release.set()
+                statuses = sorted(login.result(timeout=10).status_code for login in logins)
+                client.portal.call(configure_request_threadpool)
+                hasher.shutdown()
+        assert statuses.count(503) == 8
+
+    def test_hash_is_upgraded_when_parameters_change(self):
+        """A hash made with old Argon2 parameters is replaced on verification"""
+        from app.password_hashing import PasswordHasher, build_context
+
+        old = PasswordHasher(workers=1, queue_size=0, context=build_context(time_cost=1, memory_cost=1024, parallelism=1))
+        new = PasswordHasher(workers=1, queue_size=0, context=build_context(time_cost=2, memory_cost=1024, parallelism=1))
+        try:
+            stored = old.hash("Passw0rd!x")
+            assert new.verify_and_update("wrong", stored) == (False, None)
+
+            valid, upgraded = new.verify_and_update("Passw0rd!x", stored)
+            assert valid is True
+            assert upgraded and "t=2" in upgraded
+            assert new.verify_and_update("Passw0rd!x", upgraded) == (True, None)
+        finally:
+            old.shutdown()
+            new.shutdown()
+
+
+class TestSecurityMonitorCounters:
+    """Test the bucketed counters behind brute-force detection"""
+
+    def test_ring_counter_slides_with_time(self):
+        """Events leave the count once their bucket falls out of the window"""
+        from app.security_monitor import RingCounter
+
+        counter = RingCounter(60, 12)
+        assert counter.add(1000.0) == 1
+        assert counter.add(1001.0, amount=2) == 3
+        assert counter.add(1030.0) == 4
+        assert counter.count(1059.0) == 4
+        assert counter.count(1061.0) == 1
+        assert counter.count(5000.0) == 0
+        assert counter.add(5000.0) == 1
+
+    def test_alerts_per_ip_and_per_user(self):
+        """Failures are counted per IP and per user, under concurrent updates"""
+        import threading
+        from app.security_monitor import SecurityMonitor
+
+        monitor = SecurityMonitor()
+        monitor.BRUTE_FORCE_THRESHOLD = 1000
+        now = 1000.0
+
+        def attack(index):
+            for i in range(250):
+                monitor._record_event('login_failed', 1000 + i, '10.0.0.1', now)
+
+        threads = [threading.Thread(target=attack, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert monitor.failed_by_ip['10.0.0.1'].count(now) == 1000
+
+        alerts = dict(monitor._record_event('login_failed', 7, '10.0.0.1', now))
+        assert alerts['brute_force_attack']['failed_attempts'] == 1001
+        assert 'multiple_user_failures' not in alerts
+        monitor._record_event('login_failed', 7, '10.0.0.2', now)
+        alerts = dict(monitor._record_event('login_failed', 7, '10.0.0.3', now))
+        assert alerts['multiple_user_failures']['failed_attempts'] == 3
+        assert alerts['unusual_login_pattern']['unique_ips'] == 3
+        assert alerts['unusual_login_pattern']['total_logins'] == 3
+
+        # One account hit from many addresses keeps only threshold IPs
+        for i in range(10000):
+            monitor._record_event('login_failed', 8, f'172.16.{i // 256}.{i % 256}', now + i * 0.1)
+        logins = monitor.login_ips_by_user[8]
+        assert len(logins.ips) == monitor.UNUSUAL_IP_THRESHOLD
+        assert next(reversed(logins.ips)) == '172.16.39.15'
+        assert logins.logins.count(now + 1000) == 10000
+        logins.expire(now + 1000 + 3600)
+        assert not logins.ips
+
+        # Idle IPs and users are forgotten by the periodic sweep
+        monitor.failed_by_ip['10.0.0.9'] = type(monitor.failed_by_ip['10.0.0.1'])(60, 12)
+        monitor._analyze_patterns()
+        assert '10.0.0.9' not in monitor.failed_by_ip
+
+
+class TestCompiledIPRanges:
+    """Test the compiled CIDR matcher used by IP restrictions"""
+
+    def test_matches_like_a_linear_scan(self):
+        """The most specific containing range is found for IPv4 and IPv6"""
+        import ipaddress
+        import random
+        from app.access_restrictions import CompiledRanges
+
+        rng = random.Random(19)
+        cidrs = ["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "2001:db8::/32", "2001:db8:1::/48", "not-a-cidr"]
+        cidrs += [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/{rng.choice([16, 20, 24, 28])}"
+                  for _ in range(2000)]
+        ranges = CompiledRanges(cidrs)
+        assert ranges.size == len(cidrs) - 1
+
+        networks = [ipaddress.ip_network(c, strict=False) for c in cidrs if c != "not-a-cidr"]
+        probes = ["10.1.2.3", "10.1.9.9", "10.200.0.1", "11.0.0.1", "2001:db8:1::5", "2001:db8:2::5", "::1"]
+        probes += [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+                   for _ in range(500)]
+        for probe in probes:
+            ip = ipaddress.ip_address(probe)
+            containing = [n for n in networks if ip in n]
+            match = ranges.match(ip)
+            if not containing:
+                assert match is None
+            else:
+                assert ipaddress.ip_network(match, strict=False).prefixlen == max(n.prefixlen for n in containing)
+
+        assert ranges.match(ipaddress.ip_address("10.1.2.3")) == "10.1.2.0/24"
+        assert ranges.match(ipaddress.ip_address("2001:db8:2::5")) == "2001:db8::/32"
+
+    def test_compiled_once_per_settings_version(self):
+        """Ranges are recompiled only when the settings version changes"""
+        from app.access_restrictions import AccessRestrictions
+
+        restrictions = AccessRestrictions()
+        settings = type('Settings', (), {
+            'id': 1, 'version': 1, 'ip_restrictions_enabled': True,
+            'allowed_ip_ranges': [], 'blocked_ip_ranges': ["10.0.0.0/8"]
+        })()
+        first = restrictions.compiled_ranges(settings)
+        assert restrictions.check_ip_restrictions("10.5.5.5", settings)[0] is False
+        assert restrictions.compiled_ranges(settings) is first
+
+        settings.blocked_ip_ranges = []
+        settings.version = 2
+        assert restrictions.compiled_ranges(settings) is not first
+        assert restrictions.check_ip_restrictions("10.5.5.5", settings) == (True, None)
+
+
+class TestGeoIP:
+    """Test the offline memory-mapped GeoIP database"""
+
+    def test_import_and_lookup(self, tmp_path):
+        """CSV ranges in both layouts are imported and found by binary search"""
+        from app.geoip import GeoIPDatabase, import_csv
+
+        csv_file = tmp_path / "ranges.csv"
+        csv_file.write_text(
+            "ip_start,ip_end,country\n"
+            "1.0.0.0,1.0.0.255,AU\n"
+            "16777472,16778239,CN\n"  # 1.0.1.0 - 1.0.3.255 as integers
+            "8.8.8.0/24,US\n"
+            "8.0.0.0,8.255.255.255,US\n"
+            "9.0.0.0,9.0.0.255,-\n"
+            "2001:4860::,2001:4860:ffff:ffff:ffff:ffff:ffff:ffff,US\n"
+            "2a00:1450::/32,IE\n"
+        )
+        path = str(tmp_path / "geoip.bin")
+        assert import_csv(str(csv_file), path) == {"ipv4_ranges": 3, "ipv6_ranges": 2}
+
+        database = GeoIPDatabase(path)
+        try:
+            assert database.lookup("1.0.0.1") == "AU"
+            assert database.lookup("1.0.2.9") == "CN"
+            assert database.lookup("8.8.8.8") == "US"
+            assert database.lookup("8.200.1.1") == "US"
+            assert database.lookup("9.0.0.1") is None
+            assert database.lookup("0.0.0.1") is None
+            assert database.lookup("2001:4860::8888") == "US"
+            assert database.lookup("2a00:1450:4001::1") == "IE"
+            assert database.lookup("::1") is None
+            assert database.lookup("not-an-ip") is None
+        finally:
+            database.close()
+
+    def test_provider_caches_and_is_bounded(self, tmp_path):
+        """Lookups go through a bounded LRU; a missing database fails open"""
+        from app.geoip import GeoIPProvider, build_database
+
+        path = str(tmp_path / "geoip.bin")
+        build_database([(4, 0x0A000000, 0x0AFFFFFF, "NL"), (4, 0x0A010000, 0x0A01FFFF, "BE")], path)
+        provider = GeoIPProvider(path=path, cache_size=2, online_fallback=False)
+
+        assert provider.country_code("10.0.0.1") == "NL"
+        assert provider.country_code("10.1.0.1") == "BE"
+        assert provider.country_code("10.0.0.1") == "NL"
+        provider.country_code("10.2.0.1")
+        stats = provider.stats()
+        assert stats["hits"] == 1
+        assert stats["cache_size"] == 2
+        assert stats["ipv4_ranges"] == 3
+
+        missing = GeoIPProvider(path=str(tmp_path / "missing.bin"), online_fallback=False)
+        assert missing.country_code("10.0.0.1") is None
+
+    def test_restrictions_without_database(self, tmp_path, monkeypatch):
+        """Without a database, lookups stay online by default; with no fallback the gap is reported"""
+        from types import SimpleNamespace
+        from app.access_restrictions import AccessRestrictions
+        from app.geoip import GeoIPProvider, geo_restrictions_problem
+
+        settings = SimpleNamespace(geo_restrictions_enabled=True, blocked_countries=["RU"], allowed_countries=[])
+        upgraded = GeoIPProvider(path=str(tmp_path / "missing.bin"))
+        assert upgraded.online_fallback is True
+        monkeypatch.setattr(upgraded, "_lookup_online", lambda ip: "RU")
+        assert upgraded.country_code("203.0.113.7") == "RU"
+        assert geo_restrictions_problem(settings, upgraded) is None
+
+        restrictions = AccessRestrictions()
+        restrictions.geoip = upgraded
+        assert restrictions.check_geo_restrictions("203.0.113.7", settings)[0] is False
+
+        offline = GeoIPProvider(path=str(tmp_path / "missing.bin"), online_fallback=False)
+        assert "no GeoIP database" in geo_restrictions_problem(settings, offline)
+        assert geo_restrictions_problem(SimpleNamespace(geo_restrictions_enabled=True, blocked_countries=[],
+                                                        allowed_countries=None), offline) is None
@@ -0,0 +1,78 @@
+"""
+Tests for the in-process settings cache.
+"""
+
+import pytest
+import time
+
+
+class TestSettingsCache:
+    """Test the versioned in-process cache of settings rows"""
+
+    def test_snapshot_is_read_only(self, session_factory):
+        """Snapshots are detached copies that cannot be modified"""
+        from app import crud
+        from app.settings_cache import SettingsCache
+
+        SessionLocal = session_factory
+        db = SessionLocal()
+        cache = SettingsCache(poll_seconds=60)
+        row = crud.get_global_settings(db)
+        row.blocked_ip_ranges = ["10.0.0.0/8"]
+        db.commit()
+
+        snapshot = cache.get(db, type(row), crud.get_global_settings)
+        assert snapshot.blocked_ip_ranges == ("10.0.0.0/8",)
+        assert snapshot.version == row.version
+        with pytest.raises(AttributeError):
+            snapshot.signup_enabled = False
+        assert cache.get(db, type(row), crud.get_global_settings) is snapshot
+        db.close()
+
+    def test_update_invalidates_local_snapshot(self, session_factory):
+        """Updating through crud is visible to the next read in this process"""
+        from app import crud
+        from app.settings_cache import settings_cache
+
+        SessionLocal = session_factory
+        db = SessionLocal()
+        assert crud.get_global_settings_snapshot(db).signup_enabled is True
+        crud.update_global_settings(db, {"signup_enabled": False})
+        assert crud.get_global_settings_snapshot(db).signup_enabled is False
+
+        before = crud.get_oidc_config_snapshot(db)
+        crud.update_password_policy(db, {"min_length": 20})
+        assert crud.get_password_policy_snapshot(db).min_length == 20
+        assert crud.get_oidc_config_snapshot(db) is before
+        assert settings_cache.stats()["invalidations"] >= 2
+        db.close()
+
+    def test_poll_picks_up_changes_from_other_workers(self, session_factory):
+        """A version bump made elsewhere is noticed after the poll interval"""
+        from app import crud, models
+        from app.settings_cache import SettingsCache
+
+        SessionLocal = session_factory
+        db = SessionLocal()
+        cache = SettingsCache(poll_seconds=0.05)
+        assert cache.get(db, models.OIDCConfig, crud.get_oidc_config).enabled is False
+
+        # Another worker: writes the row without touching this cache
+        other = SessionLocal()
+        row = other.query(models.OIDCConfig).first()
+        row.enabled = True
+        row.version += 1
+        other.commit()
+        other.close()
+
+        assert cache.get(db, models.OIDCConfig, crud.get_oidc_config).enabled is False
+        time.sleep(0.06)
+        db.expire_all()
+        assert cache.get(db, models.OIDCConfig, crud.get_oidc_config).enabled is True
+        time.sleep(0.06)
+        cache.get(db, models.OIDCConfig, crud.get_oidc_config)
+        stats = cache.stats()
+        assert stats["reloads"] == 2
+        assert stats["polls"] == 1
+        assert stats["hits"] == 1
+        db.close()
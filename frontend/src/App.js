@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import Auth from './Auth';
 import MainLayout from './layouts/MainLayout';
@@ -226,16 +226,34 @@ const App = () => {
     }
   }, []);
 
+  // Fetch TOTP codes for many accounts in a single request
+  const fetchTotpCodes = useCallback(async (appIds) => {
+    const newCodes = {};
+    try {
+      const params = new URLSearchParams();
+      appIds.forEach(appId => params.append('ids', appId));
+      const response = await axios.get(`/api/applications/codes?${params.toString()}`);
+      response.data.codes.forEach(entry => {
+        newCodes[entry.id] = entry.code.toString().replace(/(\d{3})(\d{3})/, '$1 $2');
+      });
+    } catch (error) {
+      console.error('Failed to fetch codes:', error);
+    }
+    return newCodes;
+  }, []);
+
   // Fetch codes for all accounts
   const fetchAllCodes = useCallback(async (appIds) => {
-    const newCodes = {};
+    const newCodes = await fetchTotpCodes(appIds);
+    // HOTP accounts are not part of the batch response; fetch those individually
+    const missingIds = appIds.filter(appId => !(appId in newCodes));
     await Promise.all(
-      appIds.map(async (appId) => {
+      missingIds.map(async (appId) => {
         newCodes[appId] = await fetchCode(appId);
       })
     );
     return newCodes;
-  }, [fetchCode]);
+  }, [fetchCode, fetchTotpCodes]);
 
   const loadUserData = useCallback(async () => {
     try {
@@ -308,6 +326,98 @@ const App = () => {
     return () => window.removeEventListener('resize', handleResize);
   }, []);
 
+  // Live code stream (Server-Sent Events). While it is connected the server
+  // pushes new codes at each period boundary and the timer below only counts down.
+  const codeStreamActive = useRef(false);
+  const hasAccounts = accounts.length > 0;
+
+  useEffect(() => {
+    if (!isAuthenticated || !hasAccounts || !window.fetch || !window.TextDecoder) {
+      return undefined;
+    }
+
+    const controller = new AbortController();
+    let retryTimer = null;
+
+    const applyCodes = (payload) => {
+      const newCodes = {};
+      payload.codes.forEach(entry => {
+        newCodes[entry.id] = entry.code.toString().replace(/(\d{3})(\d{3})/, '$1 $2');
+      });
+      setCodes(prevCodes => ({ ...prevCodes, ...newCodes }));
+    };
+
+    const connect = async () => {
+      let reconnectDelay = 5000;
+      try {
+        const response = await fetch('/api/applications/codes/stream', {
+          headers: {
+            Authorization: `Bearer ${localStorage.getItem('token')}`,
+            Accept: 'text/event-stream'
+          },
+          signal: controller.signal
+        });
+        if (!response.ok || !response.body) {
+          // 429: too many open streams (e.g. other tabs) - keep polling instead
+          if (response.status === 429 || response.status === 401) {
+            return;
+          }
+          throw new Error(`Code stream failed with status ${response.status}`);
+        }
+
+        codeStreamActive.current = true;
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) {
+            break;
+          }
+          buffer += decoder.decode(value, { stream: true });
+          let separator = buffer.indexOf('\n\n');
+          while (separator !== -1) {
+            const message = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+            separator = buffer.indexOf('\n\n');
+
+            let event = 'message';
+            let data = '';
+            message.split('\n').forEach(line => {
+              if (line.startsWith('event: ')) {
+                event = line.slice(7);
+              } else if (line.startsWith('data: ')) {
+                data += line.slice(6);
+              }
+            });
+            if (event === 'codes' && data) {
+              applyCodes(JSON.parse(data));
+            }
+          }
+        }
+        // Server closed the stream (resync / maximum duration): reconnect right away
+        reconnectDelay = 0;
+      } catch (error) {
+        if (controller.signal.aborted) {
+          return;
+        }
+        console.error('Code stream disconnected:', error);
+      } finally {
+        codeStreamActive.current = false;
+      }
+      if (!controller.signal.aborted) {
+        retryTimer = setTimeout(connect, reconnectDelay);
+      }
+    };
+
+    connect();
+    return () => {
+      controller.abort();
+      clearTimeout(retryTimer);
+      codeStreamActive.current = false;
+    };
+  }, [isAuthenticated, hasAccounts]);
+
   useEffect(() => {
     const updateTimers = async () => {
       const now = Math.floor(Date.now() / 1000);
@@ -331,21 +441,16 @@ const App = () => {
       setTimers(newTimers);
       setProgresses(newProgresses);
       
-      // Fetch new codes for expired timers
-      if (expiredIds.length > 0) {
-        const newCodes = { ...codes };
-        await Promise.all(
-          expiredIds.map(async (id) => {
-            newCodes[id] = await fetchCode(parseInt(id));
-          })
-        );
-        setCodes(newCodes);
+      // Fetch new codes for expired timers (unless the code stream pushes them)
+      if (expiredIds.length > 0 && !codeStreamActive.current) {
+        const refreshedCodes = await fetchTotpCodes(expiredIds.map(id => parseInt(id)));
+        setCodes({ ...codes, ...refreshedCodes });
       }
     };
 
     const interval = setInterval(updateTimers, 1000);
     return () => clearInterval(interval);
-  }, [timers, codes, fetchCode]);
+  }, [timers, codes, fetchTotpCodes]);
 
   const logout = () => {
     localStorage.removeItem('token');
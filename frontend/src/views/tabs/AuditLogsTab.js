@@ -10,8 +10,11 @@ const AuditLogsTab = ({ appSettings, currentUser }) => {
     action: '',
     status: '',
     limit: 50,
-    offset: 0
+    cursor: ''
   });
+  // Cursors of the pages before the current one, and of the next (older) page
+  const [previousCursors, setPreviousCursors] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [toast, setToast] = useState(null);
 
   // Theme-aware colors
@@ -40,10 +43,11 @@ const AuditLogsTab = ({ appSettings, currentUser }) => {
       if (auditLogsFilter.action) params.action = auditLogsFilter.action;
       if (auditLogsFilter.status) params.status = auditLogsFilter.status;
       if (auditLogsFilter.limit) params.limit = auditLogsFilter.limit;
-      if (auditLogsFilter.offset) params.offset = auditLogsFilter.offset;
+      if (auditLogsFilter.cursor) params.cursor = auditLogsFilter.cursor;
 
       const response = await axios.get('/api/admin/audit-logs', { params });
       setAuditLogs(response.data || []);
+      setNextCursor(response.headers['x-next-cursor'] || null);
       showToast('Audit logs loaded', 'success');
     } catch (error) {
       console.error('Failed to fetch audit logs:', error);
@@ -61,8 +65,19 @@ const AuditLogsTab = ({ appSettings, currentUser }) => {
     setAuditLogsFilter(prev => ({
       ...prev,
       [field]: value,
-      offset: field !== 'offset' ? 0 : value
+      cursor: ''
     }));
+    setPreviousCursors([]);
+  };
+
+  const handleOlderPage = () => {
+    setPreviousCursors(prev => [...prev, auditLogsFilter.cursor]);
+    setAuditLogsFilter(prev => ({ ...prev, cursor: nextCursor }));
+  };
+
+  const handleNewerPage = () => {
+    setAuditLogsFilter(prev => ({ ...prev, cursor: previousCursors[previousCursors.length - 1] }));
+    setPreviousCursors(prev => prev.slice(0, -1));
   };
 
   const handleExportAuditLogs = async () => {
@@ -387,6 +402,49 @@ const AuditLogsTab = ({ appSettings, currentUser }) => {
           )}
         </div>
 
+        {/* Pagination: pages are fetched by cursor (X-Next-Cursor), newest first */}
+        {(previousCursors.length > 0 || nextCursor) && (
+          <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginTop: '12px' }}>
+            <button
+              onClick={handleNewerPage}
+              disabled={auditLogsLoading || previousCursors.length === 0}
+              style={{
+                padding: '6px 12px',
+                backgroundColor: colors.background,
+                color: colors.primary,
+                border: `1px solid ${colors.border}`,
+                borderRadius: '6px',
+                cursor: auditLogsLoading || previousCursors.length === 0 ? 'not-allowed' : 'pointer',
+                fontSize: '13px',
+                opacity: auditLogsLoading || previousCursors.length === 0 ? 0.6 : 1
+              }}
+            >
+              <i className="fas fa-chevron-left" style={{ marginRight: '6px' }}></i>
+              Newer
+            </button>
+            <span style={{ color: colors.secondary, fontSize: '13px' }}>
+              Page {previousCursors.length + 1}
+            </span>
+            <button
+              onClick={handleOlderPage}
+              disabled={auditLogsLoading || !nextCursor}
+              style={{
+                padding: '6px 12px',
+                backgroundColor: colors.background,
+                color: colors.primary,
+                border: `1px solid ${colors.border}`,
+                borderRadius: '6px',
+                cursor: auditLogsLoading || !nextCursor ? 'not-allowed' : 'pointer',
+                fontSize: '13px',
+                opacity: auditLogsLoading || !nextCursor ? 0.6 : 1
+              }}
+            >
+              Older
+              <i className="fas fa-chevron-right" style={{ marginLeft: '6px' }}></i>
+            </button>
+          </div>
+        )}
+
         {/* Audit Log Detail Modal */}
         {selectedAuditLog && (
           <div